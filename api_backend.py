@@ -0,0 +1,244 @@
+import time
+
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+
+import lrig.limb_stretch_node as limb_stretch_node
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+# DAG node types, everything else in a plan goes through the DG modifier
+DAG_TYPES = ['transform', 'joint', 'nurbsCurve', 'locator']
+FORMS = {0: om.MFnNurbsCurve.kOpen, 1: om.MFnNurbsCurve.kClosed,
+         2: om.MFnNurbsCurve.kPeriodic}
+
+
+def _plug(name):
+    sel = om.MSelectionList()
+    sel.add(name)
+    return sel.getPlug(0)
+
+
+def _node(name):
+    sel = om.MSelectionList()
+    sel.add(name)
+    return sel.getDependNode(0)
+
+
+def _curve_data(spec):
+    data = om.MFnNurbsCurveData().create()
+    om.MFnNurbsCurve().create([om.MPoint(p) for p in spec['points']],
+                              spec['knots'], spec['degree'],
+                              FORMS[spec['form']], False, False, data)
+    return data
+
+
+def _numeric_attr(attr):
+    fn = om.MFnNumericAttribute()
+    obj = fn.create(attr['longName'], attr['longName'],
+                    om.MFnNumericData.kDouble,
+                    attr.get('defaultValue', 0.0))
+    if 'min' in attr:
+        fn.setMin(attr['min'])
+    if 'max' in attr:
+        fn.setMax(attr['max'])
+    fn.keyable = attr.get('keyable', False)
+    return obj
+
+
+def _queue_value(modifier, plug, value):
+    if isinstance(value, (list, tuple)) and len(value) == 16:
+        data = om.MFnMatrixData().create(om.MMatrix(value))
+        modifier.newPlugValue(plug, data)
+    elif isinstance(value, (list, tuple)):
+        for i, v in enumerate(value):
+            modifier.newPlugValueDouble(plug.child(i), v)
+    elif isinstance(value, bool):
+        modifier.newPlugValueBool(plug, value)
+    elif isinstance(value, int):
+        modifier.newPlugValueInt(plug, value)
+    else:
+        modifier.newPlugValueDouble(plug, value)
+
+
+# Plans handed to the limbRig command by key, a command only takes strings.
+# Lives here since Maya loads the plugin file as a module of its own.
+pending_plans = {}
+
+
+# Applies a plan through the limbRig command, so the build is one step on
+# Maya's undo queue that undo and redo replay. patterns are the names the
+# plan can clash with, see limb_utils.unique_names(). Returns a dict
+# mapping planned names to the names Maya gave the nodes.
+def build_plan(plan, patterns=None):
+    return _build({'plan': plan, 'patterns': patterns})
+
+
+# Loads a rig_plan.plan_script() script through the limbRig command, like
+# build_plan(). planned are the script's rig_plan.planned_names().
+def build_script(script, planned, patterns=None):
+    return _build({'script': script, 'planned': planned,
+                   'patterns': patterns})
+
+
+def _build(pending):
+    import lrig.limb_rig_plugin as limb_rig_plugin
+    limb_rig_plugin.ensure_loaded()
+    key = str(id(pending))
+    pending_plans[key] = pending
+    try:
+        cmds.limbRig(plan=key)
+        return pending['names']
+    finally:
+        del pending_plans[key]
+
+
+# Queues a rig plan into modifiers. Nodes, attributes and the network are
+# committed in three passes since plugs only resolve once their node or
+# attribute exists. Returns (names, modifiers); undo_plan(modifiers)
+# reverts the whole build. If a pass fails, the ones already committed are
+# undone before the error is raised. Nothing goes on Maya's undo queue,
+# build_plan() runs this inside the limbRig command for that.
+def apply_plan(plan):
+    modifiers = []
+    try:
+        names = _apply_passes(plan, modifiers)
+    except Exception:
+        undo_plan(modifiers)
+        raise
+    return names, modifiers
+
+
+# Commits a modifier, it is kept first so a partial doIt is undone too
+def _commit(modifier, modifiers):
+    modifiers.append(modifier)
+    modifier.doIt()
+
+
+def _apply_passes(plan, modifiers):
+    if any(node['type'] == 'limbStretch' for node in plan.nodes):
+        limb_stretch_node.ensure_loaded()
+    names = {}
+    objects = {}
+
+    def real(plug):
+        node, _, attr = plug.partition('.')
+        node = names.get(node, node)
+        return node + '.' + attr if attr else node
+
+    # Pass 1: every node, created directly under its final parent. Parents
+    # outside the plan have to be in the scene already.
+    dag_mod = om.MDagModifier()
+    dg_mod = om.MDGModifier()
+    for node in plan.nodes:
+        if node['type'] in DAG_TYPES:
+            parent = node['parent']
+            if not parent:
+                parent = om.MObject.kNullObj
+            elif parent in objects:
+                parent = objects[parent]
+            elif cmds.objExists(real(parent)):
+                parent = _node(real(parent))
+            else:
+                limb_utils.error("{} can't be parented to {}, it doesn't "
+                                 "exist".format(node['name'], parent))
+            obj = dag_mod.createNode(node['type'], parent)
+            dag_mod.renameNode(obj, limb_utils.unique_name(node['name']))
+        else:
+            obj = dg_mod.createNode(node['type'])
+            dg_mod.renameNode(obj, limb_utils.unique_name(node['name']))
+        objects[node['name']] = obj
+    for modifier in [dg_mod, dag_mod]:
+        _commit(modifier, modifiers)
+    for name, obj in objects.items():
+        if obj.hasFn(om.MFn.kDagNode):
+            names[name] = om.MFnDagNode(obj).partialPathName()
+        else:
+            names[name] = om.MFnDependencyNode(obj).name()
+
+    # Pass 2: dynamic attributes
+    attr_mod = om.MDGModifier()
+    for attr in plan.attributes:
+        attr_mod.addAttribute(objects[attr['node']], _numeric_attr(attr))
+    _commit(attr_mod, modifiers)
+
+    # Pass 3: values, connections, then the command based pieces
+    net_mod = om.MDGModifier()
+    for shape, spec in plan.shapes.items():
+        net_mod.newPlugValue(_plug(real(shape) + '.cached'),
+                             _curve_data(spec))
+    for plug, value in plan.values:
+        _queue_value(net_mod, _plug(real(plug)), value)
+    for source, destination in plan.connections:
+        net_mod.connect(_plug(real(source)), _plug(real(destination)))
+    for handle in plan.ik_handles:
+        names[handle['name']] = limb_utils.unique_name(handle['name'])
+        net_mod.commandToExecute(
+            'ikHandle -n "{}" -sj "{}" -ee "{}" -s "sticky" -sol "{}" '
+            '-srp 1'.format(real(handle['name']), real(handle['startJoint']),
+                            real(handle['endEffector']), handle['solver']))
+        effector = rig_plan.effector_name(handle['name'])
+        names[effector] = limb_utils.unique_name(effector)
+        net_mod.commandToExecute('rename `ikHandle -q -ee "{}"` "{}"'.format(
+            real(handle['name']), real(effector)))
+        net_mod.commandToExecute('parent "{}" "{}"'.format(
+            real(handle['name']), real(handle['parent'])))
+    for constraint in plan.constraints:
+        names[constraint['name']] = limb_utils.unique_name(
+            constraint['name'])
+        net_mod.commandToExecute('{} -n "{}"{} "{}" "{}"'.format(
+            constraint['type'], real(constraint['name']),
+            ' -mo' if constraint['maintainOffset'] else '',
+            real(constraint['driver']), real(constraint['driven'])))
+    _commit(net_mod, modifiers)
+    return names
+
+
+# Queues a rig_plan.plan_script() script into a modifier and returns
+# (names, modifiers) like apply_plan(). The names are allocated like
+# rig_plan.load_script() does, the script runs in one commandToExecute.
+def apply_script(script, planned):
+    if 'createNode limbStretch ' in script:
+        limb_stretch_node.ensure_loaded()
+    names = dict((name, limb_utils.unique_name(name)) for name in planned)
+    modifier = om.MDGModifier()
+    modifier.commandToExecute(rig_plan.rename_script(script, names))
+    modifiers = []
+    try:
+        _commit(modifier, modifiers)
+    except Exception:
+        undo_plan(modifiers)
+        raise
+    return names, modifiers
+
+
+def undo_plan(modifiers):
+    for modifier in reversed(modifiers):
+        modifier.undoIt()
+
+
+def redo_plan(modifiers):
+    done = []
+    try:
+        for modifier in modifiers:
+            _commit(modifier, done)
+    except Exception:
+        undo_plan(done)
+        raise
+
+
+# Builds the same limb repeatedly with each backend and returns the average
+# seconds per build, deleting every build before the next one
+def benchmark_backends(backends=('cmds', 'plan', 'api'), repeat=4,
+                       **kwargs):
+    import lrig.limb as limb
+    timings = {}
+    for backend in backends:
+        elapsed = 0.0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            top_group = limb.create_limb(backend=backend, **kwargs)
+            elapsed += time.perf_counter() - start
+            cmds.delete(top_group)
+        timings[backend] = elapsed / repeat
+    return timings
@@ -0,0 +1,304 @@
+import argparse
+import collections
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+# Workers print each result on a line starting with this, anything else
+# the interpreter prints is ignored
+RESULT_PREFIX = 'LRIG_RESULT '
+LIMB_KEYS = ['side', 'limb', 'joints', 'aliases', 'pole_vector',
+             'primary_axis', 'up_axis', 'stretch', 'backend', 'blend_mode',
+             'stretch_node']
+# Lines of a worker's stderr kept for the report
+STDERR_LINES = 20
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Reads a JSON manifest: {"defaults": {limb options}, "jobs": [{"scene":
+# path, "output": path, "limbs": [{limb options}, ...]}, ...]}. Limb
+# options are create_limb's keyword arguments, defaults apply to every
+# limb and output defaults to saving over the scene. Relative paths are
+# from the manifest. Returns the jobs with every limb's options filled in.
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs', [])):
+        if not job.get('scene') or not job.get('limbs'):
+            raise ValueError("Job {} needs a scene and limbs".format(i))
+        limbs = [dict(defaults, **spec) for spec in job['limbs']]
+        for spec in limbs:
+            unknown = sorted(set(spec) - set(LIMB_KEYS))
+            if unknown:
+                raise ValueError("Job {} has unknown limb options: {}"
+                                 .format(i, ', '.join(unknown)))
+        scene = os.path.join(root, job['scene'])
+        jobs.append({'scene': scene,
+                     'output': os.path.join(root, job.get('output', scene)),
+                     'limbs': limbs})
+    return jobs
+
+
+# Runs in the worker: opens the scene, builds every limb and saves
+def rig_scene(job):
+    import lrig.limb as limb
+    cmds = limb.cmds
+    cmds.file(job['scene'], open=True, force=True)
+    start = time.perf_counter()
+    top_groups = [limb.create_limb(**spec) for spec in job['limbs']]
+    build_seconds = time.perf_counter() - start
+    cmds.file(rename=job['output'])
+    file_type = 'mayaBinary' if job['output'].endswith('.mb') else \
+        'mayaAscii'
+    cmds.file(save=True, force=True, type=file_type)
+    return {'top_groups': top_groups, 'build_seconds': build_seconds}
+
+
+# A worker takes one JSON job per line on stdin and answers each with a
+# result line, until stdin closes. fake_maya runs the jobs against the fake
+# scene so the scheduler can be tried without Maya.
+def worker_main(fake_maya=False):
+    if fake_maya:
+        import lrig.fake_maya
+        lrig.fake_maya.install()
+    else:
+        import maya.standalone
+        maya.standalone.initialize(name='python')
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        try:
+            result = dict(rig_scene(json.loads(line)), status='ok')
+        except Exception as e:
+            traceback.print_exc()
+            result = {'status': 'failed',
+                      'error': '{}: {}'.format(type(e).__name__, e)}
+        sys.stdout.write(RESULT_PREFIX + json.dumps(result) + '\n')
+        sys.stdout.flush()
+    if not fake_maya:
+        maya.standalone.uninitialize()
+
+
+class WorkerError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+# One headless interpreter running worker_main, started on first use and
+# again after it was killed or died. stdout and stderr are read on their
+# own threads so a job can time out and a chatty interpreter can't block.
+class Worker(object):
+    def __init__(self, command, env=None):
+        self.command = command
+        self.env = env
+        self.process = None
+        self.results = None
+        self.stderr = collections.deque(maxlen=STDERR_LINES)
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, bufsize=1,
+            env=self.env)
+        self.results = queue.Queue()
+        self.stderr.clear()
+        for stream, read in [(self.process.stdout, self._read_stdout),
+                             (self.process.stderr, self._read_stderr)]:
+            reader = threading.Thread(target=read, args=(stream,
+                                                         self.results))
+            reader.daemon = True
+            reader.start()
+
+    def _read_stdout(self, stream, results):
+        for line in iter(stream.readline, ''):
+            if line.startswith(RESULT_PREFIX):
+                results.put(line[len(RESULT_PREFIX):])
+        results.put(None)  # The worker exited
+
+    def _read_stderr(self, stream, results):
+        for line in iter(stream.readline, ''):
+            self.stderr.append(line.rstrip())
+
+    # Sends a job and waits for its result. Raises WorkerError with a
+    # 'timeout' or 'crashed' status, after which the worker restarts on
+    # the next job.
+    def run(self, job, timeout=None):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        try:
+            self.process.stdin.write(json.dumps(job) + '\n')
+            self.process.stdin.flush()
+            result = self.results.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise WorkerError('timeout', "No result after {}s".format(
+                timeout))
+        except (IOError, OSError):
+            result = None
+        if result is None:
+            self.kill()
+            raise WorkerError('crashed', '\n'.join(self.stderr) or
+                              "Worker exited")
+        return json.loads(result)
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+        if self.process is not None:
+            self.process.wait()
+        self.process = None
+
+    def stop(self, timeout=10.0):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (IOError, OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+
+# The command that starts a worker: mayapy by default, or this Python on
+# the fake scene. Any interpreter that can import lrig works.
+def worker_command(interpreter='mayapy', fake_maya=False):
+    if fake_maya:
+        return [sys.executable, '-m', 'lrig.batch', '--worker',
+                '--fake-maya']
+    return [interpreter, '-m', 'lrig.batch', '--worker']
+
+
+def worker_env():
+    env = dict(os.environ)
+    paths = [PACKAGE_PARENT] + [p for p in env.get('PYTHONPATH', '').split(
+        os.pathsep) if p]
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    return env
+
+
+# Rigs every job on a pool of workers. A job that fails, times out or
+# kills its worker is queued again until it has had retries more
+# attempts. A worker that can't be started or talked to fails the attempt
+# like a crash does. Returns a report with every job's attempts, in job
+# order.
+def run_batch(jobs, workers=4, timeout=600.0, retries=1, command=None,
+              env=None):
+    command = command or worker_command()
+    env = env or worker_env()
+    results = [{'scene': job['scene'], 'output': job['output'],
+                'status': 'pending', 'attempts': []} for job in jobs]
+    pending = queue.Queue()
+    for index in range(len(jobs)):
+        pending.put(index)
+    remaining = [len(jobs)]
+    lock = threading.Lock()
+    threads = []
+
+    # Once every job is done the workers are told to stop
+    def finish():
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                for _ in threads:
+                    pending.put(None)
+
+    def work(worker_id):
+        worker = Worker(command, env)
+        try:
+            for index in iter(pending.get, None):
+                start = time.perf_counter()
+                retry = False
+                try:
+                    try:
+                        attempt = worker.run(jobs[index], timeout)
+                    except WorkerError as e:
+                        attempt = {'status': e.status, 'error': str(e)}
+                    except Exception as e:
+                        worker.kill()
+                        attempt = {'status': 'error', 'error': '{}: {}'
+                                   .format(type(e).__name__, e)}
+                    attempt['seconds'] = time.perf_counter() - start
+                    attempt['worker'] = worker_id
+                    result = results[index]
+                    result['attempts'].append(attempt)
+                    result['status'] = attempt['status']
+                    retry = attempt['status'] != 'ok' and \
+                        len(result['attempts']) <= retries
+                    if retry:
+                        pending.put(index)
+                finally:
+                    # A job is done unless it was queued again, even when
+                    # recording it failed, so no worker waits forever
+                    if not retry:
+                        finish()
+        finally:
+            worker.stop()
+
+    start = time.perf_counter()
+    for worker_id in range(min(workers, len(jobs))):
+        threads.append(threading.Thread(target=work, args=(worker_id,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for result in results:
+        if not result['attempts']:
+            continue
+        last = result['attempts'][-1]
+        result['seconds'] = sum(a['seconds'] for a in result['attempts'])
+        for key in ['build_seconds', 'top_groups', 'error']:
+            if key in last:
+                result[key] = last[key]
+    return {'workers': len(threads),
+            'seconds': time.perf_counter() - start,
+            'ok': sum(r['status'] == 'ok' for r in results),
+            'failed': sum(r['status'] != 'ok' for r in results),
+            'jobs': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rig the scenes in a manifest with create_limb on a "
+                    "pool of headless Maya workers.")
+    parser.add_argument('manifest', nargs='?')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--timeout', type=float, default=600.0,
+                        help="Seconds a job may take")
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--interpreter', default='mayapy')
+    parser.add_argument('--fake-maya', action='store_true',
+                        help="Run workers on the fake scene instead of Maya")
+    parser.add_argument('--output', help="JSON report, stdout by default")
+    parser.add_argument('--worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        worker_main(args.fake_maya)
+        return 0
+    if not args.manifest:
+        parser.error("a manifest is required")
+
+    report = run_batch(load_manifest(args.manifest), args.workers,
+                       args.timeout, args.retries,
+                       worker_command(args.interpreter, args.fake_maya))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import lrig.fake_maya as fake_maya
+
+LIMB_COUNTS = [1, 10, 100]
+CHAIN_LENGTHS = [10, 100, 300]
+# Per limb (or per joint) numbers compared against a baseline report
+COST_KEYS = ['calls', 'queries', 'nodes_created', 'nodes_deleted',
+             'connections']
+# The limbRig plugin, loaded by path so importing it is part of the load
+PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'limb_rig_plugin.py')
+# The limbs of each character --character builds, in order
+CHARACTER_LIMBS = [('L', 'arm'), ('R', 'arm'), ('L', 'leg'), ('R', 'leg')]
+LEG_ALIASES = ['Hip', 'Knee', 'Ankle']
+GUIDE_POSITIONS = {'Shoulder': (2.0, 15.0, 0.0), 'Elbow': (5.0, 15.0, -0.5),
+                   'Wrist': (8.0, 15.0, 0.0), 'PV': (5.0, 15.0, -5.0)}
+
+
+# Guide joints and pole vector for one limb, spread out along Z. Returns
+# the create_limb keyword arguments that point at them.
+def create_guides(cmds, index, side='L'):
+    side_name = "Left" if side == 'L' else "Right"
+    mirror = 1.0 if side == 'L' else -1.0
+    names = {}
+    for part, (x, y, z) in sorted(GUIDE_POSITIONS.items()):
+        cmds.select(clear=True)
+        names[part] = cmds.joint(
+            name='{}{}{}_guide'.format(side_name, part, index),
+            position=(x * mirror, y, z + index * 10.0))
+    joints = [names[part] for part in ['Shoulder', 'Elbow', 'Wrist']]
+    return {'side': side, 'joints': joints,
+            'aliases': dict(zip(joints, ['Shoulder', 'Elbow', 'Wrist'])),
+            'pole_vector': names['PV']}
+
+
+# A guide joint hierarchy for a long chain, a gentle wave along X.
+# Returns the create_long_chain keyword arguments that point at it.
+def create_chain_guides(cmds, count, side='C'):
+    cmds.select(clear=True)
+    joints = []
+    for i in range(count):
+        joints.append(cmds.joint(
+            joints[-1] if joints else None,
+            name='Chain{}_guide'.format(i),
+            position=(float(i), 10.0 + math.sin(i * 0.3),
+                      math.cos(i * 0.2))))
+    return {'side': side, 'name': 'chain', 'joints': joints}
+
+
+def _empty_scene(cmds, headless):
+    if headless:
+        fake_maya.new_scene()
+    else:
+        cmds.file(new=True, force=True)
+
+
+# Builds count limbs, alternating sides, in an empty scene and returns the
+# instrumented cost of the builds. With template, the first guides get a
+# limb template that is then stamped onto every set of guides.
+def run_build(count, template=False, **options):
+    headless = fake_maya.install() is not None
+    import lrig.limb as limb
+    import lrig.cmds_proxy as cmds_proxy
+    import lrig.limb_template as limb_template
+    cmds = limb.cmds
+    _empty_scene(cmds, headless)
+    guides = [create_guides(cmds, i, 'L' if i % 2 == 0 else 'R')
+              for i in range(count)]
+    start = time.perf_counter()
+    with cmds_proxy.instrumented() as proxy:
+        if template:
+            options.pop('backend', None)
+            options.pop('cache', None)
+            built = limb_template.create_template(**dict(options,
+                                                         **guides[0]))
+            built.stamp_many([guide['joints'] + [guide['pole_vector']]
+                              for guide in guides])
+        else:
+            for guide in guides:
+                limb.create_limb(**dict(options, **guide))
+    return _result(proxy, time.perf_counter() - start, 'limbs', count)
+
+
+# Builds count limbs in an empty scene, both arms and both legs of one
+# character after another, and returns the instrumented cost of the
+# builds. With character, each character's limbs are built together by
+# create_character, otherwise one create_limb call per limb. Both use the
+# same backend, plan unless backend is api, since create_character only
+# has those.
+def run_character_build(count, character=True, **options):
+    headless = fake_maya.install() is not None
+    import lrig.limb as limb
+    import lrig.cmds_proxy as cmds_proxy
+    import lrig.limb_character as limb_character
+    cmds = limb.cmds
+    _empty_scene(cmds, headless)
+    backend = 'api' if options.pop('backend', None) == 'api' else 'plan'
+    options.pop('cache', None)
+    specs = []
+    for i in range(count):
+        side, limb_name = CHARACTER_LIMBS[i % len(CHARACTER_LIMBS)]
+        spec = dict(options, limb=limb_name, **create_guides(cmds, i, side))
+        if limb_name == 'leg':
+            spec['aliases'] = dict(zip(spec['joints'], LEG_ALIASES))
+        specs.append(spec)
+    start = time.perf_counter()
+    with cmds_proxy.instrumented() as proxy:
+        if character:
+            for i in range(0, count, len(CHARACTER_LIMBS)):
+                limb_character.create_character(
+                    specs[i:i + len(CHARACTER_LIMBS)],
+                    'Character{}'.format(i // len(CHARACTER_LIMBS)),
+                    backend)
+        else:
+            for spec in specs:
+                limb.create_limb(backend=backend, **spec)
+    return _result(proxy, time.perf_counter() - start, 'limbs', count)
+
+
+# Builds one long chain of count joints in an empty scene and returns the
+# instrumented cost of the build, per joint
+def run_chain_build(count, **options):
+    headless = fake_maya.install() is not None
+    import lrig.limb_chain as limb_chain
+    import lrig.cmds_proxy as cmds_proxy
+    cmds = limb_chain.cmds
+    _empty_scene(cmds, headless)
+    guides = create_chain_guides(cmds, count)
+    start = time.perf_counter()
+    with cmds_proxy.instrumented() as proxy:
+        limb_chain.create_long_chain(**dict(options, **guides))
+    return _result(proxy, time.perf_counter() - start, 'joints', count)
+
+
+def _result(proxy, elapsed, unit, count):
+    report = proxy.report()
+    totals = report['totals']
+    per = '_per_' + unit[:-1]
+    # seconds leaves out the scene counts the proxy takes between phases
+    result = {unit: count, 'seconds': totals['seconds'],
+              'seconds' + per: totals['seconds'] / count,
+              'wall_seconds': elapsed,
+              'phases': report['phases'], 'commands': totals['commands']}
+    for key in COST_KEYS:
+        result[key] = totals[key]
+        result[key + per] = float(totals[key]) / count
+    return result
+
+
+# With chain, counts are the lengths of single chains instead of numbers
+# of limbs. Chain reports also have the growth of each per joint cost from
+# the shortest to the longest chain, which stays near 1 while building is
+# linear. With character, limbs are built as four limb characters, and
+# the same limbs built one at a time are reported under 'separate'.
+def run(counts=None, template=False, chain=False, character=False,
+        **options):
+    report = {'headless': fake_maya.install() is not None,
+              'options': dict(options, template=template, chain=chain,
+                              character=character)}
+    if character:
+        counts = counts or LIMB_COUNTS
+        report['runs'] = [run_character_build(count, True, **options)
+                          for count in counts]
+        report['separate'] = [run_character_build(count, False, **options)
+                              for count in counts]
+        return report
+    if not chain:
+        report['runs'] = [run_build(count, template, **options)
+                          for count in counts or LIMB_COUNTS]
+        if options.get('cache') and not template:
+            import lrig.rig_cache as rig_cache
+            report['cache'] = rig_cache.open_cache(options['cache']).stats()
+        return report
+    options.pop('backend', None)
+    options.pop('cache', None)
+    runs = [run_chain_build(count, **options)
+            for count in counts or CHAIN_LENGTHS]
+    report['runs'] = runs
+    report['growth'] = dict(
+        (key, runs[-1][key + '_per_joint'] / runs[0][key + '_per_joint']
+         if runs[0][key + '_per_joint'] else 0.0)
+        for key in ['seconds'] + COST_KEYS)
+    return report
+
+
+# Runs in a fresh Maya interpreter and prints a result line: seconds to
+# start Maya, to load the limbRig plugin and for its first command (which
+# imports the builder), a second command, and undoing and redoing it. The
+# lrig modules loading the plugin imported are listed too.
+def startup_main():
+    import lrig.batch as batch
+    start = time.perf_counter()
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    import maya.cmds as cmds
+    result = {'maya_seconds': time.perf_counter() - start}
+    cmds.undoInfo(state=True, infinity=True)
+
+    modules = set(sys.modules)
+    start = time.perf_counter()
+    cmds.loadPlugin(PLUGIN_PATH, quiet=True)
+    result['load_seconds'] = time.perf_counter() - start
+    result['load_imports'] = sorted(
+        m for m in set(sys.modules) - modules
+        if m.startswith('lrig') or m.startswith('limb_'))
+
+    for i, key in enumerate(['first_command', 'second_command']):
+        guide = create_guides(cmds, i, 'L' if i % 2 == 0 else 'R')
+        start = time.perf_counter()
+        cmds.limbRig(side=guide['side'], joints=guide['joints'],
+                     aliases=[guide['aliases'][j] for j in guide['joints']],
+                     poleVector=guide['pole_vector'])
+        result[key + '_seconds'] = time.perf_counter() - start
+    for command in ['undo', 'redo']:
+        start = time.perf_counter()
+        getattr(cmds, command)()
+        result[command + '_seconds'] = time.perf_counter() - start
+    sys.stdout.write(batch.RESULT_PREFIX + json.dumps(result) + '\n')
+    sys.stdout.flush()
+    maya.standalone.uninitialize()
+
+
+# Measures plugin startup with startup_main in a new interpreter, mayapy
+# by default, so nothing is imported or cached beforehand
+def run_startup(interpreter='mayapy'):
+    import lrig.batch as batch
+    try:
+        process = subprocess.Popen(
+            [interpreter, '-m', 'lrig.benchmark', '--startup-worker'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=batch.worker_env())
+        out, err = process.communicate()
+    except (IOError, OSError) as e:
+        return {'interpreter': interpreter, 'error': str(e)}
+    for line in out.splitlines():
+        if line.startswith(batch.RESULT_PREFIX):
+            result = json.loads(line[len(batch.RESULT_PREFIX):])
+            result['interpreter'] = interpreter
+            return result
+    lines = err.strip().splitlines()[-batch.STDERR_LINES:]
+    return {'interpreter': interpreter,
+            'error': '\n'.join(lines) or "Exited with {}".format(
+                process.returncode)}
+
+
+# Lists the per limb (or per joint) costs that grew more than tolerance (a
+# fraction) over the baseline, for runs of the same size. Time is only
+# compared when time_tolerance is given since it depends on the machine.
+def compare(report, baseline, tolerance=0.0, time_tolerance=None):
+    unit = 'joints' if report['options'].get('chain') else 'limbs'
+    per = '_per_' + unit[:-1]
+    keys = [key + per for key in COST_KEYS]
+    if time_tolerance is not None:
+        keys.append('seconds' + per)
+    old_runs = dict((run[unit], run) for run in baseline['runs']
+                    if unit in run)
+    regressions = []
+    for run in report['runs']:
+        old = old_runs.get(run[unit])
+        if old is None:
+            continue
+        for key in keys:
+            if key not in old:  # Reports from before the key was added
+                continue
+            limit = time_tolerance if key.startswith('seconds') else \
+                tolerance
+            if run[key] > old[key] * (1.0 + limit) + 1e-9:
+                regressions.append({unit: run[unit], 'key': key,
+                                    'baseline': old[key],
+                                    'value': run[key]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure what create_limb costs for 1, 10 and 100 "
+                    "limbs, or create_long_chain for chains of 10, 100 "
+                    "and 300 joints. Runs against a fake scene outside "
+                    "Maya.")
+    parser.add_argument('--limbs', type=int, nargs='+')
+    parser.add_argument('--chain', type=int, nargs='*',
+                        help="Build long chains of these lengths instead")
+    parser.add_argument('--backend', default='cmds')
+    parser.add_argument('--blend-mode', default='blendColors')
+    parser.add_argument('--no-stretch', action='store_true')
+    parser.add_argument('--template', action='store_true',
+                        help="Stamp copies of one limb template")
+    parser.add_argument('--character', action='store_true',
+                        help="Build arms and legs as four limb characters "
+                             "and compare with building them one by one")
+    parser.add_argument('--cache',
+                        help="Cache plans in this directory, needs the plan "
+                             "or api backend. Repeat a count to see hits.")
+    parser.add_argument('--startup', action='store_true',
+                        help="Time loading the limbRig plugin and its "
+                             "first commands in a new mayapy instead")
+    parser.add_argument('--interpreter', default='mayapy',
+                        help="Maya interpreter for --startup")
+    parser.add_argument('--startup-worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--output', help="JSON file, stdout by default")
+    parser.add_argument('--baseline', help="Report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.0)
+    parser.add_argument('--time-tolerance', type=float)
+    args = parser.parse_args(argv)
+    if args.startup_worker:
+        startup_main()
+        return 0
+
+    chain = args.chain is not None
+    if args.startup:
+        report = {'startup': run_startup(args.interpreter)}
+    else:
+        report = run(args.chain if chain else args.limbs, args.template,
+                     chain, args.character, backend=args.backend,
+                     blend_mode=args.blend_mode, stretch=not args.no_stretch,
+                     cache=args.cache)
+    if args.baseline and not args.startup:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f),
+                                            args.tolerance,
+                                            args.time_tolerance)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report.get('regressions') or \
+        'error' in report.get('startup', {}) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
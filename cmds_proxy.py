@@ -0,0 +1,171 @@
+import contextlib
+import functools
+import time
+
+# Functions create_limb goes through. _build_limb's own calls (checks,
+# grouping and global scale) are reported as 'grouping'.
+LIMB_PHASES = ['create_chain', 'create_blend_control', 'blend_ik_fk',
+               'create_fk_controls', 'create_ik_controls_and_handle',
+               'add_ik_stretch', 'add_fk_stretch']
+PLAN_PHASES = ['plan_limb', 'apply_plan']
+TEMPLATE_PHASES = ['create_template']
+# The long chain's own calls (checks, grouping and global scale) are
+# reported as 'create_long_chain'
+CHAIN_PHASES = ['create_long_chain', 'create_spline_ik']
+MIRROR_PHASES = ['read_limb', 'plan_mirror']
+# Commands that only read the scene, xform counts when called with query
+QUERY_COMMANDS = ['getAttr', 'listRelatives', 'listConnections', 'ls',
+                  'objExists', 'nodeType', 'pluginInfo']
+
+
+def scene_counts(cmds):
+    nodes = cmds.ls()
+    connections = cmds.listConnections(nodes, connections=True, plugs=True,
+                                       source=False) or []
+    return len(nodes), len(connections) // 2
+
+
+def _new_phase():
+    return {'calls': 0, 'queries': 0, 'commands': {}, 'seconds': 0.0,
+            'cmds_seconds': 0.0, 'nodes_created': 0, 'nodes_deleted': 0,
+            'connections': 0}
+
+
+# Wraps a cmds module and records every call under the innermost running
+# phase. Phases are exclusive: time, calls and scene deltas spent in a
+# nested phase only count towards that phase. Scene counts are taken at
+# phase boundaries and around delete, outside the timed sections.
+class CmdsProxy(object):
+    def __init__(self, cmds):
+        self._cmds = cmds
+        self.reset()
+
+    def __getattr__(self, name):
+        command = getattr(self._cmds, name)
+        if not callable(command):
+            return command
+
+        @functools.wraps(command)
+        def call(*args, **kwargs):
+            if name == 'delete':
+                before = len(self._cmds.ls())
+            start = time.perf_counter()
+            try:
+                return command(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats = self.phases[self._stack[-1]]
+                stats['calls'] += 1
+                if name in QUERY_COMMANDS or kwargs.get('query') or \
+                        kwargs.get('q'):
+                    stats['queries'] += 1
+                stats['commands'][name] = stats['commands'].get(name, 0) + 1
+                stats['cmds_seconds'] += elapsed
+                if name == 'delete':
+                    pause = time.perf_counter()
+                    deleted = before - len(self._cmds.ls())
+                    stats['nodes_deleted'] += deleted
+                    self._deleted += deleted
+                    self._mark_time += time.perf_counter() - pause
+
+        # Later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+    def reset(self):
+        self.phases = {'other': _new_phase()}
+        self._stack = ['other']
+        self._mark_counts = scene_counts(self._cmds)
+        self._mark_time = time.perf_counter()
+        self._deleted = 0
+
+    # Closes the running interval and charges it to the current phase
+    def _switch(self, stack):
+        now = time.perf_counter()
+        counts = scene_counts(self._cmds)
+        stats = self.phases[self._stack[-1]]
+        stats['seconds'] += now - self._mark_time
+        nodes = counts[0] - self._mark_counts[0]
+        stats['nodes_created'] += nodes + self._deleted
+        stats['connections'] += counts[1] - self._mark_counts[1]
+        self._stack = stack
+        self.phases.setdefault(stack[-1], _new_phase())
+        self._mark_counts = counts
+        self._deleted = 0
+        self._mark_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._switch(self._stack + [name])
+        try:
+            yield self.phases[name]
+        finally:
+            self._switch(self._stack[:-1])
+
+    def phased(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    # Phase stats plus their totals, without the 'other' phase when nothing
+    # ran outside a phase
+    def report(self):
+        self._switch(self._stack)
+        phases = dict((name, dict(stats))
+                      for name, stats in self.phases.items()
+                      if name != 'other' or stats['calls'])
+        totals = _new_phase()
+        for stats in phases.values():
+            for key, value in stats.items():
+                if key == 'commands':
+                    for command, count in value.items():
+                        totals['commands'][command] = \
+                            totals['commands'].get(command, 0) + count
+                else:
+                    totals[key] += value
+        return {'phases': phases, 'totals': totals}
+
+
+# Routes the cmds calls of limb, limb_utils, rig_plan, limb_template,
+# limb_chain and limb_mirror through a CmdsProxy and records the builder
+# functions as phases
+@contextlib.contextmanager
+def instrumented(proxy=None):
+    import lrig.limb as limb
+    import lrig.limb_chain as limb_chain
+    import lrig.limb_mirror as limb_mirror
+    import lrig.limb_template as limb_template
+    import lrig.limb_utils as limb_utils
+    import lrig.rig_plan as rig_plan
+    proxy = proxy or CmdsProxy(limb.cmds)
+    patches = [(module, 'cmds', proxy)
+               for module in [limb, limb_utils, rig_plan, limb_template,
+                              limb_chain, limb_mirror]]
+    patches += [(limb, name, proxy.phased(name, getattr(limb, name)))
+                for name in LIMB_PHASES]
+    patches.append((limb, '_build_limb',
+                    proxy.phased('grouping', limb._build_limb)))
+    patches += [(rig_plan, name, proxy.phased(name, getattr(rig_plan, name)))
+                for name in PLAN_PHASES]
+    patches += [(limb_template, name,
+                 proxy.phased(name, getattr(limb_template, name)))
+                for name in TEMPLATE_PHASES]
+    patches += [(limb_chain, name,
+                 proxy.phased(name, getattr(limb_chain, name)))
+                for name in CHAIN_PHASES]
+    patches += [(limb_mirror, name,
+                 proxy.phased(name, getattr(limb_mirror, name)))
+                for name in MIRROR_PHASES]
+    patches.append((limb_template.LimbTemplate, 'stamp', proxy.phased(
+        'stamp', limb_template.LimbTemplate.stamp)))
+    originals = [(module, name, getattr(module, name))
+                 for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield proxy
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
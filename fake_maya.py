@@ -0,0 +1,922 @@
+import fnmatch
+import os
+import pickle
+import re
+import sys
+import types
+
+import lrig.limb_utils as limb_utils
+
+# An in-memory stand-in for maya.cmds covering the commands the limb
+# builders use. Nodes, hierarchy, attributes, world matrices and
+# connections are tracked but nothing is evaluated, so constraints and
+# utility nodes only exist as nodes and connections. Names are unique
+# across the whole scene.
+
+TRANSFORM_TYPES = ['transform', 'joint', 'ikHandle', 'ikEffector',
+                   'parentConstraint', 'pointConstraint',
+                   'orientConstraint', 'poleVectorConstraint']
+SHAPE_TYPES = ['nurbsCurve', 'locator', 'mesh']
+VECTOR_ATTRS = {'translate': [0.0, 0.0, 0.0],
+                'rotate': [0.0, 0.0, 0.0],
+                'scale': [1.0, 1.0, 1.0],
+                'rotatePivot': [0.0, 0.0, 0.0],
+                'scalePivot': [0.0, 0.0, 0.0],
+                'jointOrient': [0.0, 0.0, 0.0]}
+MATRIX_ATTRS = ['matrix', 'inverseMatrix', 'worldMatrix',
+                'worldInverseMatrix', 'parentMatrix', 'parentInverseMatrix',
+                'offsetParentMatrix']
+TRANSFORM_ATTRS = ['visibility', 'rotatePivotTranslate', 'rotateOrder',
+                   'message', 'segmentScaleCompensate']
+# Plugs a constraint reads from each target and the channels it writes,
+# the way Maya connects them. rig_graph models constraints with these too.
+CONSTRAINT_TARGET_ATTRS = {
+    'parentConstraint': ['translate', 'rotate', 'scale', 'rotatePivot',
+                         'rotatePivotTranslate'],
+    'pointConstraint': ['translate', 'rotatePivot', 'rotatePivotTranslate'],
+    'orientConstraint': ['rotate'],
+    'poleVectorConstraint': ['translate', 'rotatePivot',
+                             'rotatePivotTranslate']}
+CONSTRAINT_OUTPUTS = {
+    'parentConstraint': [('constraintTranslate', 'translate'),
+                         ('constraintRotate', 'rotate')],
+    'pointConstraint': [('constraintTranslate', 'translate')],
+    'orientConstraint': [('constraintRotate', 'rotate')],
+    'poleVectorConstraint': [('constraintTranslate', 'poleVector')]}
+HISTORY_TYPES = ['makeNurbCircle']
+
+
+class FakeNode(object):
+    def __init__(self, name, node_type, parent=None):
+        self.name = name
+        self.type = node_type
+        self.parent = parent
+        self.children = []
+        self.values = {}
+        self.dynamic = set()
+        self.inputs = {}  # attr -> (source node, source attr)
+        self.outputs = []  # (attr, destination node, destination attr)
+        self.instances = []  # Parents after the first of an instanced node
+
+    @property
+    def is_transform(self):
+        return self.type in TRANSFORM_TYPES
+
+    @property
+    def is_dag(self):
+        return self.type in TRANSFORM_TYPES or self.type in SHAPE_TYPES
+
+
+# Each method mirrors the maya.cmds command of the same name, with the long
+# flag names the builders use
+class FakeScene(object):
+    def __init__(self):
+        self.undo_chunks = 0
+        self.refresh_suspended = False
+        self.evaluation_mode = 'parallel'
+        self.file(new=True)
+
+    # Scene
+
+    # Scenes are saved as a pickle of the nodes, whatever the extension,
+    # so only the fake scene can open them again
+    def file(self, *args, **flags):
+        if flags.get('query'):
+            return self.scene_name if flags.get('sceneName') else None
+        if flags.get('new'):
+            self.nodes = {}
+            self.selection = []
+            self.plugins = set()
+            self.warnings = []
+            self.scene_name = ''
+            self._next_index = {}
+            self._worlds = {}
+            self.renames = 0
+        elif flags.get('open'):
+            self.file(new=True)
+            with open(args[0], 'rb') as f:
+                self.nodes, self._next_index = pickle.load(f)
+            self.scene_name = args[0]
+            return args[0]
+        elif flags.get('rename'):
+            self.scene_name = flags['rename']
+            return self.scene_name
+        elif flags.get('save'):
+            if not self.scene_name:
+                raise RuntimeError("Scene has no name to save to")
+            with open(self.scene_name, 'wb') as f:
+                pickle.dump((self.nodes, self._next_index), f,
+                            pickle.HIGHEST_PROTOCOL)
+            return self.scene_name
+        return None
+
+    def error(self, message):
+        raise RuntimeError(message)
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def pluginInfo(self, name, query=False, loaded=False, **flags):
+        return name in self.plugins
+
+    def loadPlugin(self, path, quiet=False, **flags):
+        name = os.path.splitext(os.path.basename(path))[0]
+        self.plugins.add(name)
+        return [name]
+
+    # Only the open chunk count is kept, there is no undo queue
+    def undoInfo(self, *args, **flags):
+        if flags.get('openChunk'):
+            self.undo_chunks += 1
+        elif flags.get('closeChunk'):
+            self.undo_chunks -= 1
+        return True if flags.get('query') else None
+
+    def refresh(self, *args, **flags):
+        if flags.get('query'):
+            return self.refresh_suspended if flags.get('suspend') else None
+        if 'suspend' in flags:
+            self.refresh_suspended = flags['suspend']
+        return None
+
+    def evaluationManager(self, *args, **flags):
+        if flags.get('query'):
+            return [self.evaluation_mode] if flags.get('mode') else None
+        if 'mode' in flags:
+            self.evaluation_mode = flags['mode']
+        return None
+
+    def select(self, *objects, **flags):
+        names = [self._node(o).name for o in self._flatten(objects)]
+        if flags.get('clear'):
+            self.selection = []
+        elif flags.get('add'):
+            self.selection += [n for n in names if n not in self.selection]
+        elif flags.get('deselect'):
+            self.selection = [n for n in self.selection if n not in names]
+        else:
+            self.selection = names
+
+    def ls(self, *objects, **flags):
+        if flags.get('selection'):
+            names = list(self.selection)
+        elif objects:
+            # Exact names are looked up, wildcards matched in one pass
+            patterns = self._flatten(objects)
+            names = [p for p in patterns
+                     if p in self.nodes and not any(c in p for c in '*?[')]
+            wildcards = [fnmatch.translate(p) for p in patterns
+                         if any(c in p for c in '*?[')]
+            if wildcards:
+                match = re.compile('|'.join(wildcards)).match
+                names += [n for n in self.nodes
+                          if match(n) and n not in names]
+        else:
+            names = list(self.nodes)
+        # dag adds every descendant, once per instance path
+        if flags.get('dag'):
+            listed = []
+            for n in names:
+                if self.nodes[n].is_dag:
+                    listed += self._dag_paths(self.nodes[n],
+                                              self._path(self.nodes[n]))
+        else:
+            listed = [(self.nodes[n], None) for n in names]
+        node_type = flags.get('type')
+        if node_type:
+            types_ = node_type if isinstance(node_type, list) else \
+                [node_type]
+            listed = [(n, p) for n, p in listed if n.type in types_]
+        result = []
+        for node, path in listed:
+            if flags.get('long'):
+                result.append(path or self._path(node))
+            else:
+                result.append(node.name)
+            if flags.get('showType'):
+                result.append(node.type)
+        return result
+
+    def objExists(self, name):
+        node_name, _, attr = name.partition('.')
+        node = self.nodes.get(node_name)
+        if node is None:
+            return False
+        return self._has_attr(node, attr) if attr else True
+
+    def nodeType(self, name):
+        return self._node(name).type
+
+    # Creation
+
+    def createNode(self, node_type, name=None, parent=None, **flags):
+        parent_node = self._node(parent) if parent else None
+        if node_type in SHAPE_TYPES and parent_node is None:
+            parent_node = self._create('transform', 'transform1')
+        return self._create(node_type, name or node_type + '1',
+                            parent_node).name
+
+    def joint(self, *args, **flags):
+        parent = self._node(args[0]) if args and args[0] else None
+        node = self._create('joint', flags.get('name') or 'joint1', parent)
+        if flags.get('position'):
+            self._set_world_translation(node, flags['position'])
+        return node.name
+
+    def group(self, *objects, **flags):
+        parent = self._node(flags['parent']) if flags.get('parent') else None
+        node = self._create('transform', flags.get('name') or 'group1',
+                            parent)
+        if objects and not flags.get('empty'):
+            self.parent(*(list(self._flatten(objects)) + [node.name]))
+        return node.name
+
+    def spaceLocator(self, **flags):
+        node = self._create('transform', flags.get('name') or 'locator1')
+        self._create('locator', node.name + 'Shape', node)
+        if flags.get('position'):
+            node.values['translate'] = [float(v) for v in flags['position']]
+        return [node.name]
+
+    def circle(self, **flags):
+        node = self._create('transform', flags.get('name') or 'nurbsCircle1')
+        shape = self._create('nurbsCurve', node.name + 'Shape', node)
+        settings = {'radius': flags.get('radius', 1.0),
+                    'normal': list(flags.get('normal', (0, 0, 1))),
+                    'degree': flags.get('degree', 3),
+                    'sections': flags.get('sections', 8)}
+        if not flags.get('constructionHistory', flags.get('ch', True)):
+            shape.values['cc'] = settings
+            return [node.name]
+        maker = self._create('makeNurbCircle', 'makeNurbCircle1')
+        maker.values.update(settings)
+        self._connect(maker, 'outputCurve', shape, 'create')
+        return [node.name, maker.name]
+
+    def curve(self, **flags):
+        node = self._create('transform', flags.get('name') or 'curve1')
+        shape = self._create('nurbsCurve', node.name + 'Shape', node)
+        shape.values['cc'] = {'degree': flags.get('degree', 3),
+                              'points': flags.get('p', flags.get('point'))}
+        return node.name
+
+    def ikHandle(self, *objects, **flags):
+        if flags.get('query'):
+            handle = self._node(objects[0])
+            return handle.inputs['endEffector'][0].name
+        start = self._node(flags['startJoint'])
+        end = self._node(flags['endEffector'])
+        handle = self._create('ikHandle', flags.get('name') or 'ikHandle1')
+        handle.values['translate'] = limb_utils.get_translation(
+            self._world(end))
+        effector = self._create('ikEffector', 'effector1', end.parent)
+        for axis in 'XYZ':
+            self._connect(end, 'translate' + axis, effector,
+                          'translate' + axis)
+        solver_name = flags.get('solver', 'ikRPsolver')
+        solver = self.nodes.get(solver_name) or self._create(solver_name,
+                                                             solver_name)
+        self._connect(start, 'message', handle, 'startJoint')
+        self._connect(effector, 'handlePath[0]', handle, 'endEffector')
+        self._connect(solver, 'message', handle, 'ikSolver')
+        if flags.get('curve'):
+            curve = self._node(flags['curve'])
+            shape = ([c for c in curve.children if c.type == 'nurbsCurve']
+                     or [curve])[0]
+            self._connect(shape, 'worldSpace[0]', handle, 'inCurve')
+        return [handle.name, effector.name]
+
+    def parentConstraint(self, *objects, **flags):
+        return self._constrain('parentConstraint', objects, flags)
+
+    def pointConstraint(self, *objects, **flags):
+        return self._constrain('pointConstraint', objects, flags)
+
+    def orientConstraint(self, *objects, **flags):
+        return self._constrain('orientConstraint', objects, flags)
+
+    def poleVectorConstraint(self, *objects, **flags):
+        return self._constrain('poleVectorConstraint', objects, flags)
+
+    # Copies the roots and their hierarchies. upstreamNodes also copies the
+    # dependency nodes feeding them. Connections between copied nodes move
+    # to the copies; with inputConnections or upstreamNodes, connections
+    # from anything that wasn't copied stay on the original source.
+    def duplicate(self, *objects, **flags):
+        roots = [self._node(o) for o in self._flatten(objects)]
+        walk = []  # (node, parent) pairs, instances are copied per parent
+        for root in roots:
+            walk += self._preorder(root)
+        originals = [node for node, _ in walk]
+        if flags.get('upstreamNodes'):
+            pending = list(originals)
+            seen = set(originals)
+            while pending:
+                for source, _ in pending.pop().inputs.values():
+                    if source not in seen and not source.is_dag:
+                        seen.add(source)
+                        originals.append(source)
+                        pending.append(source)
+                        walk.append((source, None))
+        copies = {}
+        for node, parent in walk:
+            parent = copies.get(parent, parent)
+            copy = self._create(node.type, node.name, parent)
+            copy.values = dict((k, list(v) if isinstance(v, list) else v)
+                               for k, v in node.values.items())
+            copy.dynamic = set(node.dynamic)
+            copies[node] = copy
+        keep_inputs = flags.get('inputConnections') or \
+            flags.get('upstreamNodes')
+        for node in originals:
+            for attr, (source, source_attr) in node.inputs.items():
+                if source in copies or keep_inputs:
+                    self._connect(copies.get(source, source), source_attr,
+                                  copies[node], attr)
+        if flags.get('returnRootsOnly'):
+            return [copies[root].name for root in roots]
+        return [copies[node].name for node in originals]
+
+    # Editing
+
+    def rename(self, old, new, **flags):
+        node = self._node(old)
+        if new == node.name:
+            return new
+        del self.nodes[node.name]
+        node.name = self._unique(new)
+        self.nodes[node.name] = node
+        return node.name
+
+    def delete(self, *objects, **flags):
+        nodes = [self._node(o) for o in self._flatten(objects)]
+        if flags.get('ch') or flags.get('constructionHistory'):
+            for node in nodes:
+                for shape in [node] + node.children:
+                    for source, _ in list(shape.inputs.values()):
+                        if source.type in HISTORY_TYPES:
+                            self._delete(source)
+            return
+        for node in nodes:
+            if node.name in self.nodes:
+                self._delete(node)
+
+    def parent(self, *args, **flags):
+        objects = self._flatten(args)
+        if flags.get('world'):
+            new_parent = None
+        else:
+            new_parent = self._node(objects[-1])
+            objects = objects[:-1]
+        result = []
+        for name in objects:
+            node = self._node(name)
+            if flags.get('addObject'):  # Instances the shape under parent
+                node.instances.append(new_parent)
+                new_parent.children.append(node)
+                result.append(node.name)
+                continue
+            world = self._world(node)
+            self._reparent(node, new_parent)
+            if not flags.get('relative'):
+                self._set_world(node, world)
+            result.append(node.name)
+        return result
+
+    def hide(self, *objects, **flags):
+        for name in self._flatten(objects):
+            self._node(name).values['visibility'] = False
+
+    def makeIdentity(self, *objects, **flags):
+        channels = [flags.get(c) for c in ['translate', 'rotate', 'scale']]
+        if not any(c is not None for c in channels):
+            channels = [True, True, True]
+        translate, rotate, scale = channels
+        for name in self._flatten(objects):
+            node = self._node(name)
+            children = [c for c in node.children if c.is_transform]
+            worlds = [self._world(c) for c in children]
+            self._moved(node)
+            if node.type == 'joint':
+                if rotate:
+                    node.values['jointOrient'] = limb_utils.get_euler_rotation(
+                        self._rotation_matrix(node))
+                    node.values['rotate'] = [0.0, 0.0, 0.0]
+            else:
+                if translate:
+                    # The pivot stays where it was in the world
+                    offset = self._vector(node, 'translate')
+                    for pivot in ['rotatePivot', 'scalePivot']:
+                        node.values[pivot] = [
+                            p + o for p, o in zip(self._vector(node, pivot),
+                                                  offset)]
+                    node.values['translate'] = [0.0, 0.0, 0.0]
+                if rotate:
+                    node.values['rotate'] = [0.0, 0.0, 0.0]
+            if scale:
+                node.values['scale'] = [1.0, 1.0, 1.0]
+            for child, world in zip(children, worlds):
+                self._set_world(child, world)
+
+    def xform(self, *objects, **flags):
+        world_space = flags.get('worldSpace', False)
+        if flags.get('query'):
+            node = self._node(self._flatten(objects)[0])
+            if flags.get('matrix'):
+                return self._world(node) if world_space else \
+                    self._local(node)
+            if flags.get('translation'):
+                if world_space:
+                    return limb_utils.get_translation(self._world(node))
+                return list(self._vector(node, 'translate'))
+            if flags.get('rotation'):
+                if world_space:
+                    return limb_utils.get_euler_rotation(self._world(node))
+                return list(self._vector(node, 'rotate'))
+            for pivot in ['rotatePivot', 'scalePivot']:
+                if flags.get(pivot):
+                    point = list(self._vector(node, pivot))
+                    if world_space:
+                        return limb_utils.transform_point(
+                            point, self._world(node))
+                    return point
+            return None
+        for name in self._flatten(objects):
+            node = self._node(name)
+            self._moved(node)
+            if flags.get('matrix'):
+                if world_space:
+                    self._set_world(node, flags['matrix'])
+                else:
+                    self._set_local(node, flags['matrix'])
+            if flags.get('translation') is not None:
+                if world_space:
+                    self._set_world_translation(node, flags['translation'])
+                else:
+                    node.values['translate'] = [
+                        float(v) for v in flags['translation']]
+            if flags.get('rotation') is not None:
+                if world_space:
+                    self._set_world_rotation(node, flags['rotation'])
+                else:
+                    node.values['rotate'] = [float(v)
+                                             for v in flags['rotation']]
+            if flags.get('pivots') is not None:
+                point = [float(v) for v in flags['pivots']]
+                if world_space:
+                    point = limb_utils.transform_point(
+                        point, limb_utils.inverse_matrix(self._world(node)))
+                node.values['rotatePivot'] = list(point)
+                node.values['scalePivot'] = list(point)
+
+    # Attributes
+
+    def addAttr(self, *objects, **flags):
+        long_name = flags.get('longName') or flags.get('ln')
+        for name in self._flatten(objects) or self.selection:
+            node = self._node(name)
+            if long_name in node.dynamic or (node.is_transform and
+                                             self._has_attr(node, long_name)):
+                raise RuntimeError("Found more than one attribute named "
+                                   "'{}' on '{}'".format(long_name, name))
+            node.dynamic.add(long_name)
+            node.values[long_name] = flags.get('defaultValue', 0.0)
+
+    def getAttr(self, plug, **flags):
+        node, attr = self._plug(plug)
+        base = attr.split('[')[0]
+        if base in MATRIX_ATTRS and node.is_dag:
+            return self._matrix_attr(node, base)
+        if attr in VECTOR_ATTRS:
+            return [tuple(self._vector(node, attr))]
+        if attr[:-1] in VECTOR_ATTRS and attr[-1] in 'XYZ':
+            return self._vector(node, attr[:-1])['XYZ'.index(attr[-1])]
+        if attr not in node.values and not self._has_attr(node, attr):
+            raise ValueError("No object matches name: " + plug)
+        return node.values.get(attr, 0.0)
+
+    def setAttr(self, plug, *values, **flags):
+        node, attr = self._plug(plug)
+        children = [attr + a for a in 'XYZ'] if attr in VECTOR_ATTRS else []
+        if attr in node.inputs or attr[:-1] in node.inputs or \
+                any(child in node.inputs for child in children):
+            raise RuntimeError("setAttr: The attribute '{}' is locked or "
+                               "connected and cannot be modified."
+                               .format(plug))
+        self._moved(node)
+        attr_type = flags.get('type')
+        if attr_type == 'matrix':
+            node.values[attr] = [float(v) for v in values[0]]
+        elif attr_type:
+            node.values[attr] = values
+        elif attr in VECTOR_ATTRS:
+            node.values[attr] = [float(v) for v in values]
+        elif attr[:-1] in VECTOR_ATTRS and attr[-1] in 'XYZ':
+            self._vector(node, attr[:-1])['XYZ'.index(attr[-1])] = \
+                float(values[0])
+        elif len(values) > 1:
+            node.values[attr] = [float(v) for v in values]
+        else:
+            node.values[attr] = values[0]
+
+    def connectAttr(self, source, destination, **flags):
+        source_node, source_attr = self._plug(source)
+        node, attr = self._plug(destination)
+        if attr in node.inputs:
+            if not flags.get('force'):
+                raise RuntimeError("'{}' is already connected to '{}'."
+                                   .format(source, destination))
+            self._disconnect(node, attr)
+        self._connect(source_node, source_attr, node, attr)
+
+    def disconnectAttr(self, source, destination, **flags):
+        node, attr = self._plug(destination)
+        self._disconnect(node, attr)
+
+    def listConnections(self, *objects, **flags):
+        names = self._flatten(objects) or list(self.selection)
+        source = flags.get('source', True)
+        destination = flags.get('destination', True)
+        result = []
+        for name in names:
+            node_name, _, attr = name.partition('.')
+            node = self._node(node_name)
+            links = []
+            if source:
+                links += [(a, other, other_attr) for a, (other, other_attr)
+                          in node.inputs.items()]
+            if destination:
+                links += node.outputs
+            for own_attr, other, other_attr in links:
+                if attr and own_attr != attr:
+                    continue
+                other_name = other.name
+                if flags.get('plugs'):
+                    other_name += '.' + other_attr
+                if flags.get('connections'):
+                    result += [node.name + '.' + own_attr, other_name]
+                else:
+                    result.append(other_name)
+        return result or None
+
+    def listRelatives(self, *objects, **flags):
+        result = []
+        for name in self._flatten(objects) or self.selection:
+            node = self._node(name)
+            if flags.get('parent'):
+                related = [node.parent] if node.parent else []
+            elif flags.get('allDescendents'):
+                related = self._descendants(node)
+            else:
+                related = list(node.children)
+                if flags.get('shapes'):
+                    related = [r for r in related if r.type in SHAPE_TYPES]
+            node_type = flags.get('type')
+            if node_type:
+                related = [r for r in related if r.type == node_type]
+            result += [self._path(r) if flags.get('fullPath') else r.name
+                       for r in related]
+        return result or None
+
+    # Internals
+
+    def _flatten(self, items):
+        flat = []
+        for item in items:
+            if isinstance(item, (list, tuple)):
+                flat += self._flatten(item)
+            elif item is not None:
+                flat.append(item)
+        return flat
+
+    def _node(self, name):
+        node = self.nodes.get(name.split('|')[-1])
+        if node is None:
+            raise ValueError("No object matches name: " + name)
+        return node
+
+    def _plug(self, plug):
+        node_name, _, attr = plug.partition('.')
+        return self._node(node_name), attr
+
+    def _path(self, node):
+        path = ''
+        while node is not None:
+            path = '|' + node.name + path
+            node = node.parent
+        return path
+
+    # Maya's clash renaming: strip trailing digits and count up
+    # Clashing names are numbered like Maya does, renames counts them
+    def _unique(self, name):
+        if name not in self.nodes:
+            return name
+        self.renames += 1
+        base = name.rstrip('0123456789')
+        index = self._next_index.get(base, 1)
+        while base + str(index) in self.nodes:
+            index += 1
+        self._next_index[base] = index + 1
+        return base + str(index)
+
+    def _create(self, node_type, name, parent=None):
+        node = FakeNode(self._unique(name), node_type)
+        self.nodes[node.name] = node
+        if parent is not None:
+            self._reparent(node, parent)
+        return node
+
+    def _delete(self, node):
+        for child in list(node.children):
+            if child.parent is not node or child.instances:
+                # Instanced elsewhere, only this instance goes
+                node.children.remove(child)
+                if child.parent is node:
+                    child.parent = child.instances.pop(0)
+                else:
+                    child.instances.remove(node)
+                continue
+            self._delete(child)
+        for other in node.instances:
+            other.children.remove(node)
+        self._reparent(node, None)
+        for attr in list(node.inputs):
+            self._disconnect(node, attr)
+        for _, other, other_attr in list(node.outputs):
+            self._disconnect(other, other_attr)
+        del self.nodes[node.name]
+
+    def _reparent(self, node, parent):
+        self._moved(node)
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        node.parent = parent
+        if parent is not None:
+            parent.children.append(node)
+
+    def _preorder(self, node, parent=None):
+        result = [(node, parent or node.parent)]
+        for child in node.children:
+            result += self._preorder(child, node)
+        return result
+
+    def _dag_paths(self, node, path):
+        result = [(node, path)]
+        for child in node.children:
+            result += self._dag_paths(child, path + '|' + child.name)
+        return result
+
+    def _descendants(self, node):
+        result = []
+        for child in node.children:
+            result += self._descendants(child) + [child]
+        return result
+
+    def _connect(self, source, source_attr, node, attr):
+        node.inputs[attr] = (source, source_attr)
+        source.outputs.append((source_attr, node, attr))
+
+    def _disconnect(self, node, attr):
+        source, source_attr = node.inputs.pop(attr)
+        source.outputs.remove((source_attr, node, attr))
+
+    def _has_attr(self, node, attr):
+        base = attr.split('[')[0].split('.')[0]
+        if base in node.dynamic or base in node.values:
+            return True
+        if not node.is_transform:
+            return True  # Built in attributes of other types aren't known
+        if base[:-1] in VECTOR_ATTRS and base[-1] in 'XYZ':
+            base = base[:-1]
+        if base == 'jointOrient':
+            return node.type == 'joint'
+        return base in VECTOR_ATTRS or base in MATRIX_ATTRS or \
+            base in TRANSFORM_ATTRS
+
+    def _vector(self, node, attr):
+        if attr not in node.values:
+            node.values[attr] = list(VECTOR_ATTRS[attr])
+        return node.values[attr]
+
+    # Rotation and joint orient, without scale or translation
+    def _rotation_matrix(self, node):
+        matrix = limb_utils.compose_matrix(
+            rotation=self._vector(node, 'rotate'))
+        if node.type == 'joint':
+            matrix = limb_utils.mult_matrix(matrix, limb_utils.compose_matrix(
+                rotation=self._vector(node, 'jointOrient')))
+        return matrix
+
+    # S * R * jointOrient * T, pivots are left out
+    def _local(self, node):
+        if not node.is_transform:
+            return list(limb_utils.IDENTITY_MATRIX)
+        scale = self._vector(node, 'scale')
+        matrix = [scale[0], 0.0, 0.0, 0.0, 0.0, scale[1], 0.0, 0.0,
+                  0.0, 0.0, scale[2], 0.0, 0.0, 0.0, 0.0, 1.0]
+        matrix = limb_utils.mult_matrix(matrix, self._rotation_matrix(node))
+        matrix[12:15] = self._vector(node, 'translate')
+        return matrix
+
+    # offsetParentMatrix * parent world, what the local matrix sits on
+    def _base(self, node):
+        matrix = node.values.get('offsetParentMatrix',
+                                 limb_utils.IDENTITY_MATRIX)
+        if node.parent is not None:
+            matrix = limb_utils.mult_matrix(matrix, self._world(node.parent))
+        return list(matrix)
+
+    def _world(self, node):
+        if not node.is_dag:
+            return list(limb_utils.IDENTITY_MATRIX)
+        if node not in self._worlds:
+            self._worlds[node] = limb_utils.mult_matrix(self._local(node),
+                                                        self._base(node))
+        return list(self._worlds[node])
+
+    # Forgets the world matrices a change to node can move. Long chains
+    # stay linear to query since each world matrix is computed once.
+    def _moved(self, node):
+        if node in self._worlds:
+            del self._worlds[node]
+            for child in self._descendants(node):
+                self._worlds.pop(child, None)
+
+    def _matrix_attr(self, node, attr):
+        if attr == 'offsetParentMatrix':
+            return list(node.values.get('offsetParentMatrix',
+                                        limb_utils.IDENTITY_MATRIX))
+        if attr.startswith('parent'):
+            matrix = self._world(node.parent) if node.parent else \
+                list(limb_utils.IDENTITY_MATRIX)
+        elif attr.startswith('world'):
+            matrix = self._world(node)
+        else:
+            matrix = self._local(node)
+        if 'Inverse' in attr or attr.startswith('inverse'):
+            matrix = limb_utils.inverse_matrix(matrix)
+        return matrix
+
+    def _set_local(self, node, matrix):
+        self._moved(node)
+        scale = [limb_utils.point_distance(matrix[r * 4:r * 4 + 3],
+                                           (0, 0, 0)) for r in range(3)]
+        rotation = limb_utils.orthonormal_matrix(matrix)
+        if node.type == 'joint':
+            rotation = limb_utils.mult_matrix(
+                rotation, limb_utils.inverse_matrix(limb_utils.compose_matrix(
+                    rotation=self._vector(node, 'jointOrient'))))
+        node.values['scale'] = scale
+        node.values['rotate'] = limb_utils.get_euler_rotation(rotation)
+        node.values['translate'] = limb_utils.get_translation(matrix)
+
+    def _set_world(self, node, matrix):
+        if not node.is_transform:
+            return
+        self._set_local(node, limb_utils.mult_matrix(
+            matrix, limb_utils.inverse_matrix(self._base(node))))
+
+    def _set_world_translation(self, node, translation):
+        self._moved(node)
+        node.values['translate'] = limb_utils.transform_point(
+            translation, limb_utils.inverse_matrix(self._base(node)))
+
+    def _set_world_rotation(self, node, rotation):
+        self._moved(node)
+        base = limb_utils.orthonormal_matrix(self._base(node))
+        base[12:15] = [0.0, 0.0, 0.0]
+        local = limb_utils.mult_matrix(limb_utils.compose_matrix(
+            rotation=rotation), limb_utils.inverse_matrix(base))
+        if node.type == 'joint':
+            local = limb_utils.mult_matrix(
+                local, limb_utils.inverse_matrix(limb_utils.compose_matrix(
+                    rotation=self._vector(node, 'jointOrient'))))
+        node.values['rotate'] = limb_utils.get_euler_rotation(local)
+
+    def _constrain(self, constraint_type, objects, flags):
+        objects = self._flatten(objects)
+        driven = self._node(objects[-1])
+        name = flags.get('name') or '{}_{}1'.format(driven.name,
+                                                    constraint_type)
+        node = self._create(constraint_type, name, driven)
+        node.values['maintainOffset'] = bool(flags.get('maintainOffset'))
+        for i, target_name in enumerate(objects[:-1]):
+            target = self._node(target_name)
+            prefix = 'target[{}].target'.format(i)
+            self._connect(target, 'parentMatrix[0]', node,
+                          prefix + 'ParentMatrix')
+            for attr in CONSTRAINT_TARGET_ATTRS[constraint_type]:
+                self._connect(target, attr, node,
+                              prefix + attr[0].upper() + attr[1:])
+            weight = '{}W{}'.format(target.name, i)
+            node.dynamic.add(weight)
+            node.values[weight] = 1.0
+            self._connect(node, weight, node, prefix + 'Weight')
+        self._connect(driven, 'parentInverseMatrix[0]', node,
+                      'constraintParentInverseMatrix')
+        for output, attr in CONSTRAINT_OUTPUTS[constraint_type]:
+            for axis in 'XYZ':
+                self.connectAttr(node.name + '.' + output + axis,
+                                 driven.name + '.' + attr + axis)
+        return [node.name]
+
+
+SCENE = FakeScene()
+
+
+# Tokens of the MEL the fake runs: backquoted commands, quoted strings and
+# bare words or numbers
+MEL_TOKEN = re.compile(r'`[^`]*`|"[^"]*"|\S+')
+# Flags without a value, in query mode none of them take one
+MEL_SWITCHES = ['ignoreShape', 'maintainOffset', 'query']
+MEL_BOOLEANS = {'true': True, 'yes': True, 'on': True,
+                'false': False, 'no': False, 'off': False}
+
+
+# Runs the MEL rig_plan.plan_script() writes, one command per line, through
+# the fake scene's commands. Returns the last command's result.
+def _mel_eval(command):
+    result = None
+    for line in command.splitlines():
+        line = line.strip().rstrip(';')
+        if line:
+            result = _mel_command(line)
+    return result
+
+
+def _mel_value(token):
+    if token.startswith('`'):
+        return _mel_command(token[1:-1])
+    if token.startswith('"'):
+        return token[1:-1]
+    if token in MEL_BOOLEANS:
+        return MEL_BOOLEANS[token]
+    for number in [int, float]:
+        try:
+            return number(token)
+        except ValueError:
+            pass
+    return token
+
+
+def _mel_command(line):
+    tokens = MEL_TOKEN.findall(line)
+    command = getattr(SCENE, tokens[0], None)
+    if tokens[0].startswith('_') or not callable(command):
+        raise RuntimeError("Cannot find procedure \"{}\"."
+                           .format(tokens[0]))
+    args, flags = [], {}
+    i = 1
+    while i < len(tokens):
+        if re.match(r'-[A-Za-z]', tokens[i]):
+            flag = tokens[i][1:]
+            if flag in MEL_SWITCHES or flags.get('query'):
+                flags[flag] = True
+            else:
+                i += 1
+                flags[flag] = _mel_value(tokens[i])
+        else:
+            args.append(_mel_value(tokens[i]))
+        i += 1
+    # Matrices, knots and points as the Python command takes them
+    if flags.get('type') == 'matrix':
+        args = [args[0], args[1:]]
+    if flags.get('type') == 'nurbsCurve':
+        knot_count = args[6]
+        knots = args[7:7 + knot_count]
+        coords = args[8 + knot_count:]
+        args = args[:6] + [knots, knot_count, args[7 + knot_count]] + \
+            [coords[j:j + 3] for j in range(0, len(coords), 3)]
+    return command(*args, **flags)
+
+
+# Makes 'import maya.cmds' resolve to the fake scene when Maya can't be
+# imported. Returns the scene, or None when the real maya.cmds is used.
+def install():
+    if isinstance(sys.modules.get('maya.cmds'), FakeScene):
+        return sys.modules['maya.cmds']
+    try:
+        import maya.cmds
+        return None
+    except ImportError:
+        pass
+    maya = types.ModuleType('maya')
+    maya.__path__ = []
+    mel = types.ModuleType('maya.mel')
+    mel.eval = _mel_eval
+    maya.cmds = SCENE
+    maya.mel = mel
+    sys.modules.update({'maya': maya, 'maya.cmds': SCENE, 'maya.mel': mel})
+    # Modules imported without Maya fell back to cmds = None
+    for name, module in list(sys.modules.items()):
+        if name.startswith('lrig.') and getattr(module, 'cmds', 0) is None:
+            module.cmds = SCENE
+            if getattr(module, 'mel', 0) is None:
+                module.mel = mel
+    return SCENE
+
+
+# Empties the fake scene, like File > New
+def new_scene():
+    SCENE.file(new=True, force=True)
+    return SCENE
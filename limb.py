@@ -1,8 +1,6 @@
 import maya.cmds as cmds
-import maya.mel as mel
 import lrig.limb_utils as limb_utils
-import importlib
-importlib.reload(limb_utils)
+import lrig.rig_plan as rig_plan
 
 TRANSLATE = "translate"
 ROTATE = "rotate"
@@ -15,25 +13,84 @@ LEFT_POLE_VECTOR = "LeftShoulder_PV"
 arm_aliases = {LEFT_SHOULDER: 'Shoulder',
                LEFT_ELBOW: 'Elbow',
                LEFT_WRIST: 'Wrist'}
+# Progress steps of a build, by backend
+BUILD_STEPS = ['chains', 'blend', 'fk_controls', 'ik_controls', 'stretch',
+               'hierarchy']
+PLAN_STEPS = ['plan', 'apply']
 
 
 def create_limb(side='L', limb='arm',
                 joints=[LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST],
                 aliases=arm_aliases, pole_vector=LEFT_POLE_VECTOR,
                 primary_axis='X', up_axis='Y',
-                del_guides=False, stretch=True, color_dict={}):
-   # Checks
-    if side not in ['L', 'R']:
-        cmds.error("Must specify L (left) or R (right) for side")
-    if limb not in ['arm', 'leg']:
-        cmds.error("Must specify arm or leg for limb")
-    if len(joints) != 3 or len(aliases) != 3:
-        cmds.error("Must create 3 joints for a limb")
-
+                del_guides=False, stretch=True, color_dict={},
+                backend='cmds', blend_mode='blendColors', stretch_node=False,
+                cache=None, progress=None, return_names=False):
+    # 'plan' and 'api' compute the rig up front and apply it in bulk. With
+    # a cache (a directory or rig_cache.RigCache) the built rig is looked
+    # up by a hash of the guides and arguments and loaded in one go, it is
+    # only planned and applied on a miss.
+    if cache is not None and backend not in ['plan', 'api']:
+        cmds.error("Cached builds need the plan or api backend")
+    if backend not in ['cmds', 'plan', 'api']:
+        cmds.error("Backend must be cmds, plan or api")
+    aliases = rig_plan.check_limb(side, limb, joints, aliases)
+
+    # The build is one undo step with refresh and evaluation held off
+    # until it's done. progress(step, index, total) is called with each of
+    # BUILD_STEPS or PLAN_STEPS and returning True cancels. A failed or
+    # cancelled build deletes what it created. Names are allocated up
+    # front, so a limb that already exists only changes the numbering;
+    # with return_names the map of planned to given names is returned
+    # instead of the top group.
+    patterns = rig_plan.name_patterns("Left" if side == 'L' else "Right",
+                                      limb, [aliases[j] for j in joints])
+    if backend in ['plan', 'api']:
+        with limb_utils.build_session('create_limb', PLAN_STEPS, progress,
+                                      patterns=patterns):
+            if backend == 'api':
+                import lrig.api_backend as api_backend
+                apply, load = api_backend.build_plan, api_backend.build_script
+            else:
+                apply, load = rig_plan.apply_plan, rig_plan.load_script
+            if cache is not None:
+                import lrig.rig_cache as rig_cache
+                names, outputs = rig_cache.cached_build(
+                    cache, apply, load, side=side, limb=limb, joints=joints,
+                    aliases=aliases, pole_vector=pole_vector,
+                    primary_axis=primary_axis, up_axis=up_axis,
+                    del_guides=del_guides, stretch=stretch,
+                    color_dict=color_dict, blend_mode=blend_mode,
+                    stretch_node=stretch_node)
+            else:
+                limb_utils.build_step('plan')
+                plan = rig_plan.plan_limb(side, limb, joints, aliases,
+                                          pole_vector, primary_axis, up_axis,
+                                          stretch, blend_mode=blend_mode,
+                                          stretch_node=stretch_node)
+                limb_utils.build_step('apply')
+                names, outputs = apply(plan), plan.outputs
+            return names if return_names else \
+                names[outputs['top_group']]
+
+    # World space queries are cached for the whole build, wrap the call in
+    # limb_utils.transform_cache() to read the hit/miss counts afterwards
+    with limb_utils.build_session('create_limb', BUILD_STEPS, progress,
+                                  patterns=patterns):
+        with limb_utils.transform_cache():
+            all_group = _build_limb(side, limb, joints, aliases, pole_vector,
+                                    primary_axis, up_axis, stretch,
+                                    blend_mode, stretch_node)
+        return limb_utils.allocated_names() if return_names else all_group
+
+
+def _build_limb(side, limb, joints, aliases, pole_vector, primary_axis,
+                up_axis, stretch, blend_mode, stretch_node):
     side_name = "Left" if side == 'L' else "Right"
     limb_name = limb.capitalize()
     base_name = side_name + limb_name
 
+    limb_utils.build_step('chains')
     ik_chain = create_chain(side_name, joints, aliases, 'IK')
     fk_chain = create_chain(side_name, joints, aliases, 'FK')
     bind_chain = create_chain(side_name, joints, aliases, 'Bind')
@@ -41,16 +98,19 @@ def create_limb(side='L', limb='arm',
     # Find and create a good size for the control based on model size
     arm_len = limb_utils.distance(fk_chain[0], fk_chain[-1])
     size = arm_len/5.0
+    limb_utils.build_step('blend')
     plus_ctrl_curve = create_blend_control(
         size, up_axis, bind_chain[-1], base_name)
 
     # Blend IK/FK with blend color nodes to create bind limb
-    blend_ik_fk(ik_chain, fk_chain, bind_chain, base_name)
+    blend_ik_fk(ik_chain, fk_chain, bind_chain, base_name, blend_mode)
 
     # Create FK Controls
+    limb_utils.build_step('fk_controls')
     fk_ctrls = create_fk_controls(fk_chain, primary_axis, size)
 
     # Create IK Controls and Handle
+    limb_utils.build_step('ik_controls')
     ik_ctrls = create_ik_controls_and_handle(
         base_name, ik_chain, pole_vector, primary_axis, size)
     ik_base_ctrl = ik_ctrls['base_ctrl']
@@ -59,22 +119,24 @@ def create_limb(side='L', limb='arm',
     ik_pv_ctrl = ik_ctrls['pv_ctrl']
     no_xform_list = [ik_ctrls['handle']]
 
+    limb_utils.build_step('stretch')
     if stretch:
-        ik_stretch_ctrls = add_ik_stretch(base_name, 'arm', ik_chain,
+        ik_stretch_ctrls = add_ik_stretch(base_name, limb, ik_chain,
                                           ik_base_ctrl, ik_world_ctrl, ik_local_ctrl,
-                                          primary_axis)
+                                          primary_axis, stretch_node)
         add_fk_stretch(fk_chain, fk_ctrls, primary_axis)
         no_xform_list += ik_stretch_ctrls['measure_locs']
 
     # Clean hiearchy
-    fk_ctrl_group = cmds.group(empty=True, name=base_name + '_FK_CTRL_GROUP')
-    ik_ctrl_group = cmds.group(empty=True, name=base_name + '_IK_CTRL_GROUP')
-    skeleton_ctrl_group = cmds.group(
-        empty=True, name=base_name + '_skeleton_GROUP')
-    no_xform_group = cmds.group(
-        empty=True, name=base_name + '_noXform_GROUP')
-    limb_rig_group = cmds.group(empty=True, name=base_name + '_rig_GROUP')
-    all_group = cmds.group(empty=True, name=base_name.upper())
+    limb_utils.build_step('hierarchy')
+    fk_ctrl_group, ik_ctrl_group, skeleton_ctrl_group, no_xform_group, \
+        limb_rig_group, all_group = [
+            cmds.group(empty=True, name=limb_utils.unique_name(name))
+            for name in [base_name + '_FK_CTRL_GROUP',
+                         base_name + '_IK_CTRL_GROUP',
+                         base_name + '_skeleton_GROUP',
+                         base_name + '_noXform_GROUP',
+                         base_name + '_rig_GROUP', base_name.upper()]]
 
     # Group ik and fk controls
     cmds.parent(ik_world_ctrl, ik_pv_ctrl, ik_base_ctrl, ik_ctrl_group)
@@ -90,6 +152,9 @@ def create_limb(side='L', limb='arm',
     cmds.parent(fk_ctrl_group, ik_ctrl_group, no_xform_group,
                 fk_chain[0], ik_chain[0], plus_ctrl_curve, limb_rig_group)
     cmds.parent(skeleton_ctrl_group, limb_rig_group, all_group)
+    limb_utils.reparented([ik_world_ctrl, ik_pv_ctrl, ik_base_ctrl,
+                           fk_ctrls[0], bind_chain[0], fk_chain[0],
+                           ik_chain[0], plus_ctrl_curve] + no_xform_list)
 
     limb_utils.transfer_pivots(
         sel=[bind_chain[0], skeleton_ctrl_group, limb_rig_group, fk_ctrl_group, ik_ctrl_group])
@@ -100,15 +165,170 @@ def create_limb(side='L', limb='arm',
                  defaultValue=1, keyable=True, longName='globalScale')
     [cmds.connectAttr(all_group + '.globalScale', all_group +
                       '.scale' + axis) for axis in 'XYZ']
-    if stretch:
+    if stretch and stretch_node:
+        cmds.connectAttr(all_group + '.globalScale',
+                         ik_stretch_ctrls['stretch_node'] + '.globalScale')
+    elif stretch:
         gs_mdl = cmds.createNode(
-            'multDoubleLinear', name=base_name + "_globalScale_MDL")
+            'multDoubleLinear',
+            name=limb_utils.unique_name(base_name + "_globalScale_MDL"))
         cmds.setAttr(gs_mdl + '.input1', ik_stretch_ctrls['total_length'])
         cmds.connectAttr(all_group + '.globalScale', gs_mdl + '.input2')
         cmds.connectAttr(gs_mdl + '.output',
                          ik_stretch_ctrls['mdn'] + '.input2X')
         cmds.connectAttr(gs_mdl + '.output',
                          ik_stretch_ctrls['cnd'] + '.secondTerm')
+    return all_group
+
+
+# Moves an existing limb rig onto its guides without rebuilding it. Only
+# what depends on guide positions is rewritten: joint placement, control
+# offsetParentMatrix, constraint rest offsets, the stretch length and the
+# FK stretch offsets. Connected plugs (animation included) and control
+# channels are left alone, control shapes keep their size, and the rig's
+# groups are expected to be at rest. Returns the plugs that were written.
+def update_limb(side='L', limb='arm',
+                joints=[LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST],
+                aliases=arm_aliases, pole_vector=LEFT_POLE_VECTOR,
+                primary_axis='X', names=None):
+    # names maps planned names to the nodes the build gave them, as
+    # create_limb(return_names=True) returns it, so a numbered copy is
+    # updated too. Without names the limb's nodes have their planned names.
+    names = names or {}
+
+    def given(name):
+        return names.get(name, name)
+
+    side_name = "Left" if side == 'L' else "Right"
+    base_name = side_name + limb.capitalize()
+    if not cmds.objExists(given(base_name + '_rig_GROUP')):
+        cmds.error("No limb rig named " + base_name)
+    with limb_utils.transform_cache():
+        guide_matrices = rig_plan.read_guides(list(joints) + [pole_vector])
+    world, positions, pv_position, local = rig_plan.guide_placement(
+        guide_matrices, joints, pole_vector)
+    axis = primary_axis[-1]
+    written = []
+
+    def write(plug, *value, **flags):
+        cmds.setAttr(plug, *value, **flags)
+        written.append(plug)
+
+    # The blend control keeps its offset from the wrist, which cmds builds
+    # carry in its offsetParentMatrix and plan builds in its shape. At rest
+    # the FK wrist is where the bind wrist is.
+    blend_ctrl = given(base_name + "_Control")
+    fk_wrist = given('{}{}_FK_Joint'.format(side_name, aliases[joints[-1]]))
+    blend_offset = limb_utils.offset_matrix(
+        cmds.getAttr(blend_ctrl + '.offsetParentMatrix'),
+        limb_utils.world_matrix(fk_wrist))
+
+    # Joint placement, as create_chain froze it. Blended or constrained
+    # channels are skipped, and so are joints placed by a blendMatrix.
+    chains = {}
+    for chain_type in ['IK', 'FK', 'Bind']:
+        chain = [given('{}{}_{}_Joint'.format(side_name, aliases[j],
+                                              chain_type))
+                 for j in joints]
+        for joint, matrix in zip(chain, local):
+            connected = _connected_attrs(joint)
+            if 'offsetParentMatrix' in connected:
+                continue
+            for attr, value in [
+                    (TRANSLATE, limb_utils.get_translation(matrix)),
+                    ('jointOrient', limb_utils.get_euler_rotation(matrix))]:
+                if not connected & set([attr] + [attr + a for a in 'XYZ']):
+                    write(joint + '.' + attr, *value)
+        chains[chain_type] = chain
+
+    # Controls frozen in place keep their old position as their pivot, the
+    # offset moves them from there
+    def rest(ctrl, position):
+        pivot = cmds.getAttr(ctrl + '.rotatePivot')[0]
+        return limb_utils.translation_matrix(
+            [p - q for p, q in zip(position, pivot)])
+
+    fk_ctrls = [given('{}{}_FK_Control'.format(side_name, aliases[j]))
+                for j in joints]
+    world_ctrl = given(base_name + "_IK_Control")
+    base_ctrl = given(base_name + "_Base_Control")
+    pv_ctrl = given(base_name + "_PV_Control")
+    world_rest = rest(world_ctrl, positions[-1])
+    base_rest = rest(base_ctrl, positions[0])
+    for ctrl, matrix in [
+            (fk_ctrls[0], world[0]),
+            (blend_ctrl, limb_utils.mult_matrix(blend_offset, world[-1])),
+            (world_ctrl, world_rest), (base_ctrl, base_rest),
+            (given(base_name + "_Local_IK_Control"),
+             limb_utils.offset_matrix(world[-1], world_rest)),
+            (pv_ctrl, rest(pv_ctrl, pv_position))]:
+        write(ctrl + '.offsetParentMatrix', matrix, type='matrix')
+
+    # Rest offsets of the maintainOffset constraints, named after the
+    # planned name of the node they drive
+    wrist_position = limb_utils.translation_matrix(positions[-1])
+    for driven, offset in [
+            (base_name + "_Control", limb_utils.IDENTITY_MATRIX),
+            ('{}{}_IK_Joint'.format(side_name, aliases[joints[0]]),
+             limb_utils.offset_matrix(world[0], base_rest)),
+            (base_name + "IK_Handle",
+             limb_utils.offset_matrix(wrist_position, world[-1]))]:
+        constraint = given(driven + '_parentConstraint1')
+        write(constraint + '.target[0].targetOffsetTranslate',
+              *limb_utils.get_translation(offset))
+        write(constraint + '.target[0].targetOffsetRotate',
+              *limb_utils.get_euler_rotation(offset))
+
+    # IK stretch lengths
+    upper_length = limb_utils.point_distance(positions[0], positions[1])
+    lower_length = limb_utils.point_distance(positions[1], positions[2])
+    stretch_node = given(base_name + "_stretch_LSN")
+    if cmds.objExists(stretch_node):
+        write(stretch_node + ".upperLength", upper_length)
+        write(stretch_node + ".lowerLength", lower_length)
+    else:
+        for plug in [given(base_name + "_globalScale_MDL") + ".input1",
+                     given(base_name + "_stretchFactor") + ".input2X",
+                     given(base_name + "_stretch_condition") +
+                     ".secondTerm"]:
+            if cmds.objExists(plug.partition('.')[0]) and not \
+                    cmds.listConnections(plug, source=True,
+                                         destination=False):
+                write(plug, upper_length + lower_length)
+
+    # FK controls past the first sit on the FK stretch locator when there
+    # is one, found through the connection rather than its name
+    for i, ctrl in enumerate(fk_ctrls[1:], 1):
+        offset_loc = cmds.listConnections(ctrl + '.offsetParentMatrix',
+                                          source=True, destination=False)
+        if not offset_loc:
+            write(ctrl + '.offsetParentMatrix', local[i], type='matrix')
+            continue
+        offset_loc = offset_loc[0]
+        offset = limb_utils.get_translation(local[i])
+        write(offset_loc + '.' + ROTATE,
+              *limb_utils.get_euler_rotation(local[i]))
+        for a, value in zip('XYZ', offset):
+            if a != axis:
+                write(offset_loc + '.' + TRANSLATE + a, value)
+        stretch_mdl = cmds.listConnections(offset_loc + '.translate' + axis,
+                                           source=True, destination=False)
+        if stretch_mdl:
+            write(stretch_mdl[0] + '.input1', offset['XYZ'.index(axis)])
+
+    for group in ['_skeleton_GROUP', '_rig_GROUP', '_FK_CTRL_GROUP',
+                  '_IK_CTRL_GROUP']:
+        group = given(base_name + group)
+        cmds.xform(group, worldSpace=True, pivots=positions[0])
+        written.append(group + '.rotatePivot')
+    return written
+
+
+# Attributes of node with an incoming connection
+def _connected_attrs(node):
+    plugs = cmds.listConnections(node, source=True, destination=False,
+                                 connections=True, plugs=True) or []
+    return set(plug.partition('.')[2] for plug in plugs[::2])
 
 # Returns a list of joints for an IK, FK, or bind chain
 
@@ -117,12 +337,12 @@ def create_chain(side, joints, aliases, chain_type='IK'):
     chain = []
     idx = 0
     for j in joints:
+        name = limb_utils.unique_name('{}{}_{}_Joint'.format(
+            side, aliases[j], chain_type))
         if idx == 0:  # Root joint, no parent
-            joint = cmds.joint(None, name='{}{}_{}_Joint'.format(
-                side, aliases[j], chain_type))
+            joint = cmds.joint(None, name=name)
         else:
-            joint = cmds.joint(chain[idx-1],
-                               name='{}{}_{}_Joint'.format(side, aliases[j], chain_type))
+            joint = cmds.joint(chain[idx-1], name=name)
         limb_utils.snap(joint, j, freeze_transform=True)
         chain.append(joint)
         idx += 1
@@ -130,63 +350,114 @@ def create_chain(side, joints, aliases, chain_type='IK'):
 
 
 def create_blend_control(size=1, up_axis='Y', bind_joint='LeftWrist_Bind_Joint', base_name=""):
-    plus_shape_coords = [[-0.333, 0.333, 0.0], [-0.333, 1.0, 0.0],
-                         [0.333, 1.0, 0.0], [0.333, 0.333, 0.0],
-                         [1.0, 0.333, 0.0], [1.0, -0.333, 0.0],
-                         [0.333, -0.333, 0.0], [0.333, -1.0, 0.0],
-                         [-0.333, -1.0, 0.0], [-0.333, -0.333, 0.0],
-                         [-1.0, -0.333, 0.0], [-1.0, 0.333, 0.0],
-                         [-0.333, 0.333, 0.0]]
-    plus_control_curve = limb_utils.create_curve(
-        plus_shape_coords, base_name + "_Control")
-    limb_utils.align_lras(snap_align=True, sel=[
-                          plus_control_curve, bind_joint])
-
-    cmds.setAttr(plus_control_curve + '.' + SCALE,
-                 size * 0.25, size * 0.25, size * 0.25)
-    # Offset it from the model
-    offset = size * 1.5 * sum(limb_utils.get_axis_vector(up_axis))
-    cmds.setAttr(plus_control_curve + "." + TRANSLATE + up_axis[-1], offset)
-
-    # Freeze transformation
-    cmds.makeIdentity(plus_control_curve, apply=True, normal=False)
+    plus_control_curve = limb_utils.create_control(
+        base_name + "_Control", 'plus', size=size * 0.25)
+
+    # Sit on the joint, offset from the model along its up axis
+    up_offset = [size * 1.5 * a for a in limb_utils.get_axis_vector(up_axis)]
+    cmds.setAttr(plus_control_curve + '.offsetParentMatrix',
+                 limb_utils.mult_matrix(
+                     limb_utils.translation_matrix(up_offset),
+                     limb_utils.world_matrix(bind_joint)), type='matrix')
+    limb_utils.invalidate(plus_control_curve)
 
     # Parent constrain to wrist of our bind joint
-    cmds.parentConstraint(bind_joint, plus_control_curve, maintainOffset=True)
+    constrain('parentConstraint', bind_joint, plus_control_curve,
+              maintainOffset=True)
     # Add IK/FK switching
     cmds.addAttr(plus_control_curve, attributeType='double', min=0, max=1, defaultValue=1,
                  keyable=True, longName='iKfK')
     return plus_control_curve
 
 
-def blend_ik_fk(ik_chain, fk_chain, bind_chain, base_name):
-    parts = [b.replace("_Bind_Joint", '') for b in bind_chain]
+# Constrains driven to driver with the name rig_plan gives the constraint,
+# allocated like every other node. Returns the constraint.
+def constrain(constraint_type, driver, driven, **flags):
+    name = limb_utils.unique_name('{}_{}1'.format(
+        limb_utils.requested_name(driven), constraint_type))
+    return getattr(cmds, constraint_type)(driver, driven, name=name,
+                                          **flags)[0]
+
+
+# Nodes blend_ik_fk creates per joint in each mode
+BLEND_NODES_PER_JOINT = {'blendColors': 3, 'pairBlend': 2, 'blendMatrix': 1}
+
+
+def blend_node_count(blend_mode='blendColors', joint_count=3):
+    return BLEND_NODES_PER_JOINT[blend_mode] * joint_count
+
+
+# Blends the IK and FK chains into the bind chain and returns the nodes it
+# made. blendColors blends every channel linearly, pairBlend slerps
+# rotation and keeps one blendColors for scale, blendMatrix blends each
+# joint's local matrix and drives the bind joint's offsetParentMatrix.
+def blend_ik_fk(ik_chain, fk_chain, bind_chain, base_name,
+                blend_mode='blendColors'):
+    if blend_mode not in BLEND_NODES_PER_JOINT:
+        cmds.error("Blend mode must be blendColors, pairBlend or blendMatrix")
+    blend_attr = limb_utils.allocated_name(base_name + "_Control") + ".iKfK"
+    blend_nodes = []
+    parts = [limb_utils.requested_name(b).replace("_Bind_Joint", '')
+             for b in bind_chain]
     for ik, fk, bind, part in zip(ik_chain, fk_chain, bind_chain, parts):
-        for attr in [TRANSLATE, ROTATE, SCALE]:
-            blend_node = cmds.createNode('blendColors',
-                                         name=part + "_BCN")  # Blend Colors Node
+        if blend_mode == 'blendMatrix':
+            blend_node = cmds.createNode(
+                'blendMatrix', name=limb_utils.unique_name(part + "_BMX"))
+            cmds.connectAttr(fk + ".matrix", blend_node + ".inputMatrix")
+            cmds.connectAttr(ik + ".matrix",
+                             blend_node + ".target[0].targetMatrix")
+            cmds.connectAttr(blend_attr, blend_node + ".target[0].weight")
+            # The blended matrix replaces the joint's own placement
+            limb_utils.reset_transformation(bind, True, True, True)
+            cmds.setAttr(bind + ".jointOrient", 0, 0, 0)
+            cmds.connectAttr(blend_node + ".outputMatrix",
+                             bind + ".offsetParentMatrix")
+            blend_nodes.append(blend_node)
+            continue
+        attrs = [TRANSLATE, ROTATE, SCALE]
+        if blend_mode == 'pairBlend':
+            # weight 0 is input 1, so FK goes first
+            blend_node = cmds.createNode(
+                'pairBlend', name=limb_utils.unique_name(part + "_PBN"))
+            cmds.setAttr(blend_node + ".rotInterpolation", 1)  # Quaternions
+            for attr, source in [("Translate", fk), ("Rotate", fk)]:
+                cmds.connectAttr(source + "." + attr.lower(),
+                                 blend_node + ".in" + attr + "1")
+            for attr in ["Translate", "Rotate"]:
+                cmds.connectAttr(ik + "." + attr.lower(),
+                                 blend_node + ".in" + attr + "2")
+                cmds.connectAttr(blend_node + ".out" + attr,
+                                 bind + "." + attr.lower())
+            cmds.connectAttr(blend_attr, blend_node + ".weight")
+            blend_nodes.append(blend_node)
+            attrs = [SCALE]
+        for attr in attrs:
+            blend_node = cmds.createNode(  # Blend Colors Node
+                'blendColors',
+                name=limb_utils.unique_name('{}_{}_BCN'.format(part, attr)))
             cmds.connectAttr(ik + "." + attr, blend_node + ".color1")
             cmds.connectAttr(fk + "." + attr, blend_node + ".color2")
-            cmds.connectAttr(base_name + "_Control.iKfK",
-                             blend_node + ".blender")
+            cmds.connectAttr(blend_attr, blend_node + ".blender")
             cmds.connectAttr(blend_node + ".output", bind + "." + attr)
+            blend_nodes.append(blend_node)
+    return blend_nodes
 
 
 def create_fk_controls(fk_joints, axis='X', size=1):
-    primary_axis = limb_utils.get_axis_vector(axis)
     idx = 0
     fk_controls = []
     for fk in fk_joints:
-        # Create a circle
-        circle_ctrl = cmds.circle(radius=size, normal=primary_axis, degree=3,
-                                  name=fk.replace("_Joint", "_Control"))[0]
+        # Every FK control shares one circle
+        circle_ctrl = limb_utils.create_control(
+            limb_utils.requested_name(fk).replace("_Joint", "_Control"),
+            'circle', 3, 8, axis, size)
         # Parent control to the previous unless its the root
         if idx > 0:
             cmds.parent(circle_ctrl, fk_controls[idx-1])
         # Snap circles to the joint and point/orient constrain to joint
         ctrl_offset = limb_utils.align_lras(
-            snap_align=True, sel=[circle_ctrl, fk])
-        cmds.pointConstraint(circle_ctrl, fk)
+            snap_align=True, delete_history=False, sel=[circle_ctrl, fk])
+        constrain('pointConstraint', circle_ctrl, fk)
         # cmds.orientConstraint(circle_ctrl, fk)  # This line may need work?
         cmds.connectAttr(circle_ctrl + '.rotate', fk + '.rotate')
         fk_controls.append(circle_ctrl)
@@ -195,47 +466,46 @@ def create_fk_controls(fk_joints, axis='X', size=1):
 
 
 def create_ik_controls_and_handle(base_name, ik_joints, pole_vector, axis='X', size=1):
+    # Controls only take the position of what they sit on, set through
+    # their offsetParentMatrix since library shapes can't be frozen
+    def place(ctrl, node):
+        position = limb_utils.get_translation(limb_utils.world_matrix(node))
+        cmds.setAttr(ctrl + '.offsetParentMatrix',
+                     limb_utils.translation_matrix(position), type='matrix')
+        limb_utils.invalidate(ctrl)
+
     # Create world control for wrist
-    primary_axis = limb_utils.get_axis_vector(axis)
-    world_ctrl = cmds.circle(radius=size*1.2, normal=primary_axis, degree=1, sections=4,
-                             constructionHistory=False, name=base_name + "_IK_Control")[0]
-    cmds.setAttr(world_ctrl + '.rotate' + axis[-1], 45)
-    limb_utils.snap(world_ctrl, ik_joints[-1],
-                    freeze_transform=True, rotate=False)
-
-    # Create local control for wrist
-    local_ctrl = cmds.circle(radius=size*1.2, normal=primary_axis, degree=1, sections=4,
-                             constructionHistory=False, name=base_name + "_Local_IK_Control")[0]
-    cmds.setAttr(local_ctrl + '.rotate' + axis[-1], 45)
-    local_off = limb_utils.align_lras(
-        snap_align=True, sel=[local_ctrl, ik_joints[-1]])
-
-    # Parent local to world
-    cmds.parent(local_off, world_ctrl)
+    world_ctrl = limb_utils.create_control(
+        base_name + "_IK_Control", 'square', normal=axis, size=size * 1.2)
+    place(world_ctrl, ik_joints[-1])
+
+    # Create local control for wrist, under the world control
+    local_ctrl = limb_utils.create_control(
+        base_name + "_Local_IK_Control", 'circle', 1, 4, axis, size * 1.2,
+        parent=world_ctrl)
+    limb_utils.align_lras(snap_align=True, delete_history=False,
+                          sel=[local_ctrl, ik_joints[-1]])
 
     # Create pole vector control
-    pv_ctrl_points = [[0, 1, 0], [0, -1, 0], [0, 0, 0],
-                      [-1, 0, 0], [1, 0, 0], [0, 0, 0],
-                      [0, 0, -1], [0, 0, 1]]
-    pv_ctrl = limb_utils.create_curve(
-        pv_ctrl_points, name=base_name + "_PV_Control")
-    cmds.setAttr(pv_ctrl + "." + SCALE, size * 0.25, size * 0.25, size * 0.25)
-    limb_utils.snap(pv_ctrl, pole_vector, rotate=False, freeze_transform=True)
+    pv_ctrl = limb_utils.create_control(
+        base_name + "_PV_Control", 'cross', size=size * 0.25)
+    place(pv_ctrl, pole_vector)
 
     # Create Base Control at shoulder
-    base_ctrl = cmds.circle(radius=size*1.2, normal=primary_axis, degree=1, sections=4,
-                            constructionHistory=False, name=base_name + "_Base_Control")[0]
-    cmds.setAttr(base_ctrl + '.rotate' + axis[-1], 45)
-    limb_utils.snap(base_ctrl, ik_joints[0],
-                    rotate=False, freeze_transform=True)
-    cmds.parentConstraint(base_ctrl, ik_joints[0], maintainOffset=True)
+    base_ctrl = limb_utils.create_control(
+        base_name + "_Base_Control", 'square', normal=axis, size=size * 1.2)
+    place(base_ctrl, ik_joints[0])
+    constrain('parentConstraint', base_ctrl, ik_joints[0], maintainOffset=True)
 
    # Create IK Handle
-    ik_handle = cmds.ikHandle(name=base_name + "IK_Handle", startJoint=ik_joints[0],
-                              endEffector=ik_joints[-1], sticky='sticky', solver='ikRPsolver',
-                              setupForRPsolver=True)[0]
-    cmds.parentConstraint(local_ctrl, ik_handle, maintainOffset=True)
-    cmds.poleVectorConstraint(pv_ctrl, ik_handle)
+    ik_handle, effector = cmds.ikHandle(
+        name=limb_utils.unique_name(base_name + "IK_Handle"),
+        startJoint=ik_joints[0], endEffector=ik_joints[-1], sticky='sticky',
+        solver='ikRPsolver', setupForRPsolver=True)
+    cmds.rename(effector, limb_utils.unique_name(
+        rig_plan.effector_name(base_name + "IK_Handle")))
+    constrain('parentConstraint', local_ctrl, ik_handle, maintainOffset=True)
+    constrain('poleVectorConstraint', pv_ctrl, ik_handle)
 
     control_dict = {'base_ctrl': base_ctrl,
                     'world_ctrl': world_ctrl,
@@ -245,7 +515,8 @@ def create_ik_controls_and_handle(base_name, ik_joints, pole_vector, axis='X', s
     return control_dict
 
 
-def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_local_ctrl, axis):
+def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_local_ctrl, axis,
+                   use_node=False):
     up_name = "up" + limb.capitalize()
     lo_name = "lo" + limb.capitalize()
     # Add on/off control for stretch and limb lengths
@@ -262,15 +533,45 @@ def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_l
     lower_bone_length = limb_utils.distance(ik_joints[1], ik_joints[2])
     total_bone_length = upper_bone_length + lower_bone_length
 
+    # One limbStretch node computes both bone scales from the controls
+    if use_node:
+        import lrig.limb_stretch_node as limb_stretch_node
+        limb_stretch_node.ensure_loaded()
+        stretch_node = cmds.createNode(
+            'limbStretch',
+            name=limb_utils.unique_name(base_name + "_stretch_LSN"))
+        for ctrl, end in [(ik_base_ctrl, 'start'), (ik_local_ctrl, 'end')]:
+            cmds.connectAttr(ctrl + '.worldMatrix[0]',
+                             stretch_node + '.' + end + 'Matrix')
+            cmds.connectAttr(ctrl + '.rotatePivot',
+                             stretch_node + '.' + end + 'Pivot')
+        cmds.setAttr(stretch_node + '.upperLength', upper_bone_length)
+        cmds.setAttr(stretch_node + '.lowerLength', lower_bone_length)
+        for attr, node_attr in [('stretch', 'stretch'), (up_name, 'upper'),
+                                (lo_name, 'lower')]:
+            cmds.connectAttr(ik_world_ctrl + '.' + attr,
+                             stretch_node + '.' + node_attr)
+        cmds.connectAttr(stretch_node + '.outUpperScale',
+                         ik_joints[0] + '.' + SCALE + axis[-1])
+        cmds.connectAttr(stretch_node + '.outLowerScale',
+                         ik_joints[1] + '.' + SCALE + axis[-1])
+        return {'measure_locs': [],
+                'total_length': total_bone_length,
+                'stretch_node': stretch_node}
+
     # Create locators at the shoulder and the wrist
-    start_loc = cmds.spaceLocator(name=base_name + "_startLocator")[0]
-    end_loc = cmds.spaceLocator(name=base_name + "_endLocator")[0]
-    cmds.pointConstraint(ik_base_ctrl, start_loc, maintainOffset=False)
-    cmds.pointConstraint(ik_local_ctrl, end_loc, maintainOffset=False)
+    start_loc = cmds.spaceLocator(
+        name=limb_utils.unique_name(base_name + "_startLocator"))[0]
+    end_loc = cmds.spaceLocator(
+        name=limb_utils.unique_name(base_name + "_endLocator"))[0]
+    constrain('pointConstraint', ik_base_ctrl, start_loc,
+              maintainOffset=False)
+    constrain('pointConstraint', ik_local_ctrl, end_loc, maintainOffset=False)
 
     # Create node that calculates distance between start and end
     distance_start_end = cmds.createNode(
-        "distanceBetween", name=base_name + "_distanceBetween")
+        "distanceBetween",
+        name=limb_utils.unique_name(base_name + "_distanceBetween"))
     cmds.connectAttr(
         start_loc + ".worldMatrix[0]", distance_start_end + ".inMatrix1")
     cmds.connectAttr(
@@ -278,7 +579,8 @@ def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_l
 
     # Calculate Stretch Ratio (distance to total bone length)
     stretch_ratio = cmds.createNode(
-        "multiplyDivide", name=base_name + "_stretchFactor")
+        "multiplyDivide",
+        name=limb_utils.unique_name(base_name + "_stretchFactor"))
     cmds.connectAttr(distance_start_end + ".distance",
                      stretch_ratio + ".input1X")
     cmds.setAttr(stretch_ratio + ".input2X", total_bone_length)
@@ -287,7 +589,8 @@ def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_l
 
     # Condition node. If stretch ratio >= 1, perform a stretch
     stretch_cond = cmds.createNode(
-        "condition", name=base_name + "_stretch_condition")
+        "condition",
+        name=limb_utils.unique_name(base_name + "_stretch_condition"))
     cmds.connectAttr(distance_start_end + ".distance",
                      stretch_cond + '.firstTerm')
     cmds.connectAttr(stretch_ratio + ".outputX",
@@ -298,15 +601,18 @@ def add_ik_stretch(base_name, limb, ik_joints, ik_base_ctrl, ik_world_ctrl, ik_l
 
     # stretching on/off
     stretch_bta = cmds.createNode(
-        'blendTwoAttr', name=base_name + "_stretch_BTA")
+        'blendTwoAttr',
+        name=limb_utils.unique_name(base_name + "_stretch_BTA"))
     cmds.setAttr(stretch_bta + ".input[0]", 1)
     cmds.connectAttr(stretch_cond + ".outColorR", stretch_bta + ".input[1]")
     cmds.connectAttr(ik_world_ctrl + ".stretch",
                      stretch_bta + ".attributesBlender")
 
     # Add length to upper/lower arms
-    up_pma = cmds.createNode('plusMinusAverage', name=up_name + "PMA")
-    lo_pma = cmds.createNode('plusMinusAverage', name=lo_name + "PMA")
+    up_pma = cmds.createNode('plusMinusAverage', name=limb_utils.unique_name(
+        '{}_{}_PMA'.format(base_name, up_name)))
+    lo_pma = cmds.createNode('plusMinusAverage', name=limb_utils.unique_name(
+        '{}_{}_PMA'.format(base_name, lo_name)))
     cmds.connectAttr(ik_world_ctrl + '.' + up_name, up_pma + ".input1D[0]")
     cmds.connectAttr(ik_world_ctrl + '.' + lo_name, lo_pma + ".input1D[0]")
     cmds.connectAttr(stretch_bta + '.output', up_pma + ".input1D[1]")
@@ -335,15 +641,17 @@ def add_fk_stretch(fk_joints, fk_ctrls, axis):
         cmds.addAttr(fk_ctrl, attributeType='double', min=0.001, defaultValue=1,
                      keyable=True, longName='stretch')
         # Create locator
-        offset_loc = cmds.spaceLocator(
-            name=fk_ctrl[i].replace('_Control', "_offLOC"))[0]
+        ctrl_name = limb_utils.requested_name(fk_ctrl)
+        offset_loc = cmds.spaceLocator(name=limb_utils.unique_name(
+            ctrl_name.replace('_Control', "_offLOC")))[0]
         # Parent to this joint
         cmds.parent(offset_loc, fk_joints[i])
         # Move locators to position elblow locator -> wrist, shoulder -> elbow
         limb_utils.snap(offset_loc, fk_joints[i+1])
         # make MDL to find stretch factor
-        fk_stretch_mdl = cmds.createNode("multDoubleLinear",
-                                         name=fk_ctrl.replace("_Control", "_FK_Stretch_MDL"))
+        fk_stretch_mdl = cmds.createNode(
+            "multDoubleLinear", name=limb_utils.unique_name(
+                ctrl_name.replace("_Control", "_Stretch_MDL")))
         # Make input1 translate_x of offset locator
         offset_x = cmds.getAttr(
             offset_loc + '.' + TRANSLATE + axis[-1])
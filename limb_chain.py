@@ -0,0 +1,203 @@
+import maya.cmds as cmds
+import lrig.limb as limb
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+SIDE_NAMES = {'L': "Left", 'R': "Right", 'C': "Center"}
+# ikHandle enums for the spline's advanced twist
+FORWARD_AXES = {'X': 0, '-X': 1, 'Y': 2, '-Y': 3, 'Z': 4, '-Z': 5}
+UP_AXES = {'Y': 0, '-Y': 1, 'Z': 3, '-Z': 4, 'X': 6, '-X': 7}
+OBJECT_ROTATION_UP_START_END = 4
+# Progress steps of a chain build
+CHAIN_STEPS = ['chains', 'blend', 'fk_controls', 'ik_controls',
+               'hierarchy']
+
+
+# Rigs a chain of any length (tails, tentacles, spines) with the same
+# IK/FK blend as a limb. The FK side is a control per joint, the IK side a
+# spline whose curve follows ik_controls controls. Every step costs the
+# same per joint, so building stays linear in the length of the chain.
+# Runs as one build session like create_limb, with CHAIN_STEPS.
+def create_long_chain(side='C', name='tail', joints=None, aliases=None,
+                      primary_axis='X', up_axis='Y', stretch=True,
+                      ik_controls=3, blend_mode='blendColors',
+                      progress=None):
+    # Checks
+    if side not in SIDE_NAMES:
+        cmds.error("Must specify L (left), R (right) or C (center) for side")
+    if not joints or len(joints) < 3:
+        cmds.error("Must have at least 3 joints for a chain")
+    if not 2 <= ik_controls <= len(joints):
+        cmds.error("Must have at least 2 IK controls and at most one per "
+                   "joint")
+
+    side_name = SIDE_NAMES[side]
+    base_name = side_name + name.capitalize()
+    if not aliases:
+        aliases = dict((j, name.capitalize() + str(i + 1))
+                       for i, j in enumerate(joints))
+
+    patterns = rig_plan.name_patterns(side_name, name,
+                                      [aliases[j] for j in joints])
+    with limb_utils.build_session('create_long_chain', CHAIN_STEPS,
+                                  progress, patterns=patterns):
+        with limb_utils.transform_cache():
+            return _build_long_chain(side_name, base_name, joints, aliases,
+                                     primary_axis, up_axis, stretch,
+                                     ik_controls, blend_mode)
+
+
+def _build_long_chain(side_name, base_name, joints, aliases, primary_axis,
+                      up_axis, stretch, ik_controls, blend_mode):
+    limb_utils.build_step('chains')
+    ik_chain = limb.create_chain(side_name, joints, aliases, 'IK')
+    fk_chain = limb.create_chain(side_name, joints, aliases, 'FK')
+    bind_chain = limb.create_chain(side_name, joints, aliases, 'Bind')
+
+    # Same control size as a limb's for three joints
+    chain_len = limb_utils.distance(fk_chain[0], fk_chain[-1])
+    size = chain_len / (2.5 * (len(joints) - 1))
+    limb_utils.build_step('blend')
+    plus_ctrl_curve = limb.create_blend_control(
+        size, up_axis, bind_chain[-1], base_name)
+    limb.blend_ik_fk(ik_chain, fk_chain, bind_chain, base_name,
+                     blend_mode)
+
+    limb_utils.build_step('fk_controls')
+    fk_ctrls = limb.create_fk_controls(fk_chain, primary_axis, size)
+    if stretch:
+        limb.add_fk_stretch(fk_chain, fk_ctrls, primary_axis)
+    limb_utils.build_step('ik_controls')
+    spline = create_spline_ik(base_name, ik_chain, primary_axis,
+                              up_axis, size, ik_controls, stretch)
+
+    # Clean hiearchy
+    limb_utils.build_step('hierarchy')
+    fk_ctrl_group, ik_ctrl_group, skeleton_ctrl_group, no_xform_group, \
+        limb_rig_group, all_group = [
+            cmds.group(empty=True, name=limb_utils.unique_name(name))
+            for name in [base_name + '_FK_CTRL_GROUP',
+                         base_name + '_IK_CTRL_GROUP',
+                         base_name + '_skeleton_GROUP',
+                         base_name + '_noXform_GROUP',
+                         base_name + '_rig_GROUP', base_name.upper()]]
+
+    cmds.parent(spline['ctrls'], ik_ctrl_group)
+    cmds.parent(fk_ctrls[0], fk_ctrl_group)
+    cmds.parent(bind_chain[0], skeleton_ctrl_group)
+    cmds.parent(spline['handle'], spline['curve'], no_xform_group)
+    cmds.parent(fk_ctrl_group, ik_ctrl_group, no_xform_group,
+                fk_chain[0], ik_chain[0], plus_ctrl_curve, limb_rig_group)
+    cmds.parent(skeleton_ctrl_group, limb_rig_group, all_group)
+    limb_utils.reparented(spline['ctrls'] + [
+        fk_ctrls[0], bind_chain[0], spline['handle'], fk_chain[0],
+        ik_chain[0], plus_ctrl_curve])
+    # The curve's points are already in world space
+    cmds.setAttr(spline['curve'] + '.inheritsTransform', 0)
+    limb_utils.invalidate(spline['curve'], reparent=True)
+
+    limb_utils.transfer_pivots(
+        sel=[bind_chain[0], skeleton_ctrl_group, limb_rig_group,
+             fk_ctrl_group, ik_ctrl_group])
+    cmds.hide(no_xform_group, fk_chain[0], ik_chain[0], bind_chain[0])
+
+    # Global scalling
+    cmds.addAttr(all_group, attributeType='double', min=0.001,
+                 defaultValue=1, keyable=True, longName='globalScale')
+    [cmds.connectAttr(all_group + '.globalScale', all_group +
+                      '.scale' + axis) for axis in 'XYZ']
+    if stretch:
+        cmds.connectAttr(all_group + '.globalScale',
+                         spline['rest_length'] + '.input2')
+    return all_group
+
+
+# Spline IK for the IK chain. The curve has a point per control, taken
+# from evenly spaced joints, and the first and last controls twist the
+# chain. With stretch, the IK joints scale with the curve's length.
+def create_spline_ik(base_name, ik_joints, axis='X', up_axis='Y', size=1,
+                     count=3, stretch=True):
+    last = len(ik_joints) - 1
+    picks = [int(round(k * last / (count - 1.0))) for k in range(count)]
+
+    ctrls = []
+    points = []
+    for k, i in enumerate(picks):
+        ctrl = limb_utils.create_control(
+            '{}_IK{}_Control'.format(base_name, k + 1), 'circle', 1, 4, axis,
+            size * 1.2)
+        matrix = limb_utils.orthonormal_matrix(
+            limb_utils.world_matrix(ik_joints[i]))
+        cmds.setAttr(ctrl + '.offsetParentMatrix', matrix, type='matrix')
+        ctrls.append(ctrl)
+        points.append(limb_utils.get_translation(matrix))
+
+    curve = limb_utils.create_curve(
+        points, limb_utils.unique_name(base_name + '_IK_Curve'),
+        deg=min(3, count - 1))
+    curve_shape = curve + 'Shape'
+    for k, ctrl in enumerate(ctrls):
+        point_dcm = cmds.createNode(
+            'decomposeMatrix', name=limb_utils.unique_name(
+                '{}_IK{}_DCM'.format(base_name, k + 1)))
+        cmds.connectAttr(ctrl + '.worldMatrix[0]',
+                         point_dcm + '.inputMatrix')
+        cmds.connectAttr(point_dcm + '.outputTranslate',
+                         '{}.controlPoints[{}]'.format(curve_shape, k))
+
+    ik_handle, effector = cmds.ikHandle(
+        name=limb_utils.unique_name(base_name + "IK_Handle"),
+        startJoint=ik_joints[0], endEffector=ik_joints[-1],
+        solver='ikSplineSolver', curve=curve, createCurve=False,
+        parentCurve=False)
+    cmds.rename(effector, limb_utils.unique_name(
+        rig_plan.effector_name(base_name + "IK_Handle")))
+    # Twist from the first and last controls' up axis
+    up_vector = limb_utils.get_axis_vector(up_axis)
+    cmds.setAttr(ik_handle + '.dTwistControlEnable', 1)
+    cmds.setAttr(ik_handle + '.dWorldUpType', OBJECT_ROTATION_UP_START_END)
+    cmds.setAttr(ik_handle + '.dForwardAxis', FORWARD_AXES[axis])
+    cmds.setAttr(ik_handle + '.dWorldUpAxis', UP_AXES[up_axis])
+    cmds.setAttr(ik_handle + '.dWorldUpVector', *up_vector)
+    cmds.setAttr(ik_handle + '.dWorldUpVectorEnd', *up_vector)
+    cmds.connectAttr(ctrls[0] + '.worldMatrix[0]',
+                     ik_handle + '.dWorldUpMatrix')
+    cmds.connectAttr(ctrls[-1] + '.worldMatrix[0]',
+                     ik_handle + '.dWorldUpMatrixEnd')
+
+    spline = {'ctrls': ctrls, 'curve': curve, 'handle': ik_handle}
+    if not stretch:
+        return spline
+
+    # Stretch factor is the curve's length over its rest length
+    cmds.addAttr(ctrls[-1], attributeType='double', min=0, max=1,
+                 defaultValue=1, keyable=True, longName='stretch')
+    curve_info = cmds.createNode(
+        'curveInfo', name=limb_utils.unique_name(base_name + "_curveInfo"))
+    cmds.connectAttr(curve_shape + '.worldSpace[0]',
+                     curve_info + '.inputCurve')
+    rest_mdl = cmds.createNode(
+        'multDoubleLinear',
+        name=limb_utils.unique_name(base_name + "_globalScale_MDL"))
+    cmds.setAttr(rest_mdl + '.input1',
+                 cmds.getAttr(curve_info + '.arcLength'))
+    stretch_ratio = cmds.createNode(
+        "multiplyDivide",
+        name=limb_utils.unique_name(base_name + "_stretchFactor"))
+    cmds.connectAttr(curve_info + '.arcLength', stretch_ratio + '.input1X')
+    cmds.connectAttr(rest_mdl + '.output', stretch_ratio + '.input2X')
+    cmds.setAttr(stretch_ratio + ".operation", 2)
+
+    # stretching on/off
+    stretch_bta = cmds.createNode(
+        'blendTwoAttr',
+        name=limb_utils.unique_name(base_name + "_stretch_BTA"))
+    cmds.setAttr(stretch_bta + ".input[0]", 1)
+    cmds.connectAttr(stretch_ratio + ".outputX", stretch_bta + ".input[1]")
+    cmds.connectAttr(ctrls[-1] + ".stretch",
+                     stretch_bta + ".attributesBlender")
+    for joint in ik_joints[:-1]:
+        cmds.connectAttr(stretch_bta + '.output',
+                         joint + '.scale' + axis[-1])
+    spline['rest_length'] = rest_mdl
+    return spline
@@ -0,0 +1,114 @@
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+SIDE_NAMES = {'L': "Left", 'R': "Right"}
+# plan_limb options a limb spec can set, joints and pole_vector are guides
+SPEC_KEYS = ['side', 'limb', 'joints', 'aliases', 'pole_vector',
+             'primary_axis', 'up_axis', 'stretch', 'blend_mode',
+             'stretch_node']
+# Progress steps of a character build
+CHARACTER_STEPS = ['guides', 'plan', 'apply']
+
+
+# A limb spec with the defaults plan_limb would use filled in
+def limb_options(spec):
+    unknown = set(spec) - set(SPEC_KEYS)
+    if unknown:
+        limb_utils.error("Unknown limb options: " +
+                         ", ".join(sorted(unknown)))
+    if 'joints' not in spec or 'pole_vector' not in spec:
+        limb_utils.error("Every limb needs its joints and pole_vector")
+    options = dict(spec)
+    options.setdefault('side', 'L')
+    options.setdefault('limb', 'arm')
+    if options.get('aliases') is None:
+        options['aliases'] = dict(zip(options['joints'],
+                                      ['Shoulder', 'Elbow', 'Wrist']))
+    return options
+
+
+# Every guide of every limb, in spec order and once each
+def character_guides(specs):
+    guides = []
+    seen = set()
+    for spec in specs:
+        for guide in list(spec['joints']) + [spec['pole_vector']]:
+            if guide not in seen:
+                seen.add(guide)
+                guides.append(guide)
+    return guides
+
+
+# Every name a character's nodes start with, see rig_plan.name_patterns
+def name_patterns(specs, name='Character'):
+    patterns = [name.upper() + '*', name + '_*']
+    for spec in specs:
+        options = limb_options(spec)
+        options['aliases'] = rig_plan.check_limb(
+            options['side'], options['limb'], options['joints'],
+            options['aliases'])
+        patterns += rig_plan.name_patterns(
+            SIDE_NAMES.get(options['side'], options['side']),
+            options['limb'],
+            [options['aliases'][j] for j in options['joints']])
+    return patterns
+
+
+# Plans every limb of a character into one plan. specs are dicts of
+# plan_limb options, one per limb, and no two can share a side and limb.
+# The limbs share one set of groups (see rig_plan.plan_groups) whose top
+# group's globalScale scales them all, so they don't each get their own
+# and stretch without a globalScale multDoubleLinear. Guides are read once
+# each, in one pass, unless guide_matrices has them.
+def plan_character(specs, name='Character', guide_matrices=None):
+    if not specs:
+        limb_utils.error("A character needs at least one limb")
+    specs = [limb_options(spec) for spec in specs]
+    if guide_matrices is None:
+        limb_utils.build_step('guides')
+        guide_matrices = rig_plan.read_guides(character_guides(specs))
+    limb_utils.build_step('plan')
+
+    plan = rig_plan.RigPlan(name)
+    groups = rig_plan.plan_groups(plan, name)
+    top_group = groups['top_group']
+    global_scale = rig_plan.plan_global_scale(plan, top_group)
+    plan.set_value(groups['no_xform_group'] + '.visibility', False)
+    character = dict(groups, global_scale=global_scale)
+    limbs = []
+    for spec in specs:
+        limb_plan = rig_plan.plan_limb(guide_matrices=guide_matrices,
+                                       character=character, **spec)
+        if limb_plan.base_name in [out['base_name'] for out in limbs]:
+            limb_utils.error("Two limbs of the character are both " +
+                             limb_plan.base_name)
+        plan.extend(limb_plan)
+        limbs.append(dict(limb_plan.outputs,
+                          base_name=limb_plan.base_name))
+    plan.outputs.update({'top_group': top_group,
+                         'global_scale': global_scale, 'limbs': limbs})
+    return plan
+
+
+# Builds a character's limbs from their guides in one pass. specs are
+# dicts of create_limb's limb options, see plan_character. The plan holds
+# every limb, and applying it goes through one kind of edit at a time for
+# all of them: every node, then every shape, attribute, value, IK handle,
+# connection and constraint. Runs as one build session like create_limb,
+# returns the character's top group, or the map of planned to given
+# names with return_names.
+def create_character(specs, name='Character', backend='plan',
+                     progress=None, return_names=False):
+    if backend not in ['plan', 'api']:
+        limb_utils.error("Backend must be plan or api")
+    with limb_utils.build_session('create_character', CHARACTER_STEPS,
+                                  progress,
+                                  patterns=name_patterns(specs, name)):
+        plan = plan_character(specs, name)
+        limb_utils.build_step('apply')
+        if backend == 'api':
+            import lrig.api_backend as api_backend
+            names = api_backend.build_plan(plan)
+        else:
+            names = rig_plan.apply_plan(plan)
+        return names if return_names else names[plan.outputs['top_group']]
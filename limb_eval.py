@@ -0,0 +1,399 @@
+import numpy as np
+
+import lrig.limb_utils as limb_utils
+
+try:
+    import maya.cmds as cmds
+except ImportError:  # Evaluation only needs the rig plan
+    cmds = None
+
+# Default value of every input channel, keyed like LimbEvaluator.input_plugs
+DEFAULTS = {'ikfk': 1.0, 'stretch': 1.0, 'up_length': 1.0,
+            'lo_length': 1.0, 'global_scale': 1.0,
+            'fk_rotate': (0.0, 0.0, 0.0), 'fk_stretch': 1.0,
+            'ik_translate': (0.0, 0.0, 0.0), 'ik_rotate': (0.0, 0.0, 0.0),
+            'local_translate': (0.0, 0.0, 0.0),
+            'local_rotate': (0.0, 0.0, 0.0),
+            'base_translate': (0.0, 0.0, 0.0),
+            'pv_translate': (0.0, 0.0, 0.0)}
+
+
+# Vectorized versions of limb_utils.compose_matrix/get_euler_rotation.
+# Arrays are (..., 3) degrees and (..., 3, 3) row vector rotations.
+def euler_to_matrix(rotation):
+    rad = np.radians(rotation)
+    cx, cy, cz = np.cos(rad[..., 0]), np.cos(rad[..., 1]), np.cos(rad[..., 2])
+    sx, sy, sz = np.sin(rad[..., 0]), np.sin(rad[..., 1]), np.sin(rad[..., 2])
+    m = np.empty(rad.shape[:-1] + (3, 3))
+    m[..., 0, 0] = cy * cz
+    m[..., 0, 1] = cy * sz
+    m[..., 0, 2] = -sy
+    m[..., 1, 0] = sx * sy * cz - cx * sz
+    m[..., 1, 1] = sx * sy * sz + cx * cz
+    m[..., 1, 2] = sx * cy
+    m[..., 2, 0] = cx * sy * cz + sx * sz
+    m[..., 2, 1] = cx * sy * sz - sx * cz
+    m[..., 2, 2] = cx * cy
+    return m
+
+
+def matrix_to_euler(m):
+    sy = np.clip(-m[..., 0, 2], -1.0, 1.0)
+    locked = np.abs(sy) >= 0.999999
+    x = np.where(locked, np.arctan2(-m[..., 2, 1], m[..., 1, 1]),
+                 np.arctan2(m[..., 1, 2], m[..., 2, 2]))
+    z = np.where(locked, 0.0, np.arctan2(m[..., 0, 1], m[..., 0, 0]))
+    return np.degrees(np.stack([x, np.arcsin(sy), z], axis=-1))
+
+
+# Unit quaternions (..., 4) as x, y, z, w, for row vector rotations
+def matrix_to_quaternion(m):
+    c = np.swapaxes(m, -1, -2)
+    trace = [c[..., 0, 0], c[..., 1, 1], c[..., 2, 2]]
+    w = np.sqrt(np.maximum(0.0, 1 + trace[0] + trace[1] + trace[2])) / 2
+    x = np.sqrt(np.maximum(0.0, 1 + trace[0] - trace[1] - trace[2])) / 2
+    y = np.sqrt(np.maximum(0.0, 1 - trace[0] + trace[1] - trace[2])) / 2
+    z = np.sqrt(np.maximum(0.0, 1 - trace[0] - trace[1] + trace[2])) / 2
+    x = np.copysign(x, c[..., 2, 1] - c[..., 1, 2])
+    y = np.copysign(y, c[..., 0, 2] - c[..., 2, 0])
+    z = np.copysign(z, c[..., 1, 0] - c[..., 0, 1])
+    return _normalize(np.stack([x, y, z, w], axis=-1))
+
+
+def quaternion_to_matrix(q):
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    c = np.empty(q.shape[:-1] + (3, 3))
+    c[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    c[..., 0, 1] = 2 * (x * y - z * w)
+    c[..., 0, 2] = 2 * (x * z + y * w)
+    c[..., 1, 0] = 2 * (x * y + z * w)
+    c[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    c[..., 1, 2] = 2 * (y * z - x * w)
+    c[..., 2, 0] = 2 * (x * z - y * w)
+    c[..., 2, 1] = 2 * (y * z + x * w)
+    c[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return np.swapaxes(c, -1, -2)
+
+
+# Shortest path slerp between rotation matrices, weight 0 returns a
+def slerp(a, b, weight):
+    qa = matrix_to_quaternion(a)
+    qb = matrix_to_quaternion(b)
+    dot = np.sum(qa * qb, axis=-1, keepdims=True)
+    qb = np.where(dot < 0, -qb, qb)
+    dot = np.clip(np.abs(dot), -1.0, 1.0)
+    angle = np.arccos(dot)
+    sin = np.sin(angle)
+    small = sin < 1e-6
+    safe = np.where(small, 1.0, sin)
+    wa = np.where(small, 1 - weight, np.sin((1 - weight) * angle) / safe)
+    wb = np.where(small, weight, np.sin(weight * angle) / safe)
+    return quaternion_to_matrix(_normalize(qa * wa + qb * wb))
+
+
+def _matrix4(linear, translation):
+    m = np.zeros(linear.shape[:-2] + (4, 4))
+    m[..., :3, :3] = linear
+    m[..., 3, :3] = translation
+    m[..., 3, 3] = 1.0
+    return m
+
+
+def _point(point, matrix):
+    return np.einsum('...i,...ij->...j', point, matrix[..., :3, :3]) + \
+        matrix[..., 3, :3]
+
+
+def _normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+# Local matrix of a joint: scale * rotate * jointOrient * inverse parent
+# scale (segment scale compensate), translated into the parent's space
+def joint_matrix(translate, rotate, joint_orient, scale, parent_scale=None):
+    linear = np.einsum('...i,...ij->...ij', scale, euler_to_matrix(rotate))
+    linear = linear @ euler_to_matrix(np.asarray(joint_orient, dtype=float))
+    if parent_scale is not None:
+        linear = linear / parent_scale[..., None, :]
+    return _matrix4(linear, translate)
+
+
+# Orthonormal basis, one per row: the aim vector and the up vector made
+# perpendicular to it
+def _frame(aim, up):
+    x = _normalize(aim)
+    z = _normalize(np.cross(x, up))
+    y = np.cross(z, x)
+    return np.stack([x, y, z], axis=-2)
+
+
+# Evaluates the network create_limb builds, the IK/FK chains, the blend
+# in any mode, stretch and globalScale, for any number of frames at once.
+# Rest values come from the rig plan the rig was built from.
+class LimbEvaluator(object):
+    def __init__(self, plan):
+        values = dict((plug, value) for plug, value in plan.values)
+        out = plan.outputs
+        self.outputs = out
+        self.axis = 'XYZ'.index(out.get('primary_axis', 'X'))
+        self.stretch = out.get('stretch', 'total_length' in out)
+        self.blend_mode = out.get('blend_mode', 'blendColors')
+        ik_chain = out['ik_chain']
+        self.rest_translate = np.array(
+            [values[j + '.translate'] for j in ik_chain], dtype=float)
+        self.joint_orient = np.array(
+            [values[j + '.jointOrient'] for j in ik_chain], dtype=float)
+        self.fk_offsets = [self._matrix(values, c + '.offsetParentMatrix')
+                           for c in out['fk_ctrls']]
+        self.world_offset = self._matrix(
+            values, out['world_ctrl'] + '.offsetParentMatrix')
+        self.local_offset = self._matrix(
+            values, out['local_ctrl'] + '.offsetParentMatrix')
+        self.base_offset = self._matrix(
+            values, out['base_ctrl'] + '.offsetParentMatrix')
+        self.pv_offset = self._matrix(
+            values, out['pv_ctrl'] + '.offsetParentMatrix')
+
+        # Rest pose of the IK solve, everything below is in rig space
+        orients = euler_to_matrix(self.joint_orient)
+        self.rest_rotation = [orients[0], orients[1] @ orients[0]]
+        start = self.base_offset[3, :3]
+        end = self.local_offset[3, :3] @ self.world_offset[:3, :3] + \
+            self.world_offset[3, :3]
+        self.rest_normal = self._plane(start, end,
+                                       self.pv_offset[3, :3] - start)[1]
+
+    def _matrix(self, values, plug):
+        return np.array(values[plug], dtype=float).reshape(4, 4)
+
+    # The rotate plane normal and the direction from start to end
+    def _plane(self, start, end, pole):
+        aim = _normalize(end - start)
+        frame = _frame(aim, pole)
+        return aim, frame[..., 2, :], frame[..., 1, :]
+
+    # Maps every input to the plug it is sampled from in the scene
+    def input_plugs(self):
+        out = self.outputs
+        world = out['world_ctrl']
+        up_attr, lo_attr = out.get('length_attrs', ['upArm', 'loArm'])
+        plugs = {'ikfk': [out['blend_ctrl'] + '.iKfK'],
+                 'global_scale': [out.get('global_scale', out['top_group'] +
+                                          '.globalScale')],
+                 'fk_rotate': [c + '.rotate' for c in out['fk_ctrls']],
+                 'ik_translate': [world + '.translate'],
+                 'ik_rotate': [world + '.rotate'],
+                 'local_translate': [out['local_ctrl'] + '.translate'],
+                 'local_rotate': [out['local_ctrl'] + '.rotate'],
+                 'base_translate': [out['base_ctrl'] + '.translate'],
+                 'pv_translate': [out['pv_ctrl'] + '.translate']}
+        if self.stretch:
+            plugs.update({'stretch': [world + '.stretch'],
+                          'up_length': [world + '.' + up_attr],
+                          'lo_length': [world + '.' + lo_attr],
+                          'fk_stretch': [c + '.stretch'
+                                         for c in out['fk_ctrls'][:-1]]})
+        return plugs
+
+    def _inputs(self, count, channels):
+        inputs = {}
+        sizes = {'fk_rotate': 3, 'fk_stretch': 2}
+        for key, default in DEFAULTS.items():
+            value = np.asarray(channels.get(key, default), dtype=float)
+            shape = (count,)
+            if key in sizes:
+                shape += (sizes[key],)
+            if np.ndim(default):
+                shape += (3,)
+            inputs[key] = np.broadcast_to(value, shape)
+        return inputs
+
+    # Returns the bind chain's local translate/rotate/scale, shaped
+    # (frames, joints, 3), and world matrices shaped (frames, joints, 4, 4)
+    def evaluate(self, count, **channels):
+        unknown = set(channels) - set(DEFAULTS)
+        if unknown:
+            limb_utils.error("Unknown channels: " + ", ".join(sorted(unknown)))
+        inputs = self._inputs(count, channels)
+        ik = self._evaluate_ik(count, inputs)
+        fk = self._evaluate_fk(count, inputs)
+
+        # blendColors: color1 (IK) * blender + color2 (FK) * (1 - blender)
+        blender = inputs['ikfk'][:, None, None]
+        bind = dict((attr, ik[attr] * blender + fk[attr] * (1.0 - blender))
+                    for attr in ['translate', 'rotate', 'scale'])
+        orient = self.joint_orient
+        if self.blend_mode != 'blendColors':
+            # Quaternion blend of rotate, or of rotate * jointOrient when
+            # blendMatrix blends whole local matrices. Inverse parent
+            # scale is left out of the matrix blend.
+            ik_rotation = euler_to_matrix(ik['rotate'])
+            fk_rotation = euler_to_matrix(fk['rotate'])
+            if self.blend_mode == 'blendMatrix':
+                orients = euler_to_matrix(orient)
+                ik_rotation = ik_rotation @ orients
+                fk_rotation = fk_rotation @ orients
+                orient = np.zeros((3, 3))
+            bind['rotate'] = matrix_to_euler(
+                slerp(fk_rotation, ik_rotation, blender))
+        bind['world'] = self._chain_world(bind, inputs['global_scale'],
+                                          orient)
+        return bind
+
+    def _chain_world(self, channels, global_scale, orient):
+        world = []
+        parent = None
+        parent_scale = None
+        for i in range(3):
+            local = joint_matrix(channels['translate'][:, i],
+                                 channels['rotate'][:, i],
+                                 orient[i], channels['scale'][:, i],
+                                 parent_scale)
+            parent = local if parent is None else local @ parent
+            parent_scale = channels['scale'][:, i]
+            world.append(parent)
+        world = np.stack(world, axis=1)
+        # The top group, or the character's, carries globalScale, pivoting
+        # at the origin
+        scaled = world.copy()
+        scaled[..., :3] *= global_scale[:, None, None, None]
+        return scaled
+
+    def _axis_scale(self, count, factor):
+        scale = np.ones((count, 3))
+        scale[:, self.axis] = factor
+        return scale
+
+    def _evaluate_fk(self, count, inputs):
+        stretch = inputs['fk_stretch'] if self.stretch else np.ones((count, 2))
+        rotate = inputs['fk_rotate']
+        scales = [self._axis_scale(count, stretch[:, 0]),
+                  self._axis_scale(count, stretch[:, 1]), np.ones((count, 3))]
+        translate = np.zeros((count, 3, 3))
+        ctrl_world = None
+        joint_world = None
+        for i in range(3):
+            offset = np.broadcast_to(self.fk_offsets[i], (count, 4, 4))
+            if i and self.stretch:
+                # offLOC translate along the bone scaled by the FK stretch
+                offset = offset.copy()
+                offset[:, 3, self.axis] *= stretch[:, i - 1]
+            ctrl = _matrix4(euler_to_matrix(rotate[:, i]),
+                            np.zeros((count, 3))) @ offset
+            ctrl_world = ctrl if ctrl_world is None else ctrl @ ctrl_world
+            # pointConstraint puts the joint on the control
+            position = ctrl_world[:, 3, :3]
+            if joint_world is None:
+                translate[:, i] = position
+            else:
+                translate[:, i] = _point(position,
+                                         np.linalg.inv(joint_world))
+            local = joint_matrix(translate[:, i], rotate[:, i],
+                                 self.joint_orient[i], scales[i],
+                                 scales[i - 1] if i else None)
+            joint_world = local if joint_world is None else \
+                local @ joint_world
+        return {'translate': translate, 'rotate': np.array(rotate),
+                'scale': np.stack(scales, axis=1)}
+
+    def _evaluate_ik(self, count, inputs):
+        base = _point(inputs['base_translate'], self.base_offset)
+        world_ctrl = joint_matrix(inputs['ik_translate'], inputs['ik_rotate'],
+                                  (0, 0, 0), np.ones((count, 3))) @ \
+            self.world_offset
+        local_ctrl = joint_matrix(inputs['local_translate'],
+                                  inputs['local_rotate'], (0, 0, 0),
+                                  np.ones((count, 3))) @ self.local_offset
+        handle = (local_ctrl @ world_ctrl)[:, 3, :3]
+        pole = _point(inputs['pv_translate'], self.pv_offset) - base
+
+        # Stretch network, globalScale scales distance and length alike
+        up_scale = np.ones(count)
+        lo_scale = np.ones(count)
+        if self.stretch:
+            rest_length = np.linalg.norm(self.rest_translate[1:], axis=1).sum()
+            dist = np.linalg.norm(handle - base, axis=1)
+            factor = np.where(dist > rest_length, dist / rest_length, 1.0)
+            blended = 1.0 + inputs['stretch'] * (factor - 1.0)
+            up_scale = inputs['up_length'] + blended - 1.0
+            lo_scale = inputs['lo_length'] + blended - 1.0
+        scales = [self._axis_scale(count, up_scale),
+                  self._axis_scale(count, lo_scale), np.ones((count, 3))]
+
+        # Two bone rotate plane solve with zero twist
+        upper = self.rest_translate[1] * scales[0]
+        lower = self.rest_translate[2] * scales[1]
+        a = np.linalg.norm(upper, axis=1)
+        b = np.linalg.norm(lower, axis=1)
+        aim, normal, towards_pole = self._plane(base, handle, pole)
+        reach = np.clip(np.linalg.norm(handle - base, axis=1),
+                        np.abs(a - b) + 1e-9, a + b)
+        along = (a * a - b * b + reach * reach) / (2.0 * reach)
+        across = np.sqrt(np.maximum(a * a - along * along, 0.0))
+        elbow = base + aim * along[:, None] + towards_pole * across[:, None]
+        wrist = base + aim * reach[:, None]
+
+        rotations = []
+        parent_rotation = np.eye(3)
+        for i, (bone, start, end) in enumerate([(upper, base, elbow),
+                                                (lower, elbow, wrist)]):
+            rest = self.rest_rotation[i]
+            local_normal = rest @ self.rest_normal
+            local_frame = _frame(bone, np.broadcast_to(local_normal,
+                                                       bone.shape))
+            world_frame = _frame(end - start, normal)
+            rotation = np.swapaxes(local_frame, -1, -2) @ world_frame
+            orient = euler_to_matrix(self.joint_orient[i])
+            rotate = rotation @ np.swapaxes(parent_rotation, -1, -2) @ \
+                orient.T
+            rotations.append(matrix_to_euler(rotate))
+            parent_rotation = rotation
+        rotations.append(np.zeros((count, 3)))
+
+        translate = np.broadcast_to(self.rest_translate, (count, 3, 3)).copy()
+        translate[:, 0] = base
+        return {'translate': translate, 'rotate': np.stack(rotations, axis=1),
+                'scale': np.stack(scales, axis=1)}
+
+
+# Reads the evaluator's input channels from the scene for the given frames
+def sample_inputs(evaluator, frames):
+    channels = {}
+    for key, plugs in evaluator.input_plugs().items():
+        samples = [[_get(plug, frame) for plug in plugs] for frame in frames]
+        samples = np.array(samples, dtype=float)
+        if len(plugs) == 1:
+            samples = samples[:, 0]
+        channels[key] = samples
+    return channels
+
+
+def _get(plug, frame):
+    value = cmds.getAttr(plug, time=frame)
+    if isinstance(value, list) and isinstance(value[0], tuple):
+        value = value[0]
+    return value
+
+
+# Compares the evaluator with what the DG computes for the bind chain and
+# returns the largest absolute difference per channel. World matrices are
+# always compared, with the top group at rest apart from globalScale.
+# Under blendMatrix the bind joints' own channels stay at rest since
+# offsetParentMatrix carries the pose, so only the world is compared.
+def validate(evaluator, frames):
+    if cmds is None:
+        limb_utils.error("Validating against the DG requires Maya")
+    result = evaluator.evaluate(len(frames),
+                                **sample_inputs(evaluator, frames))
+    bind_chain = evaluator.outputs['bind_chain']
+    attrs = ['world']
+    if evaluator.blend_mode != 'blendMatrix':
+        attrs = ['translate', 'rotate', 'scale'] + attrs
+    errors = {}
+    for attr in attrs:
+        plug = 'worldMatrix[0]' if attr == 'world' else attr
+        scene = np.array([[_get(j + '.' + plug, frame) for j in bind_chain]
+                          for frame in frames], dtype=float)
+        scene = scene.reshape(result[attr].shape)
+        errors[attr] = float(np.abs(scene - result[attr]).max())
+    return errors
@@ -0,0 +1,208 @@
+import collections
+import json
+import math
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import lrig.limb_eval as limb_eval
+import lrig.limb_utils as limb_utils
+
+try:
+    import maya.cmds as cmds
+except ImportError:  # Reading an export doesn't need Maya
+    cmds = None
+
+MAGIC = b'LRIGBAKE'
+FORMAT_VERSION = 1
+# The samples start on a multiple of this many bytes
+DATA_ALIGNMENT = 64
+DEFAULT_CHUNK = 256
+# Local transform relative to the parent, joint orient and
+# offsetParentMatrix included, rotation in xyz order and degrees
+LOCAL_CHANNELS = ['tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'sx', 'sy', 'sz']
+# World matrix, row by row
+WORLD_CHANNELS = ['m{}{}'.format(r, c) for r in range(4) for c in range(4)]
+CHANNELS = LOCAL_CHANNELS + WORLD_CHANNELS
+
+
+# The bind joints under nodes (limb or character top groups), parents
+# before children, and each one's parent index, -1 for a chain's root
+def bind_joints(nodes):
+    found = []
+    for node in nodes:
+        found += cmds.listRelatives(node, allDescendents=True,
+                                    type='joint') or []
+    bind = set(joint for joint in found if '_Bind_Joint' in joint)
+    if not bind:
+        limb_utils.error("No bind joints under " + ", ".join(nodes))
+    parents = dict((joint, (cmds.listRelatives(joint, parent=True) or
+                            [None])[0]) for joint in bind)
+    children = collections.defaultdict(list)
+    for joint in sorted(bind):
+        parent = parents[joint]
+        children[parent if parent in bind else None].append(joint)
+    joints = []
+    indices = {}
+    parent_indices = []
+    pending = list(reversed(children[None]))
+    while pending:
+        joint = pending.pop()
+        indices[joint] = len(joints)
+        joints.append(joint)
+        parent_indices.append(indices.get(parents[joint], -1))
+        pending += reversed(children[joint])
+    return joints, parent_indices
+
+
+def frame_count(start, end, step=1.0):
+    if step <= 0:
+        limb_utils.error("Frame step must be positive")
+    count = int(math.floor((end - start) / float(step) + 1e-6)) + 1
+    if count < 1:
+        limb_utils.error("End frame is before the start frame")
+    return count
+
+
+# World matrices of the joints and parent matrices of the roots at each
+# frame, shaped (frames, nodes, 4, 4). Read without moving the time slider:
+# each frame is one DG context that every plug is read in, so the graph is
+# evaluated once per frame rather than once per plug.
+def sample_matrices(joints, roots, frames):
+    import maya.api.OpenMaya as om
+    plugs = [om.MSelectionList().add(name).getPlug(0) for name in
+             [joint + '.worldMatrix[0]' for joint in joints] +
+             [root + '.parentMatrix[0]' for root in roots]]
+    values = np.empty((len(frames), len(plugs), 16))
+    for i, frame in enumerate(frames):
+        context = om.MDGContext(om.MTime(frame, om.MTime.uiUnit()))
+        for j, plug in enumerate(plugs):
+            matrix = om.MFnMatrixData(plug.asMObject(context)).matrix()
+            values[i, j] = [matrix[k] for k in range(16)]
+    values = values.reshape(len(frames), len(plugs), 4, 4)
+    return values[:, :len(joints)], values[:, len(joints):]
+
+
+# LOCAL_CHANNELS from world matrices and the matrices of their parents
+def local_channels(world, parent_world):
+    local = world @ np.linalg.inv(parent_world)
+    linear = local[..., :3, :3]
+    scale = np.linalg.norm(linear, axis=-1)
+    rotate = limb_eval.matrix_to_euler(linear / scale[..., None])
+    return np.concatenate([local[..., 3, :3], rotate, scale], axis=-1)
+
+
+def _write_header(f, header):
+    text = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    prefix = len(MAGIC) + 4
+    size = -(-(prefix + len(text)) // DATA_ALIGNMENT) * DATA_ALIGNMENT - \
+        prefix
+    f.write(MAGIC + struct.pack('<I', size) + text.ljust(size))
+    return prefix + size
+
+
+# Bakes the bind chains under nodes (limb or character top groups) from
+# start to end into path and returns the file's header. The file holds a
+# small JSON header and then every sample as one array shaped (joints,
+# channels, frames), so each joint's curves are contiguous on disk. The
+# range is sampled chunk frames at a time and each chunk is written
+# through a memory map straight into place, so memory use doesn't grow
+# with the length of the range. Like rig_cache entries, the file is
+# written under a temporary name and only replaces path once complete.
+def export_bind_chains(path, nodes, start, end, step=1.0,
+                       chunk=DEFAULT_CHUNK, dtype='float32'):
+    if cmds is None:
+        limb_utils.error("Exporting bind chains requires Maya")
+    if isinstance(nodes, str):
+        nodes = [nodes]
+    joints, parents = bind_joints(nodes)
+    roots = [joint for joint, parent in zip(joints, parents) if parent < 0]
+    count = frame_count(start, end, step)
+    dtype = np.dtype(dtype).newbyteorder('<')
+    header = {'version': FORMAT_VERSION, 'dtype': dtype.str,
+              'start': start, 'step': step, 'frames': count,
+              'joints': joints, 'parents': parents, 'channels': CHANNELS,
+              'shape': [len(joints), len(CHANNELS), count]}
+
+    handle, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            offset = _write_header(f, header)
+            f.truncate(offset + dtype.itemsize * len(joints) *
+                       len(CHANNELS) * count)
+        data = np.memmap(temp_path, dtype, 'r+', offset,
+                         tuple(header['shape']))
+        for first in range(0, count, chunk):
+            frames = [start + step * i
+                      for i in range(first, min(first + chunk, count))]
+            world, root_parents = sample_matrices(joints, roots, frames)
+            parent_world = np.empty_like(world)
+            for i, parent in enumerate(parents):
+                parent_world[:, i] = world[:, parent] if parent >= 0 else \
+                    root_parents[:, roots.index(joints[i])]
+            values = np.concatenate(
+                [local_channels(world, parent_world),
+                 world.reshape(len(frames), len(joints), 16)], axis=-1)
+            data[:, :, first:first + len(frames)] = values.transpose(1, 2, 0)
+            data.flush()
+        del data
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return header
+
+
+# An exported file, read through a read only memory map. Every accessor
+# returns a view into the map, so only the pages a consumer touches are
+# read from disk, e.g. one joint's curves.
+class BakedChains(object):
+    def __init__(self, path):
+        prefix = len(MAGIC) + 4
+        with open(path, 'rb') as f:
+            start = f.read(prefix)
+            if len(start) < prefix or start[:len(MAGIC)] != MAGIC:
+                limb_utils.error("Not a baked bind chain file: " + path)
+            size = struct.unpack('<I', start[len(MAGIC):])[0]
+            self.header = json.loads(f.read(size).decode('utf-8'))
+        if self.header['version'] > FORMAT_VERSION:
+            limb_utils.error("Baked bind chain file is newer than this "
+                             "reader: " + path)
+        self.path = path
+        self.joints = self.header['joints']
+        self.parents = self.header['parents']
+        self.channels = self.header['channels']
+        self.data = np.memmap(path, np.dtype(self.header['dtype']), 'r',
+                              prefix + size, tuple(self.header['shape']))
+
+    def frames(self):
+        return self.header['start'] + \
+            self.header['step'] * np.arange(self.header['frames'])
+
+    def _index(self, joint):
+        return joint if isinstance(joint, int) else self.joints.index(joint)
+
+    # Every sample, shaped (frames, joints, channels)
+    def samples(self):
+        return self.data.transpose(2, 0, 1)
+
+    # A joint's channels, shaped (frames, channels)
+    def curve(self, joint):
+        return self.data[self._index(joint)].T
+
+    # One channel of a joint, shaped (frames,)
+    def channel(self, joint, name):
+        return self.data[self._index(joint), self.channels.index(name)]
+
+    # A joint's LOCAL_CHANNELS, shaped (frames, 9)
+    def local(self, joint):
+        return self.curve(joint)[:, :len(LOCAL_CHANNELS)]
+
+    # A joint's world matrices, shaped (frames, 4, 4)
+    def world_matrices(self, joint):
+        world = self.curve(joint)[:, len(LOCAL_CHANNELS):]
+        return world.reshape(len(world), 4, 4)
@@ -0,0 +1,145 @@
+import maya.cmds as cmds
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+# Index of the world axis normal to each mirror plane
+MIRROR_PLANES = {'YZ': 0, 'XZ': 1, 'XY': 2}
+MIRROR_MODES = ['behavior', 'orientation']
+SIDE_NAMES = {'L': "Left", 'R': "Right"}
+OPPOSITE_SIDES = {'L': 'R', 'R': 'L'}
+# Keys of the mirrored guide matrices, they never reach the scene
+POLE_VECTOR_KEY = 'pole_vector'
+# Progress steps of a mirror build
+MIRROR_STEPS = ['read', 'plan', 'apply']
+
+
+# Reflects a world matrix across a plane through the origin. Positions
+# always reflect. 'behavior' negates the reflected axes so the matrix stays
+# right handed and equal rotations move both sides as mirror images, like
+# mirrorJoint -mirrorBehavior. 'orientation' keeps the world orientation.
+def mirror_matrix(matrix, plane='YZ', mode='behavior'):
+    if plane not in MIRROR_PLANES:
+        limb_utils.error("Mirror plane must be YZ, XZ or XY")
+    if mode not in MIRROR_MODES:
+        limb_utils.error("Mirror mode must be behavior or orientation")
+    normal = MIRROR_PLANES[plane]
+    rows = [[float(v) for v in matrix[r * 4:r * 4 + 4]] for r in range(4)]
+    rows[3][normal] = -rows[3][normal]
+    if mode == 'behavior':
+        for row in rows[:3]:
+            for i in range(3):
+                if i != normal:
+                    row[i] = -row[i]
+    return [v for row in rows for v in row]
+
+
+# The joint world matrices and pole vector matrix a plan was computed
+# from, put back together from its FK control and pole vector placement.
+# Works on plans loaded from JSON too.
+def plan_matrices(plan):
+    values = dict((plug, value) for plug, value in plan.values)
+    world = []
+    for ctrl in plan.outputs['fk_ctrls']:
+        local = values[ctrl + '.offsetParentMatrix']
+        world.append(limb_utils.mult_matrix(local, world[-1]) if world
+                     else list(local))
+    pv_matrix = values[plan.outputs['pv_ctrl'] + '.offsetParentMatrix']
+    return world, pv_matrix
+
+
+# Queries a built limb's FK joints and pole vector control, four queries
+# for the whole limb. The limb is expected to be at rest. names maps
+# planned names to the nodes the build gave them, as
+# create_limb(return_names=True) returns it, so a numbered copy is read
+# too. Without names the limb's nodes have their planned names.
+def read_limb(side='L', limb='arm',
+              joints=["LeftShoulder", "LeftElbow", "LeftWrist"],
+              aliases=None, names=None):
+    names = names or {}
+    if aliases is None:
+        aliases = dict(zip(joints, ['Shoulder', 'Elbow', 'Wrist']))
+    base_name = SIDE_NAMES[side] + limb.capitalize()
+    if not cmds.objExists(names.get(base_name + '_rig_GROUP',
+                                    base_name + '_rig_GROUP')):
+        cmds.error("No limb rig named " + base_name)
+    fk_chain = ['{}{}_FK_Joint'.format(SIDE_NAMES[side], aliases[j])
+                for j in joints]
+    pv_ctrl = base_name + "_PV_Control"
+    with limb_utils.transform_cache():
+        world = [limb_utils.world_matrix(names.get(j, j)) for j in fk_chain]
+        pv_matrix = limb_utils.world_matrix(names.get(pv_ctrl, pv_ctrl))
+    return world, pv_matrix
+
+
+# Plans the opposite side of a limb from its joint and pole vector world
+# matrices, without touching the scene. names are the limb's aliases in
+# chain order. In behavior mode the blend control's up axis flips with
+# the joints' so it lands mirrored too.
+def plan_mirror(world, pv_matrix, side='L', limb='arm',
+                names=['Shoulder', 'Elbow', 'Wrist'], plane='YZ',
+                mode='behavior', primary_axis='X', up_axis='Y',
+                stretch=True, blend_mode='blendColors', stretch_node=False):
+    if side not in OPPOSITE_SIDES:
+        limb_utils.error("Must specify L (left) or R (right) for side")
+    guide_matrices = dict((name, mirror_matrix(matrix, plane, mode))
+                          for name, matrix in zip(names, world))
+    guide_matrices[POLE_VECTOR_KEY] = mirror_matrix(pv_matrix, plane, mode)
+    if mode == 'behavior':
+        up_axis = up_axis[1:] if up_axis[0] == '-' else '-' + up_axis
+    return rig_plan.plan_limb(OPPOSITE_SIDES[side], limb, list(names),
+                              dict((name, name) for name in names),
+                              POLE_VECTOR_KEY, primary_axis, up_axis,
+                              stretch, guide_matrices, blend_mode,
+                              stretch_node)
+
+
+# Plans the opposite side of an already computed plan with the same options
+def mirror_plan(plan, plane='YZ', mode='behavior'):
+    outputs = plan.outputs
+    side = 'L' if plan.base_name.startswith(SIDE_NAMES['L']) else 'R'
+    prefix = len(SIDE_NAMES[side])
+    names = [joint[prefix:-len('_FK_Joint')]
+             for joint in outputs['fk_chain']]
+    world, pv_matrix = plan_matrices(plan)
+    return plan_mirror(world, pv_matrix, side, outputs['limb'], names,
+                       plane, mode, outputs['primary_axis'],
+                       outputs['up_axis'], outputs['stretch'],
+                       outputs['blend_mode'], outputs['stretch_node'])
+
+
+# Builds the opposite side of a limb built by create_limb. Only the built
+# limb's four rest matrices are queried, the mirrored side is planned from
+# them and applied in bulk, so it is an exact reflection. Options are
+# create_limb's and should match the built limb, names is its name map as
+# read_limb takes it. Runs as one build session like create_limb, with
+# MIRROR_STEPS. Returns the top group.
+def mirror_limb(side='L', limb='arm',
+                joints=["LeftShoulder", "LeftElbow", "LeftWrist"],
+                aliases=None, plane='YZ', mode='behavior',
+                primary_axis='X', up_axis='Y', stretch=True,
+                blend_mode='blendColors', stretch_node=False,
+                backend='plan', progress=None, names=None):
+    if backend not in ['plan', 'api']:
+        cmds.error("Backend must be plan or api")
+    if side not in OPPOSITE_SIDES:
+        cmds.error("Must specify L (left) or R (right) for side")
+    if aliases is None:
+        aliases = dict(zip(joints, ['Shoulder', 'Elbow', 'Wrist']))
+    patterns = rig_plan.name_patterns(SIDE_NAMES[OPPOSITE_SIDES[side]],
+                                      limb, [aliases[j] for j in joints])
+    with limb_utils.build_session('mirror_limb', MIRROR_STEPS, progress,
+                                  patterns=patterns):
+        limb_utils.build_step('read')
+        world, pv_matrix = read_limb(side, limb, joints, aliases, names)
+        limb_utils.build_step('plan')
+        plan = plan_mirror(world, pv_matrix, side, limb,
+                           [aliases[j] for j in joints], plane, mode,
+                           primary_axis, up_axis, stretch, blend_mode,
+                           stretch_node)
+        limb_utils.build_step('apply')
+        if backend == 'api':
+            import lrig.api_backend as api_backend
+            built = api_backend.build_plan(plan)
+        else:
+            built = rig_plan.apply_plan(plan)
+        return built[plan.outputs['top_group']]
@@ -0,0 +1,263 @@
+import os
+
+import maya.api.OpenMaya as om
+
+PLUGIN_NAME = 'limb_rig_plugin'
+COMMAND_NAME = 'limbRig'
+MATCH_COMMAND_NAME = 'limbMatch'
+# Flags as (short, long, argument type, option), the options are
+# create_limb's. joints and aliases can be given once per joint.
+FLAGS = [('-s', '-side', om.MSyntax.kString, 'side'),
+         ('-l', '-limb', om.MSyntax.kString, 'limb'),
+         ('-j', '-joints', om.MSyntax.kString, 'joints'),
+         ('-a', '-aliases', om.MSyntax.kString, 'aliases'),
+         ('-pv', '-poleVector', om.MSyntax.kString, 'pole_vector'),
+         ('-pa', '-primaryAxis', om.MSyntax.kString, 'primary_axis'),
+         ('-ua', '-upAxis', om.MSyntax.kString, 'up_axis'),
+         ('-st', '-stretch', om.MSyntax.kBoolean, 'stretch'),
+         ('-bm', '-blendMode', om.MSyntax.kString, 'blend_mode'),
+         ('-sn', '-stretchNode', om.MSyntax.kBoolean, 'stretch_node'),
+         ('-c', '-cache', om.MSyntax.kString, 'cache')]
+MULTI_USE_OPTIONS = ['joints', 'aliases']
+# Applies a plan api_backend.build_plan() handed over, by its key
+PLAN_FLAG = ('-p', '-plan')
+# limbMatch's flags as (short, long, argument type)
+MATCH_FLAGS = [('-b', '-baseName', om.MSyntax.kString),
+               ('-st', '-start', om.MSyntax.kDouble),
+               ('-e', '-end', om.MSyntax.kDouble),
+               ('-ik', '-toIk', om.MSyntax.kBoolean),
+               ('-sw', '-switch', om.MSyntax.kBoolean)]
+# A planned name and the name the build gave it, once per node, see
+# limb_switch.limb_nodes
+MATCH_NAMES_FLAG = ('-nm', '-names')
+# create_limb's defaults for what the flags leave out
+DEFAULTS = {'side': 'L', 'limb': 'arm',
+            'joints': ['LeftShoulder', 'LeftElbow', 'LeftWrist'],
+            'aliases': None, 'pole_vector': 'LeftShoulder_PV',
+            'primary_axis': 'X', 'up_axis': 'Y', 'stretch': True,
+            'blend_mode': 'blendColors', 'stretch_node': False,
+            'cache': None}
+
+
+def maya_useNewAPI():
+    pass
+
+
+# limbRig builds a limb from its guides like create_limb with the api
+# backend and returns the top group. The modifiers that built it are kept,
+# so undo and redo replay them instead of building again. With -plan the
+# command applies a plan or loads a rig script handed over by
+# api_backend.build_plan() or build_script() instead and returns every name
+# it gave, which is how the api backend's builds get on the undo queue.
+# Only OpenMaya is imported when the plugin loads, the builder is imported
+# by the first command. The limbStretch node stays in its own plugin,
+# loaded when a build first asks for it.
+class LimbRigCommand(om.MPxCommand):
+    def __init__(self):
+        om.MPxCommand.__init__(self)
+        self.names = None
+        self.top_group = None
+        self.modifiers = None
+
+    @staticmethod
+    def creator():
+        return LimbRigCommand()
+
+    @staticmethod
+    def create_syntax():
+        syntax = om.MSyntax()
+        syntax.addFlag(PLAN_FLAG[0], PLAN_FLAG[1], om.MSyntax.kString)
+        for short_name, long_name, arg_type, option in FLAGS:
+            syntax.addFlag(short_name, long_name, arg_type)
+            if option in MULTI_USE_OPTIONS:
+                syntax.makeFlagMultiUse(short_name)
+        return syntax
+
+    def isUndoable(self):
+        return True
+
+    def doIt(self, args):
+        import lrig.api_backend as api_backend
+        import lrig.limb_utils as limb_utils
+        arg_data = om.MArgDatabase(self.syntax(), args)
+        if arg_data.isFlagSet(PLAN_FLAG[0]):
+            pending = api_backend.pending_plans[
+                arg_data.flagArgumentString(PLAN_FLAG[0], 0)]
+            with limb_utils.unique_names(pending['patterns']):
+                if 'script' in pending:
+                    self.names, self.modifiers = api_backend.apply_script(
+                        pending['script'], pending['planned'])
+                else:
+                    self.names, self.modifiers = api_backend.apply_plan(
+                        pending['plan'])
+            pending['names'] = self.names
+        else:
+            options = parse_options(arg_data)
+            with limb_utils.unique_names(limb_patterns(options)):
+                self.names, self.top_group, self.modifiers = \
+                    build_options(options)
+        self.set_result()
+
+    def redoIt(self):
+        import lrig.api_backend as api_backend
+        api_backend.redo_plan(self.modifiers)
+        self.set_result()
+
+    def undoIt(self):
+        import lrig.api_backend as api_backend
+        api_backend.undo_plan(self.modifiers)
+
+    def set_result(self):
+        self.clearResult()
+        if self.top_group is None:
+            self.setResult(sorted(self.names.values()))
+        else:
+            self.setResult(self.top_group)
+
+
+# limbMatch keys one side of a limb to the pose of the other over a frame
+# range, see limb_switch.match_ik_to_fk and match_fk_to_ik. The curves it
+# creates and the keys it changes are kept, so undo and redo replay them.
+class LimbMatchCommand(om.MPxCommand):
+    def __init__(self):
+        om.MPxCommand.__init__(self)
+        self.edit = None
+
+    @staticmethod
+    def creator():
+        return LimbMatchCommand()
+
+    @staticmethod
+    def create_syntax():
+        syntax = om.MSyntax()
+        for short_name, long_name, arg_type in MATCH_FLAGS:
+            syntax.addFlag(short_name, long_name, arg_type)
+        syntax.addFlag(MATCH_NAMES_FLAG[0], MATCH_NAMES_FLAG[1],
+                       om.MSyntax.kString, om.MSyntax.kString)
+        syntax.makeFlagMultiUse(MATCH_NAMES_FLAG[0])
+        return syntax
+
+    def isUndoable(self):
+        return True
+
+    def doIt(self, args):
+        import lrig.limb_switch as limb_switch
+        arg_data = om.MArgDatabase(self.syntax(), args)
+        for flag in ['-b', '-st', '-e']:
+            if not arg_data.isFlagSet(flag):
+                raise RuntimeError("Give the limb's baseName, start and end")
+        base_name = arg_data.flagArgumentString('-b', 0)
+        start = arg_data.flagArgumentDouble('-st', 0)
+        end = arg_data.flagArgumentDouble('-e', 0)
+        to_ik = arg_data.isFlagSet('-ik') and \
+            arg_data.flagArgumentBool('-ik', 0)
+        switch = not arg_data.isFlagSet('-sw') or \
+            arg_data.flagArgumentBool('-sw', 0)
+        names = {}
+        for i in range(arg_data.numberOfFlagUses(MATCH_NAMES_FLAG[0])):
+            pair = arg_data.getFlagArgumentList(MATCH_NAMES_FLAG[0], i)
+            names[pair.asString(0)] = pair.asString(1)
+        match = limb_switch.keyed_ik_match if to_ik else \
+            limb_switch.keyed_fk_match
+        self.edit = limb_switch.MatchEdit()
+        try:
+            match(base_name, start, end, switch, self.edit, names)
+        except Exception:
+            self.edit.undo()
+            raise
+
+    def redoIt(self):
+        self.edit.redo()
+
+    def undoIt(self):
+        self.edit.undo()
+
+
+# create_limb's options from the command's flags
+def parse_options(arg_data):
+    options = dict(DEFAULTS)
+    for short_name, _, arg_type, option in FLAGS:
+        if not arg_data.isFlagSet(short_name):
+            continue
+        if option in MULTI_USE_OPTIONS:
+            options[option] = [
+                arg_data.getFlagArgumentList(short_name, i).asString(0)
+                for i in range(arg_data.numberOfFlagUses(short_name))]
+        elif arg_type == om.MSyntax.kBoolean:
+            options[option] = arg_data.flagArgumentBool(short_name, 0)
+        else:
+            options[option] = arg_data.flagArgumentString(short_name, 0)
+    if options['aliases'] is None:
+        options['aliases'] = ['Shoulder', 'Elbow', 'Wrist']
+    if len(options['aliases']) != len(options['joints']):
+        raise RuntimeError("Give an alias for every joint")
+    options['aliases'] = dict(zip(options['joints'], options['aliases']))
+    return options
+
+
+# The patterns of the names a limb can clash with
+def limb_patterns(options):
+    import lrig.rig_plan as rig_plan
+    return rig_plan.name_patterns(
+        "Left" if options['side'] == 'L' else "Right", options['limb'],
+        [options['aliases'][j] for j in options['joints']])
+
+
+# Builds a limb, through the rig cache when options has one. Returns
+# (names, top group, modifiers) like api_backend.apply_plan() with the top
+# group added.
+def build_options(options):
+    import lrig.api_backend as api_backend
+    import lrig.rig_plan as rig_plan
+    options = dict(options)
+    cache = options.pop('cache')
+    modifiers = []
+
+    def apply(plan):
+        names, created = api_backend.apply_plan(plan)
+        modifiers.extend(created)
+        return names
+
+    def load(script, planned):
+        names, created = api_backend.apply_script(script, planned)
+        modifiers.extend(created)
+        return names
+
+    try:
+        if cache:
+            import lrig.rig_cache as rig_cache
+            names, outputs = rig_cache.cached_build(
+                cache, apply, load, del_guides=False, color_dict={},
+                **options)
+        else:
+            plan = rig_plan.plan_limb(**options)
+            names, outputs = apply(plan), plan.outputs
+    except Exception:
+        api_backend.undo_plan(modifiers)
+        raise
+    return names, names[outputs['top_group']], modifiers
+
+
+def plugin_path():
+    return os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+# Loads this file as a plugin unless it is already loaded
+def ensure_loaded():
+    import maya.cmds as cmds
+    if not cmds.pluginInfo(PLUGIN_NAME, query=True, loaded=True):
+        cmds.loadPlugin(plugin_path(), quiet=True)
+
+
+def initializePlugin(plugin):
+    fn = om.MFnPlugin(plugin)
+    fn.registerCommand(COMMAND_NAME, LimbRigCommand.creator,
+                       LimbRigCommand.create_syntax)
+    fn.registerCommand(MATCH_COMMAND_NAME, LimbMatchCommand.creator,
+                       LimbMatchCommand.create_syntax)
+
+
+def uninitializePlugin(plugin):
+    fn = om.MFnPlugin(plugin)
+    fn.deregisterCommand(COMMAND_NAME)
+    fn.deregisterCommand(MATCH_COMMAND_NAME)
@@ -0,0 +1,135 @@
+import os
+
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+
+import lrig.limb_utils as limb_utils
+
+PLUGIN_NAME = 'limb_stretch_node'
+
+
+def maya_useNewAPI():
+    pass
+
+
+# Replaces the IK stretch network (locators, distanceBetween,
+# multiplyDivide, condition, blendTwoAttr, two plusMinusAverage and the
+# globalScale multDoubleLinear) with one node
+class LimbStretchNode(om.MPxNode):
+    TYPE_NAME = 'limbStretch'
+    TYPE_ID = om.MTypeId(0x0007F100)  # Local development range
+
+    start_matrix = None
+    end_matrix = None
+    start_pivot = None
+    end_pivot = None
+    upper_length = None
+    lower_length = None
+    stretch = None
+    upper = None
+    lower = None
+    global_scale = None
+    out_upper_scale = None
+    out_lower_scale = None
+
+    @classmethod
+    def creator(cls):
+        return cls()
+
+    @classmethod
+    def initialize(cls):
+        matrix_fn = om.MFnMatrixAttribute()
+        numeric_fn = om.MFnNumericAttribute()
+        inputs = []
+
+        for name in ['startMatrix', 'endMatrix']:
+            attr = matrix_fn.create(name, name)
+            inputs.append(attr)
+        cls.start_matrix, cls.end_matrix = inputs
+
+        for name in ['startPivot', 'endPivot']:
+            attr = numeric_fn.createPoint(name, name)
+            inputs.append(attr)
+        cls.start_pivot, cls.end_pivot = inputs[2:4]
+
+        values = []
+        for name, default, minimum, maximum in [
+                ('upperLength', 1.0, 0.0, None),
+                ('lowerLength', 1.0, 0.0, None),
+                ('stretch', 1.0, 0.0, 1.0),
+                ('upper', 1.0, 0.001, None),
+                ('lower', 1.0, 0.001, None),
+                ('globalScale', 1.0, 0.001, None)]:
+            attr = numeric_fn.create(name, name, om.MFnNumericData.kDouble,
+                                     default)
+            numeric_fn.setMin(minimum)
+            if maximum is not None:
+                numeric_fn.setMax(maximum)
+            numeric_fn.keyable = True
+            values.append(attr)
+        (cls.upper_length, cls.lower_length, cls.stretch, cls.upper,
+         cls.lower, cls.global_scale) = values
+        inputs += values
+
+        outputs = []
+        for name in ['outUpperScale', 'outLowerScale']:
+            attr = numeric_fn.create(name, name, om.MFnNumericData.kDouble,
+                                     1.0)
+            numeric_fn.writable = False
+            numeric_fn.storable = False
+            outputs.append(attr)
+        cls.out_upper_scale, cls.out_lower_scale = outputs
+
+        for attr in inputs + outputs:
+            cls.addAttribute(attr)
+        for attr in inputs:
+            for output in outputs:
+                cls.attributeAffects(attr, output)
+
+    def compute(self, plug, data):
+        if plug not in [self.out_upper_scale, self.out_lower_scale]:
+            return None
+        cls = type(self)
+
+        def value(attr):
+            return data.inputValue(attr).asDouble()
+
+        def matrix(attr):
+            m = data.inputValue(attr).asMatrix()
+            return [m[i] for i in range(16)]
+
+        def point(attr):
+            return list(data.inputValue(attr).asFloat3())
+
+        upper, lower = limb_utils.stretch_scales(
+            matrix(cls.start_matrix), matrix(cls.end_matrix),
+            value(cls.upper_length), value(cls.lower_length),
+            value(cls.stretch), value(cls.upper), value(cls.lower),
+            value(cls.global_scale), point(cls.start_pivot),
+            point(cls.end_pivot))
+        for attr, result in [(cls.out_upper_scale, upper),
+                             (cls.out_lower_scale, lower)]:
+            handle = data.outputValue(attr)
+            handle.setDouble(result)
+            handle.setClean()
+
+
+def plugin_path():
+    return os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+# Loads this file as a plugin unless it is already loaded
+def ensure_loaded():
+    if not cmds.pluginInfo(PLUGIN_NAME, query=True, loaded=True):
+        cmds.loadPlugin(plugin_path(), quiet=True)
+
+
+def initializePlugin(plugin):
+    fn = om.MFnPlugin(plugin)
+    fn.registerNode(LimbStretchNode.TYPE_NAME, LimbStretchNode.TYPE_ID,
+                    LimbStretchNode.creator, LimbStretchNode.initialize)
+
+
+def uninitializePlugin(plugin):
+    fn = om.MFnPlugin(plugin)
+    fn.deregisterNode(LimbStretchNode.TYPE_ID)
@@ -0,0 +1,294 @@
+import numpy as np
+import maya.cmds as cmds
+
+try:
+    import maya.api.OpenMaya as om
+    import maya.api.OpenMayaAnim as oma
+except ImportError:  # Finding nodes and solving poses don't need the API
+    om = None
+    oma = None
+
+import lrig.limb_eval as limb_eval
+
+TRANSLATE = "translate"
+ROTATE = "rotate"
+
+
+# Finds the nodes of a limb built by create_limb from its base name,
+# e.g. 'LeftArm'. names maps planned names to the nodes the build gave
+# them, as create_limb(return_names=True) returns it, so a numbered copy
+# is found too. Without names the limb's nodes have their planned names.
+def limb_nodes(base_name, names=None):
+    names = names or {}
+    requested = dict((given, name) for name, given in names.items())
+
+    def given(name):
+        return names.get(name, name)
+
+    rig_group = given(base_name + '_rig_GROUP')
+    if not cmds.objExists(rig_group):
+        cmds.error("No limb rig named " + base_name)
+    nodes = {'top_group': given(base_name.upper()),
+             'blend_ctrl': given(base_name + '_Control'),
+             'world_ctrl': given(base_name + '_IK_Control'),
+             'local_ctrl': given(base_name + '_Local_IK_Control'),
+             'base_ctrl': given(base_name + '_Base_Control'),
+             'pv_ctrl': given(base_name + '_PV_Control')}
+    # A character's limbs share the rig group, its joints outside names
+    # belong to the other limbs
+    roots = [root for root in cmds.listRelatives(
+        rig_group, children=True, type='joint') or []
+        if not names or root in requested]
+    for chain_type in ['IK', 'FK']:
+        suffix = '_{}_Joint'.format(chain_type)
+        chain = [r for r in roots
+                 if requested.get(r, r).endswith(suffix)][:1]
+        while chain and len(chain) < 3:
+            chain += cmds.listRelatives(chain[-1], children=True,
+                                        type='joint')[:1]
+        nodes[chain_type.lower() + '_chain'] = chain
+    nodes['fk_ctrls'] = [
+        given(requested.get(j, j).replace('_Joint', '_Control'))
+        for j in nodes['fk_chain']]
+    return nodes
+
+
+def _mplug(name):
+    return om.MSelectionList().add(name).getPlug(0)
+
+
+# A plug's value in a context, matrices as 16 floats, compounds as a list
+# of their children's values, angles in degrees and distances in UI units
+def _plug_value(plug, context):
+    if plug.isCompound:
+        return [_plug_value(plug.child(i), context)
+                for i in range(plug.numChildren())]
+    attr = plug.attribute()
+    if attr.hasFn(om.MFn.kTypedAttribute) or \
+            attr.hasFn(om.MFn.kMatrixAttribute):
+        matrix = om.MFnMatrixData(plug.asMObject(context)).matrix()
+        return [matrix.getElement(r, c) for r in range(4) for c in range(4)]
+    if attr.hasFn(om.MFn.kUnitAttribute):
+        unit_type = om.MFnUnitAttribute(attr).unitType()
+        if unit_type == om.MFnUnitAttribute.kAngle:
+            return plug.asMAngle(context).asDegrees()
+        if unit_type == om.MFnUnitAttribute.kDistance:
+            return plug.asMDistance(context).asUnits(
+                om.MDistance.uiUnit())
+    return plug.asDouble(context)
+
+
+# Reads every plug for every frame in a single pass over the range,
+# without moving the time slider. Each frame is one DG context all plugs
+# are read in, rather than a getAttr per plug. Returns an array (frames,
+# plugs, ...).
+def sample(plugs, frames):
+    mplugs = [_mplug(plug) for plug in plugs]
+    samples = []
+    for frame in frames:
+        context = om.MDGContext(om.MTime(frame, om.MTime.uiUnit()))
+        samples.append([_plug_value(plug, context) for plug in mplugs])
+    return np.array(samples, dtype=float)
+
+
+def _matrix(plug):
+    return np.array(cmds.getAttr(plug), dtype=float).reshape(4, 4)
+
+
+def _rotation(matrices):
+    linear = matrices[..., :3, :3]
+    return linear / np.linalg.norm(linear, axis=-1, keepdims=True)
+
+
+# Static data needed to place a control: the matrix its channels sit on
+# (offsetParentMatrix * parent, without the top group) and its pivot
+def _control_data(ctrl, top_group):
+    top = _matrix(top_group + '.worldMatrix[0]')
+    parent = _matrix(ctrl + '.parentMatrix[0]') @ np.linalg.inv(top)
+    return {'base': _matrix(ctrl + '.offsetParentMatrix') @ parent,
+            'pivot': np.array(cmds.getAttr(ctrl + '.rotatePivot')[0])}
+
+
+# Solves translate (and rotate, if rotations are given) so that the point
+# origin, given in the control's space, lands on targets with the world
+# rotations. A control's matrix is T(-pivot) R T(pivot) T(t) * base.
+def _solve_control(data, top, targets, origin=None, rotations=None):
+    base = data['base'] @ top
+    pivot = data['pivot']
+    origin = pivot if origin is None else origin
+    count = len(targets)
+    rotate = np.zeros((count, 3))
+    linear = np.broadcast_to(np.eye(3), (count, 3, 3))
+    if rotations is not None:
+        base_rotation = _rotation(base)
+        linear = rotations @ np.swapaxes(base_rotation, -1, -2)
+        rotate = limb_eval.matrix_to_euler(linear)
+    local = np.einsum('ni,nij->nj', np.append(
+        targets, np.ones((count, 1)), axis=1), np.linalg.inv(base))[:, :3]
+    swung = np.einsum('i,nij->nj', origin - pivot, linear)
+    return local - pivot - swung, rotate
+
+
+# Keeps what a match created and changed, so the limbMatch command can
+# undo and redo it as one step
+class MatchEdit(object):
+    def __init__(self):
+        self.modifier = om.MDGModifier()
+        self.change = oma.MAnimCurveChange()
+
+    def undo(self):
+        self.change.undoIt()
+        self.modifier.undoIt()
+
+    def redo(self):
+        self.modifier.doIt()
+        self.change.redoIt()
+
+
+# Writes all keys of one attribute with a single anim curve call
+def key_range(plug_name, frames, values, edit=None):
+    edit = edit or MatchEdit()
+    plug = _mplug(plug_name)
+    curve_fn = oma.MFnAnimCurve()
+    sources = plug.connectedTo(True, False)
+    if sources and sources[0].node().hasFn(om.MFn.kAnimCurve):
+        curve_fn.setObject(sources[0].node())
+    else:
+        # Creating the curve only queues its connection to the plug
+        curve_fn.create(plug, None, edit.modifier)
+        edit.modifier.doIt()
+    if curve_fn.animCurveType in [oma.MFnAnimCurve.kAnimCurveTA,
+                                  oma.MFnAnimCurve.kAnimCurveUA]:
+        values = np.radians(values)
+    times = om.MTimeArray([om.MTime(f, om.MTime.uiUnit()) for f in frames])
+    curve_fn.addKeys(times, [float(v) for v in values],
+                     oma.MFnAnimCurve.kTangentAuto,
+                     oma.MFnAnimCurve.kTangentAuto, False, edit.change)
+    return edit
+
+
+def _key_vectors(node, attr, frames, vectors, edit):
+    for i, axis in enumerate('XYZ'):
+        key_range(node + '.' + attr + axis, frames, vectors[:, i], edit)
+
+
+# Runs a match as one limbMatch command, so it is a single undo step
+def _run_match(base_name, start, end, to_ik, switch, names):
+    import lrig.limb_rig_plugin as limb_rig_plugin
+    limb_rig_plugin.ensure_loaded()
+    flags = {'names': sorted(names.items())} if names else {}
+    cmds.limbMatch(baseName=base_name, start=start, end=end, toIk=to_ik,
+                   switch=switch, **flags)
+
+
+# Matches the IK controls to the FK pose over the range and keys them,
+# including the pole vector. Undoes in one step. names is the limb's name
+# map, see limb_nodes.
+def match_ik_to_fk(base_name, start, end, switch=True, names=None):
+    _run_match(base_name, start, end, True, switch, names)
+
+
+# Matches the FK controls to the IK pose over the range and keys them.
+# Undoes in one step.
+def match_fk_to_ik(base_name, start, end, switch=True, names=None):
+    _run_match(base_name, start, end, False, switch, names)
+
+
+# What limbMatch runs for match_ik_to_fk, recording its edits in edit
+def keyed_ik_match(base_name, start, end, switch, edit, names=None):
+    nodes = limb_nodes(base_name, names)
+    frames = list(range(int(start), int(end) + 1))
+    fk_chain = nodes['fk_chain']
+    top_group = nodes['top_group']
+    worlds = sample([j + '.worldMatrix[0]' for j in fk_chain] +
+                    [top_group + '.worldMatrix[0]'],
+                    frames).reshape(len(frames), 4, 4, 4)
+    tops = worlds[:, 3]
+    positions = worlds[:, :3, 3, :3]
+    wrist_rotation = _rotation(worlds[:, 2])
+
+    # World control carries the wrist, the local control is zeroed
+    world_data = _control_data(nodes['world_ctrl'], top_group)
+    local_offset = _matrix(nodes['local_ctrl'] + '.offsetParentMatrix')
+    rotations = np.swapaxes(_rotation(local_offset), -1, -2) @ \
+        wrist_rotation
+    translate, rotate = _solve_control(
+        world_data, tops, positions[:, 2], local_offset[3, :3], rotations)
+    _key_vectors(nodes['world_ctrl'], TRANSLATE, frames, translate, edit)
+    _key_vectors(nodes['world_ctrl'], ROTATE, frames, rotate, edit)
+    zeros = np.zeros((len(frames), 3))
+    _key_vectors(nodes['local_ctrl'], TRANSLATE, frames, zeros, edit)
+    _key_vectors(nodes['local_ctrl'], ROTATE, frames, zeros, edit)
+
+    translate = _solve_control(_control_data(nodes['base_ctrl'], top_group),
+                               tops, positions[:, 0])[0]
+    _key_vectors(nodes['base_ctrl'], TRANSLATE, frames, translate, edit)
+
+    # Pole vector sits out from the elbow, in the plane of the arm, at the
+    # distance it currently has from the elbow
+    pv_ctrl = nodes['pv_ctrl']
+    pv_distance = np.linalg.norm(
+        np.array(cmds.xform(pv_ctrl, query=True, worldSpace=True,
+                            rotatePivot=True)) -
+        np.array(cmds.xform(nodes['ik_chain'][1], query=True,
+                            worldSpace=True, rotatePivot=True)))
+    targets = pole_vector_positions(positions, pv_distance)
+    translate = _solve_control(_control_data(pv_ctrl, top_group), tops,
+                               targets)[0]
+    _key_vectors(pv_ctrl, TRANSLATE, frames, translate, edit)
+
+    if switch:
+        key_range(nodes['blend_ctrl'] + '.iKfK', frames,
+                  np.ones(len(frames)), edit)
+
+
+# What limbMatch runs for match_fk_to_ik, recording its edits in edit.
+# Both chains share joint orients, so FK rotate is the IK joint rotate.
+def keyed_fk_match(base_name, start, end, switch, edit, names=None):
+    nodes = limb_nodes(base_name, names)
+    frames = list(range(int(start), int(end) + 1))
+    ik_chain = nodes['ik_chain']
+    axis = _primary_axis(ik_chain[0])
+    stretchy = cmds.objExists(nodes['fk_ctrls'][0] + '.stretch')
+    plugs = [j + '.rotate' for j in ik_chain]
+    rotations = sample(plugs, frames)
+    for i, ctrl in enumerate(nodes['fk_ctrls']):
+        _key_vectors(ctrl, ROTATE, frames, rotations[:, i], edit)
+    if stretchy:
+        scales = sample([j + '.scale' + axis for j in ik_chain[:2]], frames)
+        for i, ctrl in enumerate(nodes['fk_ctrls'][:2]):
+            key_range(ctrl + '.stretch', frames, scales[:, i], edit)
+    if switch:
+        key_range(nodes['blend_ctrl'] + '.iKfK', frames,
+                  np.zeros(len(frames)), edit)
+
+
+# The axis the stretch network scales, found from its incoming connection
+def _primary_axis(joint):
+    for axis in 'XYZ':
+        if cmds.listConnections(joint + '.scale' + axis, source=True,
+                                destination=False):
+            return axis
+    return 'X'
+
+
+# Pole vector targets for (frames, 3 joints, 3) positions. Straight frames
+# reuse the direction of the previous bent frame.
+def pole_vector_positions(positions, pv_distance):
+    start, elbow, end = positions[:, 0], positions[:, 1], positions[:, 2]
+    line = end - start
+    length = np.maximum(np.linalg.norm(line, axis=1, keepdims=True), 1e-9)
+    line = line / length
+    along = np.einsum('ni,ni->n', elbow - start, line)[:, None]
+    out = elbow - (start + line * along)
+    norm = np.linalg.norm(out, axis=1)
+    bent = norm > 1e-6
+    direction = np.zeros_like(out)
+    direction[bent] = out[bent] / norm[bent, None]
+    last = np.array([0.0, 0.0, -1.0])
+    for i in range(len(direction)):
+        if bent[i]:
+            last = direction[i]
+        else:
+            direction[i] = last
+    return elbow + direction * pv_distance
@@ -0,0 +1,170 @@
+import maya.cmds as cmds
+import maya.mel as mel
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+
+# Channels each constraint type drives on its constrained node
+CONSTRAINED_ATTRS = {'parentConstraint': ['translate', 'rotate'],
+                     'pointConstraint': ['translate'],
+                     'orientConstraint': ['rotate'],
+                     'poleVectorConstraint': ['poleVector']}
+SIDE_NAMES = {'L': "Left", 'R': "Right"}
+# Progress steps of building a template
+TEMPLATE_STEPS = ['plan', 'apply', 'tag']
+
+
+# Plug values that place a planned limb on its guides: the planned values
+# that aren't overridden by a connection or constraint, plus the rest
+# offsets of its maintainOffset constraints
+def placement_values(plan):
+    connected = set(destination for _, destination in plan.connections)
+    for constraint in plan.constraints:
+        connected.update(constraint['driven'] + '.' + attr
+                         for attr in CONSTRAINED_ATTRS[constraint['type']])
+    values = dict((plug, value) for plug, value in plan.values
+                  if plug not in connected)
+    for constraint in plan.constraints:
+        if 'offset' not in constraint:
+            continue
+        prefix = constraint['name'] + '.target[0].targetOffset'
+        values[prefix + 'Translate'] = limb_utils.get_translation(
+            constraint['offset'])
+        values[prefix + 'Rotate'] = limb_utils.get_euler_rotation(
+            constraint['offset'])
+    return values
+
+
+def _same(a, b, tolerance=1e-6):
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, (list, tuple)) or isinstance(b, (list, tuple)):
+        return False
+    if a is None or b is None:
+        return a is b
+    return abs(float(a) - float(b)) < tolerance
+
+
+# The names a limb built from options can clash with, see
+# rig_plan.name_patterns
+def template_patterns(options, joints):
+    aliases = options['aliases'] or \
+        dict(zip(joints, ['Shoulder', 'Elbow', 'Wrist']))
+    return rig_plan.name_patterns(
+        SIDE_NAMES.get(options['side'], options['side']), options['limb'],
+        [aliases[j] for j in joints])
+
+
+# A limb built once from a plan, which stamp() copies onto other guides.
+# A network node has a message attribute per planned node, named after the
+# node in the plan, so one listConnections on a copied network finds every
+# copied node. dg_nodes are the planned nodes outside the top group's
+# hierarchy.
+class LimbTemplate(object):
+    def __init__(self, plan, names, guides, options, network):
+        self.plan = plan
+        self.names = names
+        self.guides = guides
+        self.options = options
+        self.network = network
+        self.patterns = template_patterns(options, guides[:3])
+        self.values = placement_values(plan)
+        self.top_group = names[plan.outputs['top_group']]
+        self.dg_nodes = [names[node['name']] for node in plan.nodes
+                         if not node['parent'] and
+                         names[node['name']] != self.top_group]
+
+    # Copies the template onto guides (shoulder, elbow, wrist and pole
+    # vector, like the template's) or onto guide_matrices keyed by the
+    # template's guide names. Only the placement values that differ from
+    # the template are written; control shapes keep the template's size.
+    # global_scale is an optional plug to drive the copy's globalScale.
+    # Runs as one build session. Returns a dict mapping planned names to
+    # the copy's nodes.
+    def stamp(self, guides=None, guide_matrices=None, global_scale=None):
+        with limb_utils.build_session('stamp', patterns=self.patterns):
+            return self._stamp(guides, guide_matrices, global_scale)
+
+    def _stamp(self, guides, guide_matrices, global_scale):
+        if guide_matrices is None:
+            if guides is None or len(guides) != len(self.guides):
+                limb_utils.error("Need a shoulder, elbow, wrist and pole "
+                                 "vector guide to stamp a limb")
+            guide_matrices = dict(
+                (key, limb_utils.world_matrix(guide))
+                for key, guide in zip(self.guides, guides))
+        plan = rig_plan.plan_limb(joints=self.guides[:3],
+                                  pole_vector=self.guides[3],
+                                  guide_matrices=guide_matrices,
+                                  **self.options)
+
+        # The hierarchy, the dependency nodes and the network are copied
+        # with their input connections: connections between copies move to
+        # the copies and the ik handles keep the template's solver. Nothing
+        # upstream is copied, so no node is copied twice.
+        roots = cmds.duplicate([self.top_group] + self.dg_nodes +
+                               [self.network], inputConnections=True,
+                               renameChildren=True, returnRootsOnly=True)
+        links = cmds.listConnections(roots[-1], source=True,
+                                     destination=False,
+                                     connections=True) or []
+        copies = dict((plug.partition('.')[2], node)
+                      for plug, node in zip(links[::2], links[1::2]))
+        # Every copy gets an allocated name rather than the one Maya gave
+        # it, all renamed in one call
+        names = dict((key, limb_utils.unique_name(key)) for key in copies)
+        renames = [(copies[key], names[key]) for key in sorted(copies)]
+        renames.append((roots[-1], limb_utils.unique_name(
+            plan.base_name + '_template_NET')))
+        mel.eval(''.join('rename -ignoreShape "{}" "{}";\n'.format(*pair)
+                         for pair in renames))
+
+        for plug, value in sorted(placement_values(plan).items()):
+            if _same(value, self.values.get(plug)):
+                continue
+            node, _, attr = plug.partition('.')
+            rig_plan.set_plug_value(names[node] + '.' + attr, value)
+        if global_scale:
+            cmds.connectAttr(global_scale,
+                             names[plan.outputs['top_group']] + '.globalScale')
+        return names
+
+    # Stamps one copy per guide list, all in one build session. Returns the
+    # names of each copy.
+    def stamp_many(self, guide_sets, global_scale=None):
+        with limb_utils.build_session('stamp_many', patterns=self.patterns):
+            with limb_utils.transform_cache():
+                return [self.stamp(guides, global_scale=global_scale)
+                        for guides in guide_sets]
+
+
+# Builds a limb from its plan and tags it so it can be stamped, takes the
+# same arguments as create_limb. Runs as one build session with
+# TEMPLATE_STEPS.
+def create_template(side='L', limb='arm',
+                    joints=["LeftShoulder", "LeftElbow", "LeftWrist"],
+                    aliases=None, pole_vector="LeftShoulder_PV",
+                    primary_axis='X', up_axis='Y', stretch=True,
+                    blend_mode='blendColors', stretch_node=False,
+                    progress=None):
+    options = {'side': side, 'limb': limb, 'aliases': aliases,
+               'primary_axis': primary_axis, 'up_axis': up_axis,
+               'stretch': stretch, 'blend_mode': blend_mode,
+               'stretch_node': stretch_node}
+    with limb_utils.build_session('create_template', TEMPLATE_STEPS,
+                                  progress, patterns=template_patterns(
+                                      options, joints)):
+        limb_utils.build_step('plan')
+        plan = rig_plan.plan_limb(joints=joints, pole_vector=pole_vector,
+                                  **options)
+        limb_utils.build_step('apply')
+        names = rig_plan.apply_plan(plan)
+
+        limb_utils.build_step('tag')
+        network = cmds.createNode('network', name=limb_utils.unique_name(
+            plan.base_name + '_template_NET'))
+        for key in sorted(names):
+            cmds.addAttr(network, longName=key, attributeType='message')
+            cmds.connectAttr(names[key] + '.message', network + '.' + key)
+        return LimbTemplate(plan, names, list(joints) + [pole_vector],
+                            options, network)
@@ -1,8 +1,474 @@
+import contextlib
+import functools
 import math
-import maya.cmds as cmds
-import maya.mel as mel
-
 
+try:
+    import maya.cmds as cmds
+    import maya.mel as mel
+except ImportError:  # The matrix math below is usable without Maya
+    cmds = None
+    mel = None
+
+IDENTITY_MATRIX = [1.0, 0.0, 0.0, 0.0,
+                   0.0, 1.0, 0.0, 0.0,
+                   0.0, 0.0, 1.0, 0.0,
+                   0.0, 0.0, 0.0, 1.0]
+
+
+# Same as cmds.error, but also usable when Maya isn't loaded
+def error(message):
+    if cmds is not None:
+        cmds.error(message)
+    raise RuntimeError(message)
+
+
+# Matrices are flat, row major lists of 16 floats using Maya's row vector
+# convention, so a child's world matrix is local * parent
+def mult_matrix(a, b):
+    return [sum(a[r * 4 + k] * b[k * 4 + c] for k in range(4))
+            for r in range(4) for c in range(4)]
+
+
+def inverse_matrix(m):
+    rows = [list(m[r * 4:r * 4 + 4]) + [1.0 if r == c else 0.0
+                                        for c in range(4)]
+            for r in range(4)]
+    for col in range(4):
+        pivot = max(range(col, 4), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            error("Matrix is not invertible")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = rows[col][col]
+        rows[col] = [v / scale for v in rows[col]]
+        for r in range(4):
+            if r != col and rows[r][col]:
+                factor = rows[r][col]
+                rows[r] = [v - factor * p for v, p in zip(rows[r], rows[col])]
+    return [rows[r][4 + c] for r in range(4) for c in range(4)]
+
+
+def get_translation(m):
+    return list(m[12:15])
+
+
+def translation_matrix(t):
+    return IDENTITY_MATRIX[:12] + [float(t[0]), float(t[1]), float(t[2]), 1.0]
+
+
+# Builds a matrix from a translation and XYZ euler rotation in degrees
+def compose_matrix(translation=(0, 0, 0), rotation=(0, 0, 0)):
+    cx, cy, cz = [math.cos(math.radians(a)) for a in rotation]
+    sx, sy, sz = [math.sin(math.radians(a)) for a in rotation]
+    return [cy * cz, cy * sz, -sy, 0.0,
+            sx * sy * cz - cx * sz, sx * sy * sz + cx * cz, sx * cy, 0.0,
+            cx * sy * cz + sx * sz, cx * sy * sz - sx * cz, cx * cy, 0.0,
+            float(translation[0]), float(translation[1]),
+            float(translation[2]), 1.0]
+
+
+# XYZ euler rotation in degrees, the inverse of compose_matrix
+def get_euler_rotation(m):
+    m = orthonormal_matrix(m)
+    sy = max(-1.0, min(1.0, -m[2]))
+    y = math.asin(sy)
+    if abs(sy) < 0.999999:
+        x = math.atan2(m[6], m[10])
+        z = math.atan2(m[1], m[0])
+    else:  # Gimbal lock, put everything into X
+        x = math.atan2(-m[9], m[5])
+        z = 0.0
+    return [math.degrees(a) for a in (x, y, z)]
+
+
+# Removes scale and shear, keeping rotation and translation
+def orthonormal_matrix(m):
+    x = _normalize(m[0:3])
+    y = _normalize(m[4:7])
+    z = _normalize(_cross(x, y))
+    y = _cross(z, x)
+    return x + [0.0] + y + [0.0] + z + [0.0] + list(m[12:15]) + [1.0]
+
+
+def transform_point(point, m):
+    return [sum(p * m[r * 4 + c] for r, p in enumerate(point)) + m[12 + c]
+            for c in range(3)]
+
+
+def point_distance(a, b):
+    return math.sqrt(sum((p - q) ** 2 for p, q in zip(a, b)))
+
+
+# The matrix that places a child at child_world under parent_world, which is
+# what a control's offsetParentMatrix needs to line up with a joint
+def offset_matrix(child_world, parent_world=None):
+    if parent_world is None:
+        return list(child_world)
+    return mult_matrix(child_world, inverse_matrix(parent_world))
+
+
+# The IK stretch network in one function: distanceBetween, the stretch
+# ratio and condition, the stretch on/off blend and the per bone offsets.
+# Points are local pivots carried by the start and end world matrices.
+# Returns the upper and lower bone scales.
+def stretch_scales(start_matrix, end_matrix, upper_length, lower_length,
+                   stretch=1.0, upper=1.0, lower=1.0, global_scale=1.0,
+                   start_pivot=(0, 0, 0), end_pivot=(0, 0, 0)):
+    start = transform_point(start_pivot, start_matrix)
+    end = transform_point(end_pivot, end_matrix)
+    dist = point_distance(start, end)
+    total_length = (upper_length + lower_length) * global_scale
+    factor = dist / total_length if dist > total_length else 1.0
+    blended = 1.0 + stretch * (factor - 1.0)
+    return upper + blended - 1.0, lower + blended - 1.0
+
+
+def _normalize(v):
+    length = math.sqrt(sum(a * a for a in v))
+    return [a / length for a in v]
+
+
+def _cross(a, b):
+    return [a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0]]
+
+
+# Memoizes world matrices and parents while a build is running. Helpers in
+# this module invalidate what they move, parent or freeze.
+class TransformCache(object):
+    def __init__(self):
+        self.matrices = {}
+        self.parents = {}
+        self.hits = 0
+        self.misses = 0
+
+    def world_matrix(self, node):
+        if node in self.matrices:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.matrices[node] = cmds.xform(node, query=True,
+                                             worldSpace=True, matrix=True)
+        return list(self.matrices[node])
+
+    def parent(self, node):
+        if node in self.parents:
+            self.hits += 1
+        else:
+            self.misses += 1
+            parent_node = cmds.listRelatives(node, parent=True)
+            self.parents[node] = parent_node[0] if parent_node else None
+        return self.parents[node]
+
+    # Drops the node and any cached descendant, reparent also forgets
+    # the node's parent
+    def invalidate(self, node, reparent=False):
+        if reparent:
+            self.parents.pop(node, None)
+        if node not in self.matrices and not self.matrices:
+            return
+        self.matrices.pop(node, None)
+        if self.matrices:
+            for child in cmds.listRelatives(node, allDescendents=True) or []:
+                self.matrices.pop(child, None)
+
+    def clear(self):
+        self.matrices = {}
+        self.parents = {}
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'queries': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+_transform_cache = None
+
+
+# Caches world space queries for the duration of the block. Nested blocks
+# share the outer cache, so callers can wrap create_limb to read the stats.
+@contextlib.contextmanager
+def transform_cache():
+    global _transform_cache
+    if _transform_cache is not None:
+        yield _transform_cache
+        return
+    _transform_cache = TransformCache()
+    try:
+        yield _transform_cache
+    finally:
+        _transform_cache = None
+
+
+# Parenting with cmds.parent keeps world matrices, only parents go stale
+def reparented(nodes):
+    if _transform_cache is None:
+        return
+    for node in nodes if isinstance(nodes, (list, tuple)) else [nodes]:
+        _transform_cache.parents.pop(node, None)
+
+
+def invalidate(nodes, reparent=False):
+    if _transform_cache is None:
+        return
+    if not isinstance(nodes, (list, tuple)):
+        nodes = [nodes]
+    for node in nodes:
+        _transform_cache.invalidate(node, reparent)
+
+
+class BuildCancelled(RuntimeError):
+    pass
+
+
+# A build running as one edit of the scene. Its edits are a single undo
+# chunk, the viewport doesn't refresh until the end and, with
+# defer_evaluation, the evaluation manager is off so it doesn't rebuild
+# its graph after every edit. progress(phase, index, total) is called at
+# each step and cancels the build by returning True. With rollback, a
+# build that fails or is cancelled deletes every node it created: the
+# names its NameAllocator handed out when it has one, otherwise whatever
+# the scene didn't have when it started.
+class BuildSession(object):
+    def __init__(self, name, steps=None, progress=None,
+                 defer_evaluation=True, rollback=True, allocator=None):
+        self.name = name
+        self.steps = list(steps or [])
+        self.progress = progress
+        self.defer_evaluation = defer_evaluation
+        self.rollback = rollback
+        self.allocator = allocator
+        self.phase = None
+        self.index = 0
+        self.depth = 0
+        self._nodes = None
+        self._evaluation_mode = None
+        self._suspended = None
+
+    def start(self):
+        if self.rollback and self.allocator is None:
+            self._nodes = set(cmds.ls())
+        cmds.undoInfo(openChunk=True, chunkName=self.name)
+        # A build run while the caller has refresh suspended leaves it so
+        self._suspended = cmds.refresh(query=True, suspend=True)
+        if not self._suspended:
+            cmds.refresh(suspend=True)
+        if self.defer_evaluation:
+            mode = cmds.evaluationManager(query=True, mode=True)[0]
+            if mode != 'off':
+                self._evaluation_mode = mode
+                cmds.evaluationManager(mode='off')
+
+    def step(self, phase):
+        self.index += 1
+        self.phase = phase
+        self.check()
+
+    # Gives the progress callback a chance to cancel without a new step
+    def check(self):
+        if self.progress is None:
+            return
+        total = max(len(self.steps), self.index)
+        if self.progress(self.phase, self.index, total):
+            raise BuildCancelled("{} cancelled during {}".format(
+                self.name, self.phase))
+
+    # Shapes and effectors go with the node they are under. Shared control
+    # shape templates and IK solvers stay for the next build.
+    def created(self):
+        if self.allocator is not None:
+            names = list(self.allocator.names.values())
+            return cmds.ls(names) if names else []
+        if self._nodes is None:
+            return []
+        return [node for node in cmds.ls() if node not in self._nodes]
+
+    # Deletes the build's nodes, inside its undo chunk so undoing the
+    # chunk doesn't bring them back
+    def undo(self):
+        created = self.created()
+        if created:
+            cmds.delete(created)
+        return created
+
+    def finish(self):
+        try:
+            cmds.undoInfo(closeChunk=True)
+        finally:
+            if self._evaluation_mode is not None:
+                cmds.evaluationManager(mode=self._evaluation_mode)
+            if not self._suspended:
+                cmds.refresh(suspend=False)
+
+
+_build_session = None
+
+
+# Runs the block as a BuildSession. Nested blocks join the outer session,
+# so a build made of other builds is still one undo step and one refresh.
+# With patterns, names are allocated in the block, see unique_names().
+@contextlib.contextmanager
+def build_session(name, steps=None, progress=None, defer_evaluation=True,
+                  rollback=True, patterns=None):
+    global _build_session
+    if _build_session is not None:
+        _build_session.depth += 1
+        try:
+            with _allocating(patterns):
+                yield _build_session
+        finally:
+            _build_session.depth -= 1
+        return
+    with _allocating(patterns) as allocator:
+        session = BuildSession(name, steps, progress, defer_evaluation,
+                               rollback, allocator)
+        session.start()
+        _build_session = session
+        try:
+            yield session
+        except BaseException:
+            if session.rollback:
+                session.undo()
+            raise
+        finally:
+            _build_session = None
+            session.finish()
+
+
+@contextlib.contextmanager
+def _allocating(patterns):
+    if patterns is None:
+        yield None
+        return
+    with unique_names(patterns) as allocator:
+        yield allocator
+
+
+# Reports a step of the running build. Steps of a nested build only give
+# the outer build's progress a chance to cancel.
+def build_step(phase):
+    if _build_session is None:
+        return
+    if _build_session.depth:
+        _build_session.check()
+    else:
+        _build_session.step(phase)
+
+
+# Runs a helper in its own undo chunk when it isn't part of a build, so it
+# is one undo step when called from the script editor too
+def in_build_session(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with build_session(func.__name__, defer_evaluation=False,
+                           rollback=False):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# Hands out node names so Maya never has to rename a clash. Names matching
+# patterns are listed once up front, after that every name is a set
+# lookup. A taken name gets the next number Maya would have given it.
+# names maps each requested name to the name handed out.
+class NameAllocator(object):
+    def __init__(self, patterns=None):
+        self.names = {}
+        self.requested = {}
+        self._taken = set()
+        self._last_index = {}
+        for name in (cmds.ls(patterns) if patterns else None) or []:
+            self.reserve(name.rpartition('|')[2])
+
+    def reserve(self, name):
+        self._taken.add(name)
+        stem = name.rstrip('0123456789')
+        if stem != name:
+            self._last_index[stem] = max(self._last_index.get(stem, 0),
+                                         int(name[len(stem):]))
+
+    def allocate(self, name):
+        unique = name
+        if name in self._taken:
+            stem = name.rstrip('0123456789')
+            index = self._last_index.get(stem, 0) + 1
+            while stem + str(index) in self._taken:
+                index += 1
+            unique = stem + str(index)
+        self.reserve(unique)
+        self.names[name] = unique
+        self.requested[unique] = name
+        return unique
+
+
+_name_allocator = None
+
+
+# Allocates every name asked for in the block from one NameAllocator.
+# Every name the block can clash with has to match patterns. Nested blocks
+# share the outer allocator.
+@contextlib.contextmanager
+def unique_names(patterns):
+    global _name_allocator
+    if _name_allocator is not None:
+        yield _name_allocator
+        return
+    _name_allocator = NameAllocator(patterns)
+    try:
+        yield _name_allocator
+    finally:
+        _name_allocator = None
+
+
+# A free name for a new node, the name itself outside unique_names()
+def unique_name(name):
+    if _name_allocator is None:
+        return name
+    return _name_allocator.allocate(name)
+
+
+# The name a node was given for a requested name, and back
+def allocated_name(name):
+    if _name_allocator is None:
+        return name
+    return _name_allocator.names.get(name, name)
+
+
+def requested_name(name):
+    if _name_allocator is None:
+        return name
+    return _name_allocator.requested.get(name, name)
+
+
+# Requested to given names of everything allocated so far
+def allocated_names():
+    if _name_allocator is None:
+        return {}
+    return dict(_name_allocator.names)
+
+
+# One query for everything snap, distance and align_lras need from a node
+def world_matrix(node):
+    if _transform_cache is not None:
+        return _transform_cache.world_matrix(node)
+    return cmds.xform(node, query=True, worldSpace=True, matrix=True)
+
+
+def get_parent(node):
+    if _transform_cache is not None:
+        return _transform_cache.parent(node)
+    parent_node = cmds.listRelatives(node, parent=True)
+    return parent_node[0] if parent_node else None
+
+
+def parent_matrix(node):
+    parent_node = get_parent(node)
+    if not parent_node:
+        return None
+    return world_matrix(parent_node)
+
+
+@in_build_session
 def reset_to_origin(node):
     # Find position
     node_pos = cmds.xform(node, query=True, worldSpace=True, rotatePivot=True)
@@ -19,10 +485,12 @@ def reset_to_origin(node):
     reset_transformation(node, rotate=True)
     cmds.makeIdentity(node, apply=True, translate=True,
                       rotate=True, scale=False, normal=False)
+    invalidate(node)
 
 
 # Moves target object to destination object's position and orientation
 # Won't work if objects are locked or have translate or rotate connections
+@in_build_session
 def snap(target, dest, freeze_transform=False, translate=True, rotate=True):
 
     # Use selected objects if None are provided
@@ -33,24 +501,32 @@ def snap(target, dest, freeze_transform=False, translate=True, rotate=True):
         cmds.error("Must provide a target and destination object")
 
     # Set position and orientation of the target to the dest
+    dest_matrix = orthonormal_matrix(world_matrix(dest))
+    invalidate(target)
+    if cmds.nodeType(target) == 'joint' and freeze_transform:
+        # A frozen joint keeps its translate and stores rotation as orient
+        local = offset_matrix(dest_matrix, parent_matrix(target))
+        if translate:
+            cmds.setAttr(target + '.translate', *get_translation(local))
+        if rotate:
+            cmds.setAttr(target + '.jointOrient', *get_euler_rotation(local))
+            cmds.setAttr(target + '.rotate', 0, 0, 0)
+        return
+    flags = {}
     if translate:
-        dest_translation = cmds.xform(
-            dest, query=True, translation=True, worldSpace=True)
-        cmds.xform(target, translation=dest_translation, worldSpace=True)
+        flags['translation'] = get_translation(dest_matrix)
     if rotate:
-        dest_rotation = cmds.xform(
-            dest, query=True, rotation=True, worldSpace=True)
-        cmds.xform(target, rotation=dest_rotation, worldSpace=True)
+        flags['rotation'] = get_euler_rotation(dest_matrix)
+    if flags:
+        cmds.xform(target, worldSpace=True, **flags)
     if freeze_transform:
         cmds.makeIdentity(target, apply=True, translate=True, rotate=True,
                           scale=True, normal=False)
 
 
 def distance(node_a, node_b):
-    a_loc = cmds.xform(node_a, query=True, worldSpace=True, rotatePivot=True)
-    b_loc = cmds.xform(node_b, query=True, worldSpace=True, rotatePivot=True)
-    dist = pow(sum([pow(a-b, 2) for a, b in zip(a_loc, b_loc)]), 0.5)
-    return dist
+    return point_distance(get_translation(world_matrix(node_a)),
+                          get_translation(world_matrix(node_b)))
 
 
 def create_curve(point_list, name, deg=1):
@@ -59,10 +535,83 @@ def create_curve(point_list, name, deg=1):
     cmds.rename(shape, curve + 'Shape')
     return curve
 
+
+PLUS_SHAPE_COORDS = [[-0.333, 0.333, 0.0], [-0.333, 1.0, 0.0],
+                     [0.333, 1.0, 0.0], [0.333, 0.333, 0.0],
+                     [1.0, 0.333, 0.0], [1.0, -0.333, 0.0],
+                     [0.333, -0.333, 0.0], [0.333, -1.0, 0.0],
+                     [-0.333, -1.0, 0.0], [-0.333, -0.333, 0.0],
+                     [-1.0, -0.333, 0.0], [-1.0, 0.333, 0.0],
+                     [-0.333, 0.333, 0.0]]
+PV_SHAPE_COORDS = [[0, 1, 0], [0, -1, 0], [0, 0, 0],
+                   [-1, 0, 0], [1, 0, 0], [0, 0, 0],
+                   [0, 0, -1], [0, 0, 1]]
+# Linear shapes by name, circles and squares come from cmds.circle
+CONTROL_SHAPE_COORDS = {'plus': PLUS_SHAPE_COORDS, 'cross': PV_SHAPE_COORDS}
+CONTROL_SHAPES = ['circle', 'square'] + sorted(CONTROL_SHAPE_COORDS)
+SHAPE_LIBRARY_GROUP = 'controlShapes_GROUP'
+
+
+# Name of the template holding a control shape, e.g. circle_d3s8_X_1p5
+def _shape_template_name(shape, degree, sections, normal, size):
+    size_name = '{:g}'.format(round(size, 4))
+    return '{}_d{}s{}_{}_{}_shapeTemplate'.format(
+        shape, degree, sections, normal.replace('-', 'n'),
+        size_name.replace('.', 'p').replace('-', 'n'))
+
+
+# Returns the shape node of a control shape, building it the first time a
+# scene asks for it. Templates live under a hidden group and are keyed by
+# shape, degree, sections, normal axis and size. 'square' is a 4 section
+# linear circle turned 45 degrees; 'plus' and 'cross' ignore normal,
+# degree and sections.
+def control_shape(shape='circle', degree=3, sections=8, normal='X',
+                  size=1.0):
+    if shape not in CONTROL_SHAPES:
+        error("Control shape must be one of " + ', '.join(CONTROL_SHAPES))
+    if shape in CONTROL_SHAPE_COORDS:
+        degree, sections, normal = 1, len(CONTROL_SHAPE_COORDS[shape]), 'Z'
+    elif shape == 'square':
+        degree, sections = 1, 4
+    template = _shape_template_name(shape, degree, sections, normal, size)
+    if cmds.objExists(template):
+        return cmds.listRelatives(template, shapes=True, fullPath=True)[0]
+
+    if not cmds.objExists(SHAPE_LIBRARY_GROUP):
+        cmds.group(empty=True, name=SHAPE_LIBRARY_GROUP)
+        cmds.hide(SHAPE_LIBRARY_GROUP)
+    if shape in CONTROL_SHAPE_COORDS:
+        points = [[c * size for c in p] for p in CONTROL_SHAPE_COORDS[shape]]
+        template = create_curve(points, template)
+    else:
+        template = cmds.circle(radius=size, normal=get_axis_vector(normal),
+                               degree=degree, sections=sections,
+                               constructionHistory=False, name=template)[0]
+        if shape == 'square':
+            cmds.setAttr(template + '.rotate' + normal[-1], 45)
+            cmds.makeIdentity(template, apply=True, rotate=True,
+                              normal=False)
+    cmds.parent(template, SHAPE_LIBRARY_GROUP)
+    return cmds.listRelatives(template, shapes=True, fullPath=True)[0]
+
+
+# A control transform drawn with an instance of a library shape. Every
+# control of the same shape and size shares one nurbsCurve, nothing is
+# frozen, so place the control through its offsetParentMatrix.
+def create_control(name, shape='circle', degree=3, sections=8, normal='X',
+                   size=1.0, parent=None):
+    shape_node = control_shape(shape, degree, sections, normal, size)
+    ctrl = cmds.createNode('transform', name=unique_name(name),
+                           parent=parent)
+    cmds.parent(shape_node, ctrl, shape=True, addObject=True)
+    return ctrl
+
 # align local rotation axes of control to the joint
-# Code taken from Nick Miller
+# Based on code from Nick Miller, the offset is computed from one world
+# matrix read per node instead of temporary joints and freezes
 
 
+@in_build_session
 def align_lras(snap_align=False, delete_history=True, sel=None):
     # get selection (first ctrl, then joint)
     if not sel:
@@ -73,74 +622,39 @@ def align_lras(snap_align=False, delete_history=True, sel=None):
     ctrl = sel[0]
     jnt = sel[1]
 
-    # check to see if the control has a parent
-    # if it does, un parent it by parenting it to the world
-    parent_node = cmds.listRelatives(ctrl, parent=True)
-    if parent_node:
-        cmds.parent(ctrl, world=True)
-
-    # store the ctrl/joint's world space position, rotation, and matrix
-    jnt_matrix = cmds.xform(jnt, query=True, worldSpace=True, matrix=True)
-    jnt_pos = cmds.xform(jnt, query=True, worldSpace=True, rotatePivot=True)
-    jnt_rot = cmds.xform(jnt, query=True, worldSpace=True, rotation=True)
-    ctrl_pos = cmds.xform(ctrl, query=True, worldSpace=True, rotatePivot=True)
-    ctrl_rot = cmds.xform(ctrl, query=True, worldSpace=True, rotation=True)
+    parent_node = get_parent(ctrl)
+    parent_world = world_matrix(parent_node) if parent_node else None
+    jnt_matrix = world_matrix(jnt)
+    if not snap_align:
+        ctrl_matrix = world_matrix(ctrl)
+    use_offset_parent = cmds.objExists(ctrl + '.offsetParentMatrix')
+    invalidate(ctrl, reparent=not use_offset_parent)
 
     # in maya 2020 we can choose to use the offsetParentMatrix instead of
     # using an offset group
-    if cmds.objExists(ctrl + '.offsetParentMatrix'):
-        off_grp = False
-        # ensure offset matrix has default values
-        cmds.setAttr(ctrl + '.offsetParentMatrix',
-                     [1.0, 0.0, 0.0, 0.0, 0.0,
-                      1.0, 0.0, 0.0, 0.0, 0.0,
-                      1.0, 0.0, 0.0, 0.0, 0.0,
-                      1.0], type='matrix')
-        reset_to_origin(ctrl)
-        # copy joint's matrix to control's offsetParentMatrix
-        cmds.setAttr(ctrl + '.offsetParentMatrix', jnt_matrix, type='matrix')
-
-        if parent_node:
-            # make temporary joints to help calculate offset matrix
-            tmp_parent_jnt = cmds.joint(None, name='tmp_01_JNT')
-            tmp_child_jnt = cmds.joint(tmp_parent_jnt, name='tmp_02_JNT')
-            snap(tmp_parent_jnt, parent_node[0])
-            snap(tmp_child_jnt, jnt)
-            cmds.parent(ctrl, parent_node[0])
-            reset_transformation(ctrl, True, True, True)
-
-            child_matrix = cmds.getAttr(tmp_child_jnt + '.matrix')
-            cmds.setAttr(ctrl + '.offsetParentMatrix',
-                         child_matrix, type='matrix')
-            cmds.delete(tmp_parent_jnt)
-
+    off_grp = None
+    if use_offset_parent:
+        offset = offset_matrix(jnt_matrix, parent_world)
+        cmds.setAttr(ctrl + '.offsetParentMatrix', offset, type='matrix')
     # Maya 2019 and below
     else:
-        reset_to_origin(ctrl)
-        # create offset group
-        off_grp = cmds.createNode('transform', name=ctrl + '_OFF_GRP')
-
-        # move offset group to joint position, parent ctrl to it, zero channels
-        cmds.xform(off_grp, worldSpace=True,
-                   translation=jnt_pos, rotation=jnt_rot)
-        if parent_node:
-            cmds.parent(off_grp, parent_node[0])
-
-    # move the control back into place
-    cmds.xform(ctrl, worldSpace=True, translation=ctrl_pos)
-    cmds.xform(ctrl, worldSpace=True, rotation=ctrl_rot)
-
-    # parent control to offset group, if it exists
-    if off_grp:
-        cmds.parent(ctrl, off_grp)
+        off_grp = cmds.createNode('transform', name=ctrl + '_OFF_GRP',
+                                  parent=parent_node)
+        offset = offset_matrix(orthonormal_matrix(jnt_matrix), parent_world)
+        cmds.xform(off_grp, objectSpace=True, matrix=offset)
+        cmds.parent(ctrl, off_grp, relative=True)
 
-    # freeze transforms again, then move pivot to match joint's
+    # zero the control onto the joint, or keep it in place and freeze
     if snap_align:
         reset_transformation(ctrl, True, True, True)
     else:
+        base = offset if parent_world is None else mult_matrix(
+            offset, parent_world)
+        cmds.xform(ctrl, objectSpace=True,
+                   matrix=offset_matrix(ctrl_matrix, base))
         cmds.makeIdentity(ctrl, apply=True, translate=True, rotate=True,
                           scale=False, normal=False)
-    cmds.xform(ctrl, worldSpace=True, pivots=jnt_pos)
+    cmds.xform(ctrl, objectSpace=True, pivots=(0, 0, 0))
 
     # delete construction history
     if delete_history:
@@ -151,11 +665,13 @@ def align_lras(snap_align=False, delete_history=True, sel=None):
         return ctrl
 
 
+@in_build_session
 def reset_transformation(nodes, translate=False, rotate=False, scale=False):
     if not nodes:
         nodes = cmds.ls(selection=True)
     if not isinstance(nodes, list):
         nodes = [nodes]
+    invalidate(nodes)
     for node in nodes:
         if translate:
             cmds.setAttr(node + '.translate', 0, 0, 0)
@@ -174,13 +690,14 @@ def get_axis_vector(axis='X'):
     elif axis[-1] == 'Z':
         axis_vec = (0, 0, 1)
     else:
-        cmds.error("Must be X, Y, Z or -X, -Y, -Z")
+        error("Must be X, Y, Z or -X, -Y, -Z")
     if axis[0] == '-':
-        axis_vec = tuple((-a for a in axis))
+        axis_vec = tuple((-a for a in axis_vec))
     return axis_vec
 
 
 # transfers pivots to either first selected object or origin
+@in_build_session
 def transfer_pivots(origin=False, sel=False):
     # if selection list is not defined, use selected in scene
     if not sel:
@@ -192,8 +709,7 @@ def transfer_pivots(origin=False, sel=False):
     # move pivot to first selected object
     else:
         # get the rotate pivot
-        first_piv = cmds.xform(sel[0], query=True, worldSpace=True,
-                               rotatePivot=True)
+        first_piv = get_translation(world_matrix(sel[0]))
         for s in sel[1:]:
             # set the rotate and scale pivot simultaneously
             cmds.xform(s, worldSpace=True, pivots=first_piv)
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+# Part of every key, bump it when plan_limb's output or the entry layout
+# changes so older entries stop matching
+CACHE_VERSION = 4
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_SUFFIX = '.rig.json.gz'
+# create_limb arguments plan_limb takes, the others only go into the key
+PLAN_KEYS = ['side', 'limb', 'joints', 'aliases', 'pole_vector',
+             'primary_axis', 'up_axis', 'stretch', 'blend_mode',
+             'stretch_node']
+
+
+def _rounded(matrix, digits=6):
+    return [round(float(v), digits) + 0.0 for v in matrix]
+
+
+# Hash of the guides' world matrices, in guide order, and the build
+# options. Matrices are rounded so float noise from the scene doesn't
+# turn a hit into a miss.
+def build_key(guide_matrices, guides, options):
+    data = {'version': CACHE_VERSION,
+            'guides': [_rounded(guide_matrices[g]) for g in guides],
+            'options': options}
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# Built rigs on disk, one gzipped JSON file per key. An entry holds the
+# rig as rig_plan.plan_script() MEL, the planned names to allocate, the
+# plan's outputs and the seconds planning and applying it took. Reading an
+# entry marks it as used, and the least recently used entries are dropped
+# once the directory holds more than max_bytes. Several processes can
+# share a directory: entries are written whole and a vanished entry is a
+# miss. The stats count the seconds misses spent building, hits spent
+# loading, and what the hits saved against building their rig again.
+class RigCache(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.seconds_building = 0.0
+        self.seconds_loading = 0.0
+        self.seconds_saved = 0.0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    # Returns the entry for key as a dict, or None. An entry missing any of
+    # its fields is a miss and is removed.
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with gzip.open(path, 'rt') as f:
+                entry = json.load(f)
+        except (IOError, OSError, EOFError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            valid = isinstance(entry['script'], str) and \
+                isinstance(entry['planned'], list) and \
+                isinstance(entry['outputs'], dict) and \
+                float(entry['seconds']) >= 0.0
+        except (KeyError, TypeError, ValueError):
+            valid = False
+        if not valid:
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry
+
+    # Stores the rig a plan builds, seconds is how long planning and
+    # applying it took
+    def put(self, key, plan, seconds):
+        self.seconds_building += seconds
+        entry = {'key': key, 'script': rig_plan.plan_script(plan),
+                 'planned': rig_plan.planned_names(plan),
+                 'outputs': plan.outputs, 'seconds': seconds}
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        with os.fdopen(handle, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(entry, separators=(',', ':'))
+                        .encode('utf-8'))
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    # Entries as (last used, size, path), least recently used first
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / total if total else 0.0,
+                'seconds_building': self.seconds_building,
+                'seconds_loading': self.seconds_loading,
+                'seconds_saved': self.seconds_saved,
+                'entries': len(self.entries()), 'bytes': self.size()}
+
+
+_caches = {}
+
+
+# The RigCache for a directory, shared by every build in the session so
+# its stats add up. A RigCache is returned as is.
+def open_cache(cache, max_bytes=DEFAULT_MAX_BYTES):
+    if isinstance(cache, RigCache):
+        return cache
+    directory = os.path.abspath(cache)
+    if directory not in _caches:
+        _caches[directory] = RigCache(directory, max_bytes)
+    return _caches[directory]
+
+
+# Builds a limb through the cache and returns (names, outputs): the dict
+# of planned to given names and the plan's outputs. options are
+# create_limb's arguments, all of them go into the key even where the plan
+# doesn't depend on them. A hit loads the stored script with
+# load(script, planned), a miss plans the limb, builds it with apply(plan)
+# and stores it; both return the names. rig_plan.load_script and
+# apply_plan are the pair for cmds, api_backend has one for the api.
+def cached_build(cache, apply, load, **options):
+    cache = open_cache(cache)
+    limb_utils.build_step('plan')
+    start = time.perf_counter()
+    guides = list(options['joints']) + [options['pole_vector']]
+    guide_matrices = rig_plan.read_guides(guides)
+    key = build_key(guide_matrices, guides, options)
+    entry = cache.get(key)
+    if entry is not None:
+        limb_utils.build_step('apply')
+        names = load(entry['script'], entry['planned'])
+        seconds = time.perf_counter() - start
+        cache.seconds_loading += seconds
+        cache.seconds_saved += entry['seconds'] - seconds
+        return names, entry['outputs']
+    plan = rig_plan.plan_limb(guide_matrices=guide_matrices,
+                              **dict((k, options[k]) for k in PLAN_KEYS))
+    limb_utils.build_step('apply')
+    names = apply(plan)
+    cache.put(key, plan, time.perf_counter() - start)
+    return names, plan.outputs
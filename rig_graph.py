@@ -0,0 +1,417 @@
+import argparse
+import collections
+import json
+import sys
+
+import lrig.fake_maya as fake_maya
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+try:
+    import maya.cmds as cmds
+except ImportError:  # Graphs from plans and files are analyzed without Maya
+    cmds = None
+
+# Source plugs that reference a node rather than pass data
+REFERENCE_ATTRS = ['message', 'handlePath']
+# Plugs of a DAG node that only depend on its parent
+PARENT_SPACE_ATTRS = ['parentMatrix', 'parentInverseMatrix']
+# Node types the parallel evaluation manager runs one at a time
+SERIAL_NODE_TYPES = ['expression', 'script', 'unknown', 'unknownDag',
+                     'unknownTransform']
+FAN_OUT_THRESHOLD = 4
+
+
+def _attr(plug):
+    return plug.partition('.')[2].split('[')[0].split('.')[0]
+
+
+# A rig's evaluation network: every node with its type and DAG parent, and
+# every connection as a (source plug, destination plug) pair. Plugs are
+# 'node.attr' with the node's short name.
+class RigGraph(object):
+    def __init__(self):
+        self.nodes = collections.OrderedDict()
+        self.parents = {}
+        self.connections = []
+
+    def add_node(self, name, node_type, parent=None):
+        self.nodes[name] = node_type
+        self.parents[name] = parent
+
+    def connect(self, source, destination):
+        self.connections.append([source, destination])
+
+    def children(self):
+        children = collections.defaultdict(list)
+        for name, parent in self.parents.items():
+            if parent:
+                children[parent].append(name)
+        return children
+
+    def to_dict(self):
+        return {'nodes': [{'name': name, 'type': node_type,
+                           'parent': self.parents[name]}
+                          for name, node_type in self.nodes.items()],
+                'connections': [list(c) for c in self.connections]}
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls()
+        for node in data['nodes']:
+            graph.add_node(node['name'], node['type'], node.get('parent'))
+        for source, destination in data['connections']:
+            graph.connect(source, destination)
+        return graph
+
+    # Node level dependencies as {node: set of nodes it depends on}. A
+    # child depends on its parent, a connection's destination on its
+    # source, and an IK chain's joints on their handle. Constraints only
+    # sit under the node they drive, they don't depend on it.
+    def dependencies(self):
+        upstream = collections.defaultdict(set)
+        for name, parent in self.parents.items():
+            if parent in self.nodes and \
+                    self.nodes[name] not in fake_maya.CONSTRAINT_OUTPUTS:
+                upstream[name].add(parent)
+        for source, destination in self.connections:
+            node = source.partition('.')[0]
+            if _attr(source) in REFERENCE_ATTRS:
+                continue
+            if _attr(source) in PARENT_SPACE_ATTRS:
+                node = self.parents.get(node)
+            target = destination.partition('.')[0]
+            if node in self.nodes and target in self.nodes and \
+                    node != target:
+                upstream[target].add(node)
+        for handle, joints in self.ik_chains().items():
+            for joint in joints:
+                upstream[joint].add(handle)
+        return upstream
+
+    # Joints each IK handle solves, from its start joint to the parent of
+    # its end effector
+    def ik_chains(self):
+        starts = {}
+        ends = {}
+        for source, destination in self.connections:
+            node, attr = destination.partition('.')[0], _attr(destination)
+            if self.nodes.get(node) != 'ikHandle':
+                continue
+            if attr == 'startJoint':
+                starts[node] = source.partition('.')[0]
+            elif attr == 'endEffector':
+                ends[node] = self.parents.get(source.partition('.')[0])
+        chains = {}
+        for handle, start in starts.items():
+            joint = ends.get(handle)
+            chain = []
+            while joint and joint != start:
+                chain.append(joint)
+                joint = self.parents.get(joint)
+            if joint == start:
+                chains[handle] = [start] + chain[::-1]
+        return chains
+
+
+# The graph a plan builds, with the connections Maya adds for its
+# constraints and IK handles. Needs no scene.
+def plan_graph(plan):
+    graph = RigGraph()
+    for node in plan.nodes:
+        graph.add_node(node['name'], node['type'], node['parent'])
+    for source, destination in plan.connections:
+        graph.connect(source, destination)
+    for handle in plan.ik_handles:
+        end = handle['endEffector']
+        end_parent = graph.parents.get(end)
+        effector = rig_plan.effector_name(handle['name'])
+        graph.add_node(handle['name'], 'ikHandle', handle['parent'])
+        graph.add_node(effector, 'ikEffector', end_parent)
+        if handle['solver'] not in graph.nodes:
+            graph.add_node(handle['solver'], handle['solver'])
+        for axis in 'XYZ':
+            graph.connect(end + '.translate' + axis,
+                          effector + '.translate' + axis)
+        graph.connect(handle['startJoint'] + '.message',
+                      handle['name'] + '.startJoint')
+        graph.connect(effector + '.handlePath[0]',
+                      handle['name'] + '.endEffector')
+        graph.connect(handle['solver'] + '.message',
+                      handle['name'] + '.ikSolver')
+    for constraint in plan.constraints:
+        name = constraint['name']
+        driver, driven = constraint['driver'], constraint['driven']
+        graph.add_node(name, constraint['type'], driven)
+        prefix = name + '.target[0].target'
+        graph.connect(driver + '.parentMatrix[0]', prefix + 'ParentMatrix')
+        for attr in fake_maya.CONSTRAINT_TARGET_ATTRS[constraint['type']]:
+            graph.connect(driver + '.' + attr,
+                          prefix + attr[0].upper() + attr[1:])
+        graph.connect('{}.{}W0'.format(name, driver), prefix + 'Weight')
+        graph.connect(driven + '.parentInverseMatrix[0]',
+                      name + '.constraintParentInverseMatrix')
+        outputs = fake_maya.CONSTRAINT_OUTPUTS[constraint['type']]
+        for output, attr in outputs:
+            for axis in 'XYZ':
+                graph.connect(name + '.' + output + axis,
+                              driven + '.' + attr + axis)
+    return graph
+
+
+# Reads a built rig from its top group: its DAG hierarchy in one query,
+# then the incoming connections of every node. Dependency nodes are
+# followed upstream, DAG nodes outside the rig are recorded but not
+# followed.
+def read_graph(top_group):
+    if cmds is None:
+        limb_utils.error("Reading a rig graph requires Maya")
+    graph = RigGraph()
+    listed = cmds.ls(top_group, dag=True, long=True, showType=True) or []
+    for i, (path, node_type) in enumerate(zip(listed[::2], listed[1::2])):
+        parts = path.split('|')
+        if parts[-1] not in graph.nodes:  # Instances keep their first path
+            graph.add_node(parts[-1], node_type, parts[-2] if i else None)
+
+    pending = list(graph.nodes)
+    while pending:
+        node = pending.pop()
+        plugs = cmds.listConnections(node, source=True, destination=False,
+                                     connections=True, plugs=True) or []
+        for destination, source in zip(plugs[::2], plugs[1::2]):
+            graph.connect(source, destination)
+            source_node = source.partition('.')[0]
+            if source_node in graph.nodes:
+                continue
+            graph.add_node(source_node, cmds.nodeType(source_node))
+            if not cmds.ls(source_node, dag=True):
+                pending.append(source_node)
+    return graph
+
+
+# Strongly connected components with more than one node, Tarjan's
+# algorithm without recursion
+def _cycles(nodes, upstream):
+    downstream = collections.defaultdict(list)
+    for node, sources in upstream.items():
+        for source in sources:
+            downstream[source].append(node)
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(downstream[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, edges = work[-1]
+            for child in edges:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(downstream[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        cycles.append(sorted(component))
+    return cycles
+
+
+# Longest path from any of starts to every node of an acyclic graph.
+# Returns {node: path} for the nodes a start reaches.
+def _longest_paths(upstream, starts):
+    downstream = collections.defaultdict(list)
+    waiting = dict((node, len(sources)) for node, sources in upstream.items())
+    for node, sources in upstream.items():
+        for source in sources:
+            downstream[source].append(node)
+    ready = [node for node, count in waiting.items() if not count]
+    paths = {}
+    while ready:
+        node = ready.pop()
+        if node in starts and node not in paths:
+            paths[node] = [node]
+        for child in downstream[node]:
+            if node in paths and (child not in paths or
+                                  len(paths[node]) >= len(paths[child])):
+                paths[child] = paths[node] + [child]
+            waiting[child] -= 1
+            if not waiting[child]:
+                ready.append(child)
+    return paths
+
+
+# Summarizes a graph: node, plug and connection counts, the longest path
+# from the controls to each bind joint, the plugs that fan out to
+# fan_out or more destinations, and what forces serial evaluation.
+def analyze(graph, fan_out=FAN_OUT_THRESHOLD):
+    upstream = graph.dependencies()
+    nodes = list(graph.nodes)
+    plugs = set()
+    outgoing = collections.Counter()
+    for source, destination in graph.connections:
+        plugs.update([source, destination])
+        outgoing[source] += 1
+
+    controls = set(node for node, node_type in graph.nodes.items()
+                   if node.endswith('_Control') and
+                   node_type == 'transform')
+
+    # A control constrained to a joint its own attributes drive, like the
+    # blend control following the wrist, closes a cycle only at the node
+    # level. The evaluation manager still clusters it, so it is reported,
+    # but depths are measured without the constraint's edge into the
+    # control so each joint keeps its own path.
+    feedback = []
+    cycles = _cycles(nodes, upstream)
+    for cycle in cycles:
+        for node in cycle:
+            if node not in controls:
+                continue
+            for source in sorted(upstream[node]):
+                if source in cycle and \
+                        graph.nodes[source] in fake_maya.CONSTRAINT_OUTPUTS:
+                    feedback.append((source, node, sorted(
+                        upstream[source] & set(cycle))))
+    if feedback:
+        upstream = collections.defaultdict(set, (
+            (node, set(sources)) for node, sources in upstream.items()))
+        for constraint, control, _ in feedback:
+            upstream[control].discard(constraint)
+        cycles = _cycles(nodes, upstream)
+
+    # Depth is measured with every cycle collapsed into one step, which
+    # shows up in a path as the list of the cycle's nodes
+    steps = dict((node, node) for node in nodes)
+    for i, cycle in enumerate(cycles):
+        steps.update((node, i) for node in cycle)
+    step_upstream = dict((step, set()) for step in steps.values())
+    for node, sources in upstream.items():
+        step_upstream[steps[node]].update(
+            steps[source] for source in sources
+            if steps[source] != steps[node])
+    paths = _longest_paths(step_upstream,
+                           set(steps[node] for node in controls))
+    depth = {}
+    for joint in nodes:
+        if not joint.endswith('_Bind_Joint'):
+            continue
+        path = paths.get(steps[joint], [])
+        depth[joint] = {'length': len(path) - 1 if path else None,
+                        'path': [cycles[step] if isinstance(step, int)
+                                 else step for step in path]}
+
+    blockers = [{'pattern': 'cycle', 'nodes': cycle,
+                 'detail': "The evaluation manager runs a cycle as one "
+                           "serial cluster"}
+                for cycle in cycles]
+    for constraint, control, drivers in feedback:
+        blockers.append({'pattern': 'control_feedback',
+                         'nodes': drivers + [constraint, control],
+                         'detail': control + " follows a node its own "
+                                   "attributes drive, which the evaluation "
+                                   "manager runs as one serial cluster"})
+    for node, node_type in graph.nodes.items():
+        if node_type in SERIAL_NODE_TYPES:
+            blockers.append({'pattern': 'serial_node', 'nodes': [node],
+                             'detail': node_type + " nodes evaluate "
+                                       "serially"})
+    hotspots = [{'plug': plug, 'destinations': count}
+                for plug, count in outgoing.most_common()
+                if count >= fan_out]
+
+    lengths = [d['length'] for d in depth.values() if d['length'] is not None]
+    children = graph.children()
+    return {'nodes': len(nodes),
+            'node_types': dict(collections.Counter(graph.nodes.values())),
+            'dag_nodes': sum(1 for node in nodes
+                             if graph.parents[node] or node in children),
+            'connections': len(graph.connections),
+            'plugs': len(plugs),
+            'dependencies': sum(len(s) for s in upstream.values()),
+            'controls': len(controls),
+            'max_depth': max(lengths) if lengths else 0,
+            'bind_depth': depth,
+            'fan_out': hotspots,
+            'serial_blockers': blockers}
+
+
+def _build_limb(options):
+    headless = fake_maya.install() is not None
+    import lrig.benchmark as benchmark
+    import lrig.limb as limb
+    if headless:
+        fake_maya.new_scene()
+    else:
+        limb.cmds.file(new=True, force=True)
+    guides = benchmark.create_guides(limb.cmds, 0)
+    top_group = limb.create_limb(**dict(options, **guides))
+    # The fake scene is only installed after this module was imported
+    global cmds
+    cmds = limb.cmds
+    return read_graph(top_group)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze a limb's evaluation network. Reads a saved "
+                    "rig plan or graph, or builds a limb in a fake scene "
+                    "outside Maya.")
+    parser.add_argument('input', nargs='?',
+                        help="RigPlan or RigGraph JSON file")
+    parser.add_argument('--backend', default='cmds')
+    parser.add_argument('--blend-mode', default='blendColors')
+    parser.add_argument('--no-stretch', action='store_true')
+    parser.add_argument('--stretch-node', action='store_true')
+    parser.add_argument('--fan-out', type=int, default=FAN_OUT_THRESHOLD)
+    parser.add_argument('--graph', action='store_true',
+                        help="Include the graph in the report")
+    parser.add_argument('--output', help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input) as f:
+            data = json.load(f)
+        if 'constraints' in data:
+            graph = plan_graph(rig_plan.RigPlan.from_dict(data))
+        else:
+            graph = RigGraph.from_dict(data)
+    else:
+        graph = _build_limb({'backend': args.backend,
+                             'blend_mode': args.blend_mode,
+                             'stretch': not args.no_stretch,
+                             'stretch_node': args.stretch_node})
+    report = analyze(graph, args.fan_out)
+    if args.graph:
+        report['graph'] = graph.to_dict()
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
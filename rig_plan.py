@@ -0,0 +1,756 @@
+import copy
+import json
+import math
+import re
+
+import lrig.limb_utils as limb_utils
+
+try:
+    import maya.cmds as cmds
+    import maya.mel as mel
+except ImportError:  # Planning and dry runs work without Maya
+    cmds = None
+    mel = None
+
+TRANSLATE = "translate"
+ROTATE = "rotate"
+SCALE = "scale"
+PLUS_SHAPE_COORDS = limb_utils.PLUS_SHAPE_COORDS
+PV_SHAPE_COORDS = limb_utils.PV_SHAPE_COORDS
+# CV radius of Maya's degree 3, 8 section circle of radius 1
+CIRCLE_CV_RADIUS = 1.108194
+# A rig's groups, in the order plan_groups() creates them. A character's
+# limbs share the character's.
+RIG_GROUPS = ['top_group', 'skeleton_group', 'rig_group', 'fk_ctrl_group',
+              'ik_ctrl_group', 'no_xform_group']
+
+
+# A complete, scene independent description of a rig. Everything is keyed
+# by the names the planner chose; the executor maps them to the real names.
+class RigPlan(object):
+    SECTIONS = ['nodes', 'shapes', 'attributes', 'values',
+                'ik_handles', 'connections', 'constraints']
+
+    def __init__(self, base_name=""):
+        self.base_name = base_name
+        self.nodes = []
+        self.shapes = {}
+        self.attributes = []
+        self.values = []
+        self.ik_handles = []
+        self.connections = []
+        self.constraints = []
+        self.outputs = {}
+
+    def add_node(self, name, node_type, parent=None):
+        self.nodes.append({'name': name, 'type': node_type,
+                           'parent': parent})
+        return name
+
+    def add_curve(self, name, spec, parent=None):
+        self.add_node(name, 'transform', parent)
+        self.add_node(name + 'Shape', 'nurbsCurve', name)
+        self.shapes[name + 'Shape'] = spec
+        return name
+
+    def add_locator(self, name, parent=None):
+        self.add_node(name, 'transform', parent)
+        self.add_node(name + 'Shape', 'locator', name)
+        return name
+
+    def add_attr(self, node, long_name, **flags):
+        attr = {'node': node, 'longName': long_name,
+                'attributeType': 'double'}
+        attr.update(flags)
+        self.attributes.append(attr)
+
+    def set_value(self, plug, value):
+        self.values.append([plug, value])
+
+    def connect(self, source, destination):
+        self.connections.append([source, destination])
+
+    # offset is the rest driven * inverse(driver) matrix a maintainOffset
+    # constraint ends up with, kept so placements can be rewritten later
+    def constrain(self, constraint_type, driver, driven,
+                  maintain_offset=False, offset=None):
+        name = '{}_{}1'.format(driven, constraint_type)
+        constraint = {'name': name, 'type': constraint_type,
+                      'driver': driver, 'driven': driven,
+                      'maintainOffset': maintain_offset}
+        if offset is not None:
+            constraint['offset'] = list(offset)
+        self.constraints.append(constraint)
+        return name
+
+    # Adds another plan's entries, the names of both must not overlap
+    def extend(self, other):
+        for section in self.SECTIONS:
+            if section == 'shapes':
+                self.shapes.update(other.shapes)
+            else:
+                getattr(self, section).extend(getattr(other, section))
+
+    def summary(self):
+        return dict((section, len(getattr(self, section)))
+                    for section in self.SECTIONS)
+
+    # Values are rounded to digits, or kept exact when digits is None
+    def to_dict(self, digits=6):
+        data = {'base_name': self.base_name, 'outputs': self.outputs}
+        for section in self.SECTIONS:
+            data[section] = getattr(self, section) if digits is None else \
+                _rounded(getattr(self, section), digits)
+        return copy.deepcopy(data)
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent, sort_keys=True)
+
+    @classmethod
+    def from_dict(cls, data):
+        plan = cls(data.get('base_name', ""))
+        for section in cls.SECTIONS:
+            setattr(plan, section, copy.deepcopy(data[section]))
+        plan.outputs = copy.deepcopy(data.get('outputs', {}))
+        return plan
+
+    # Returns a list of readable differences between two plans
+    def diff(self, other):
+        changes = []
+        mine = self.to_dict()
+        theirs = other.to_dict()
+        for section in self.SECTIONS:
+            old = _keyed(section, theirs[section])
+            new = _keyed(section, mine[section])
+            for key in sorted(set(old) | set(new)):
+                if key not in new:
+                    changes.append('- {} {}'.format(section, key))
+                elif key not in old:
+                    changes.append('+ {} {}'.format(section, key))
+                elif old[key] != new[key]:
+                    changes.append('~ {} {}: {} -> {}'.format(
+                        section, key, old[key], new[key]))
+        return changes
+
+
+def _rounded(value, digits=6):
+    if isinstance(value, float):
+        return round(value, digits) + 0.0
+    if isinstance(value, list):
+        return [_rounded(v, digits) for v in value]
+    if isinstance(value, tuple):
+        return [_rounded(v, digits) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _rounded(v, digits)) for k, v in value.items())
+    return value
+
+
+def _keyed(section, entries):
+    if section == 'shapes':
+        return dict((k, json.dumps(v, sort_keys=True))
+                    for k, v in entries.items())
+    keyed = {}
+    for entry in entries:
+        if section in ['values']:
+            keyed[entry[0]] = json.dumps(entry[1])
+        elif section == 'connections':
+            keyed[entry[1]] = entry[0]
+        elif section == 'attributes':
+            keyed[entry['node'] + '.' + entry['longName']] = json.dumps(
+                entry, sort_keys=True)
+        else:
+            keyed[entry['name']] = json.dumps(entry, sort_keys=True)
+    return keyed
+
+
+# The two axes spanning the plane a circle with this normal is drawn in
+def _plane_axes(axis='X'):
+    planes = {'X': ([0, 1, 0], [0, 0, 1]),
+              'Y': ([0, 0, 1], [1, 0, 0]),
+              'Z': ([1, 0, 0], [0, 1, 0])}
+    return planes[axis[-1]]
+
+
+# Shape specs describe a nurbsCurve in the order Maya's .cc attribute wants
+def curve_spec(points, degree=1):
+    points = [[float(c) for c in p] for p in points]
+    return {'degree': degree, 'form': 0, 'spans': len(points) - degree,
+            'knots': _open_knots(len(points), degree), 'points': points}
+
+
+def circle_spec(radius=1.0, normal='X', degree=3, sections=8, angle=0.0):
+    u, v = _plane_axes(normal)
+    if degree == 1:
+        points = []
+        for i in range(sections + 1):
+            a = math.radians(angle + 360.0 * i / sections)
+            points.append([radius * (math.cos(a) * p + math.sin(a) * q)
+                           for p, q in zip(u, v)])
+        return curve_spec(points, 1)
+    points = []
+    for i in range(sections):
+        a = math.radians(angle + 360.0 * i / sections)
+        r = radius * CIRCLE_CV_RADIUS
+        points.append([r * (math.cos(a) * p + math.sin(a) * q)
+                       for p, q in zip(u, v)])
+    points += points[:degree]
+    return {'degree': degree, 'form': 2, 'spans': sections,
+            'knots': [float(k) for k in range(1 - degree, sections + degree)],
+            'points': points}
+
+
+def _open_knots(count, degree):
+    spans = count - degree
+    return ([0.0] * (degree - 1) + [float(k) for k in range(spans + 1)] +
+            [float(spans)] * (degree - 1))
+
+
+def _scaled(spec, scale=1.0, offset=(0.0, 0.0, 0.0)):
+    spec = copy.deepcopy(spec)
+    spec['points'] = [[p * scale + o for p, o in zip(point, offset)]
+                      for point in spec['points']]
+    return spec
+
+
+# Queries the world matrix of every guide, one query per guide
+def read_guides(guides):
+    if cmds is None:
+        limb_utils.error("Reading guides requires Maya; pass "
+                           "guide_matrices to plan without a scene")
+    return dict((g, limb_utils.world_matrix(g)) for g in guides)
+
+
+# Guides only contribute position and orientation, like snap. Returns the
+# joint world matrices, their positions, the pole vector position and each
+# joint's matrix relative to the previous one.
+def guide_placement(guide_matrices, joints, pole_vector):
+    world = [limb_utils.orthonormal_matrix(guide_matrices[j])
+             for j in joints]
+    positions = [limb_utils.get_translation(m) for m in world]
+    pv_position = limb_utils.get_translation(guide_matrices[pole_vector])
+    local = [limb_utils.offset_matrix(world[i], world[i - 1] if i else None)
+             for i in range(len(world))]
+    return world, positions, pv_position, local
+
+
+def _chain_names(side_name, joints, aliases, chain_type):
+    return ['{}{}_{}_Joint'.format(side_name, aliases[j], chain_type)
+            for j in joints]
+
+
+# Every name a limb gets starts with one of these, names are the joints'
+# aliases. Only an earlier build of the same limb matches them.
+def name_patterns(side_name, limb, names):
+    base_name = side_name + limb.capitalize()
+    return [base_name + '*', base_name.upper() + '*'] + \
+        ['{}{}_*'.format(side_name, name) for name in names]
+
+
+# Errors out on options no limb can be built from, before anything is
+# named after the aliases. Returns the aliases, the default ones when
+# aliases is None.
+def check_limb(side, limb, joints, aliases=None):
+    if side not in ['L', 'R']:
+        limb_utils.error("Must specify L (left) or R (right) for side")
+    if limb not in ['arm', 'leg']:
+        limb_utils.error("Must specify arm or leg for limb")
+    if aliases is None:
+        aliases = dict(zip(joints, ['Shoulder', 'Elbow', 'Wrist']))
+    if len(joints) != 3 or len(aliases) != 3:
+        limb_utils.error("Must create 3 joints for a limb")
+    missing = [joint for joint in joints if joint not in aliases]
+    if missing:
+        limb_utils.error("No alias for " + ", ".join(missing))
+    return aliases
+
+
+# An ikHandle's effector is named after it
+def effector_name(handle):
+    return handle + '_effector'
+
+
+# A rig's groups: the top group, the skeleton and rig groups under it and
+# the FK control, IK control and noXform groups under the rig group.
+# Returns them keyed by RIG_GROUPS.
+def plan_groups(plan, base_name, parent=None):
+    top_group = plan.add_node(base_name.upper(), 'transform', parent)
+    groups = {'top_group': top_group}
+    for key, suffix, group_parent in [
+            ('skeleton_group', '_skeleton_GROUP', top_group),
+            ('rig_group', '_rig_GROUP', top_group),
+            ('fk_ctrl_group', '_FK_CTRL_GROUP', None),
+            ('ik_ctrl_group', '_IK_CTRL_GROUP', None),
+            ('no_xform_group', '_noXform_GROUP', None)]:
+        groups[key] = plan.add_node(base_name + suffix, 'transform',
+                                    group_parent or groups['rig_group'])
+    return groups
+
+
+# Builds the full description of a limb from the guide matrices alone.
+# character holds the groups and globalScale plug of a character the limb
+# is planned into, see limb_character. The limb goes into the character's
+# groups instead of its own, and the character's globalScale scales it.
+def plan_limb(side='L', limb='arm',
+              joints=["LeftShoulder", "LeftElbow", "LeftWrist"],
+              aliases=None, pole_vector="LeftShoulder_PV",
+              primary_axis='X', up_axis='Y', stretch=True,
+              guide_matrices=None, blend_mode='blendColors',
+              stretch_node=False, character=None):
+    aliases = check_limb(side, limb, joints, aliases)
+    if guide_matrices is None:
+        guide_matrices = read_guides(list(joints) + [pole_vector])
+
+    side_name = "Left" if side == 'L' else "Right"
+    base_name = side_name + limb.capitalize()
+    axis = primary_axis[-1]
+    plan = RigPlan(base_name)
+
+    world, positions, pv_position, local = guide_placement(
+        guide_matrices, joints, pole_vector)
+
+    # Groups first so everything else can be created under its parent
+    groups = character or plan_groups(plan, base_name)
+    all_group, skeleton_group, rig_group, fk_ctrl_group, ik_ctrl_group, \
+        no_xform_group = [groups[key] for key in RIG_GROUPS]
+    if not character:
+        for group in [skeleton_group, rig_group, fk_ctrl_group,
+                      ik_ctrl_group]:
+            plan.set_value(group + '.rotatePivot', positions[0])
+            plan.set_value(group + '.scalePivot', positions[0])
+
+    # Joint chains, translate and joint orient hold the frozen placement
+    chains = {}
+    for chain_type, parent in [('IK', rig_group), ('FK', rig_group),
+                               ('Bind', skeleton_group)]:
+        chain = _chain_names(side_name, joints, aliases, chain_type)
+        for i, joint in enumerate(chain):
+            plan.add_node(joint, 'joint', chain[i - 1] if i else parent)
+            if chain_type == 'Bind' and blend_mode == 'blendMatrix':
+                continue  # Placed by the blended offsetParentMatrix
+            plan.set_value(joint + '.translate',
+                           limb_utils.get_translation(local[i]))
+            plan.set_value(joint + '.jointOrient',
+                           limb_utils.get_euler_rotation(local[i]))
+        chains[chain_type] = chain
+    ik_chain, fk_chain, bind_chain = (chains['IK'], chains['FK'],
+                                      chains['Bind'])
+
+    size = limb_utils.point_distance(positions[0], positions[-1]) / 5.0
+
+    # IK/FK blend control, offset from the wrist along the up axis
+    blend_ctrl = base_name + "_Control"
+    up_offset = [size * 1.5 * a
+                 for a in limb_utils.get_axis_vector(up_axis)]
+    plan.add_curve(blend_ctrl, _scaled(curve_spec(PLUS_SHAPE_COORDS),
+                                       size * 0.25, up_offset), rig_group)
+    plan.set_value(blend_ctrl + '.offsetParentMatrix', world[-1])
+    plan.constrain('parentConstraint', bind_chain[-1], blend_ctrl, True,
+                   limb_utils.IDENTITY_MATRIX)
+    plan.add_attr(blend_ctrl, 'iKfK', min=0, max=1, defaultValue=1,
+                  keyable=True)
+
+    # Blend IK/FK into the bind chain
+    for ik, fk, bind in zip(ik_chain, fk_chain, bind_chain):
+        part = bind.replace("_Bind_Joint", '')
+        _plan_blend(plan, ik, fk, bind, part, blend_ctrl + ".iKfK",
+                    blend_mode)
+
+    # FK controls carry the joint placement in their offsetParentMatrix
+    fk_ctrls = []
+    for i, fk in enumerate(fk_chain):
+        ctrl = fk.replace("_Joint", "_Control")
+        plan.add_curve(ctrl, circle_spec(size, primary_axis, 3),
+                       fk_ctrls[-1] if fk_ctrls else fk_ctrl_group)
+        plan.set_value(ctrl + '.offsetParentMatrix', local[i])
+        plan.constrain('pointConstraint', ctrl, fk)
+        plan.connect(ctrl + '.rotate', fk + '.rotate')
+        fk_ctrls.append(ctrl)
+
+    # IK controls
+    square = circle_spec(size * 1.2, primary_axis, 1, 4, 45.0)
+    world_ctrl = plan.add_curve(base_name + "_IK_Control", square,
+                                ik_ctrl_group)
+    plan.set_value(world_ctrl + '.offsetParentMatrix',
+                   limb_utils.translation_matrix(positions[-1]))
+    local_ctrl = plan.add_curve(base_name + "_Local_IK_Control",
+                                circle_spec(size * 1.2, primary_axis, 1, 4),
+                                world_ctrl)
+    wrist_position = limb_utils.translation_matrix(positions[-1])
+    plan.set_value(local_ctrl + '.offsetParentMatrix',
+                   limb_utils.offset_matrix(world[-1], wrist_position))
+    pv_ctrl = plan.add_curve(base_name + "_PV_Control",
+                             _scaled(curve_spec(PV_SHAPE_COORDS),
+                                     size * 0.25), ik_ctrl_group)
+    plan.set_value(pv_ctrl + '.offsetParentMatrix',
+                   limb_utils.translation_matrix(pv_position))
+    base_ctrl = plan.add_curve(base_name + "_Base_Control", square,
+                               ik_ctrl_group)
+    plan.set_value(base_ctrl + '.offsetParentMatrix',
+                   limb_utils.translation_matrix(positions[0]))
+    plan.constrain('parentConstraint', base_ctrl, ik_chain[0], True,
+                   limb_utils.offset_matrix(
+                       world[0], limb_utils.translation_matrix(positions[0])))
+
+    ik_handle = base_name + "IK_Handle"
+    plan.ik_handles.append({'name': ik_handle, 'startJoint': ik_chain[0],
+                            'endEffector': ik_chain[-1],
+                            'solver': 'ikRPsolver',
+                            'parent': no_xform_group})
+    plan.constrain('parentConstraint', local_ctrl, ik_handle, True,
+                   limb_utils.offset_matrix(wrist_position, world[-1]))
+    plan.constrain('poleVectorConstraint', pv_ctrl, ik_handle)
+
+    # Global scaling, a character's limbs inherit its scale
+    if character:
+        global_scale = character['global_scale']
+    else:
+        global_scale = plan_global_scale(plan, all_group)
+
+    if stretch:
+        _plan_ik_stretch(plan, base_name, limb, ik_chain, positions,
+                         base_ctrl, world_ctrl, local_ctrl, axis,
+                         no_xform_group, global_scale, stretch_node,
+                         character is not None)
+        _plan_fk_stretch(plan, fk_chain, fk_ctrls, local, axis)
+
+    hidden = [fk_chain[0], ik_chain[0], bind_chain[0]]
+    if not character:
+        hidden.insert(0, no_xform_group)
+    for node in hidden:
+        plan.set_value(node + '.visibility', False)
+
+    plan.outputs.update({'top_group': all_group, 'blend_ctrl': blend_ctrl,
+                         'ik_chain': ik_chain, 'fk_chain': fk_chain,
+                         'bind_chain': bind_chain, 'fk_ctrls': fk_ctrls,
+                         'base_ctrl': base_ctrl, 'world_ctrl': world_ctrl,
+                         'local_ctrl': local_ctrl, 'pv_ctrl': pv_ctrl,
+                         'handle': ik_handle, 'limb': limb,
+                         'global_scale': global_scale,
+                         'character': character and all_group,
+                         'primary_axis': axis, 'up_axis': up_axis,
+                         'stretch': stretch, 'blend_mode': blend_mode,
+                         'stretch_node': stretch and stretch_node})
+    return plan
+
+
+# A globalScale attribute on group that drives its scale, returns the plug
+def plan_global_scale(plan, group):
+    plan.add_attr(group, 'globalScale', min=0.001, defaultValue=1,
+                  keyable=True)
+    for a in 'XYZ':
+        plan.connect(group + '.globalScale', group + '.scale' + a)
+    return group + '.globalScale'
+
+
+def _plan_blend(plan, ik, fk, bind, part, blend_attr, blend_mode):
+    attrs = [TRANSLATE, ROTATE, SCALE]
+    if blend_mode == 'blendMatrix':
+        blend_node = plan.add_node(part + "_BMX", 'blendMatrix')
+        plan.connect(fk + ".matrix", blend_node + ".inputMatrix")
+        plan.connect(ik + ".matrix", blend_node + ".target[0].targetMatrix")
+        plan.connect(blend_attr, blend_node + ".target[0].weight")
+        plan.connect(blend_node + ".outputMatrix",
+                     bind + ".offsetParentMatrix")
+        return
+    if blend_mode == 'pairBlend':
+        blend_node = plan.add_node(part + "_PBN", 'pairBlend')
+        plan.set_value(blend_node + ".rotInterpolation", 1)
+        for attr in ["Translate", "Rotate"]:
+            plan.connect(fk + "." + attr.lower(),
+                         blend_node + ".in" + attr + "1")
+            plan.connect(ik + "." + attr.lower(),
+                         blend_node + ".in" + attr + "2")
+            plan.connect(blend_node + ".out" + attr,
+                         bind + "." + attr.lower())
+        plan.connect(blend_attr, blend_node + ".weight")
+        attrs = [SCALE]
+    elif blend_mode != 'blendColors':
+        limb_utils.error(
+            "Blend mode must be blendColors, pairBlend or blendMatrix")
+    for attr in attrs:
+        blend_node = plan.add_node('{}_{}_BCN'.format(part, attr),
+                                   'blendColors')
+        plan.connect(ik + "." + attr, blend_node + ".color1")
+        plan.connect(fk + "." + attr, blend_node + ".color2")
+        plan.connect(blend_attr, blend_node + ".blender")
+        plan.connect(blend_node + ".output", bind + "." + attr)
+
+
+# With rig_space the distance is measured between the locators' local
+# matrices, which a scale above the limb's top group doesn't reach, so it
+# is compared to the rest length as is instead of through a globalScale
+# multDoubleLinear
+def _plan_ik_stretch(plan, base_name, limb, ik_chain, positions, base_ctrl,
+                     world_ctrl, local_ctrl, axis, no_xform_group,
+                     global_scale, use_node=False, rig_space=False):
+    up_name = "up" + limb.capitalize()
+    lo_name = "lo" + limb.capitalize()
+    plan.add_attr(world_ctrl, 'stretch', min=0, max=1, defaultValue=1,
+                  keyable=True)
+    plan.add_attr(world_ctrl, up_name, min=0.001, defaultValue=1,
+                  keyable=True)
+    plan.add_attr(world_ctrl, lo_name, min=0.001, defaultValue=1,
+                  keyable=True)
+    upper_length = limb_utils.point_distance(positions[0], positions[1])
+    lower_length = limb_utils.point_distance(positions[1], positions[2])
+    total_length = upper_length + lower_length
+    plan.outputs['total_length'] = total_length
+    plan.outputs['length_attrs'] = [up_name, lo_name]
+
+    if use_node:
+        node = plan.add_node(base_name + "_stretch_LSN", 'limbStretch')
+        for ctrl, end in [(base_ctrl, 'start'), (local_ctrl, 'end')]:
+            plan.connect(ctrl + '.worldMatrix[0]', node + '.' + end + 'Matrix')
+            plan.connect(ctrl + '.rotatePivot', node + '.' + end + 'Pivot')
+        plan.set_value(node + '.upperLength', upper_length)
+        plan.set_value(node + '.lowerLength', lower_length)
+        for attr, node_attr in [('stretch', 'stretch'), (up_name, 'upper'),
+                                (lo_name, 'lower')]:
+            plan.connect(world_ctrl + '.' + attr, node + '.' + node_attr)
+        plan.connect(global_scale, node + '.globalScale')
+        plan.connect(node + '.outUpperScale', ik_chain[0] + '.' + SCALE + axis)
+        plan.connect(node + '.outLowerScale', ik_chain[1] + '.' + SCALE + axis)
+        return
+
+    start_loc = plan.add_locator(base_name + "_startLocator", no_xform_group)
+    end_loc = plan.add_locator(base_name + "_endLocator", no_xform_group)
+    plan.constrain('pointConstraint', base_ctrl, start_loc)
+    plan.constrain('pointConstraint', local_ctrl, end_loc)
+
+    dist = plan.add_node(base_name + "_distanceBetween", 'distanceBetween')
+    matrix = ".matrix" if rig_space else ".worldMatrix[0]"
+    plan.connect(start_loc + matrix, dist + ".inMatrix1")
+    plan.connect(end_loc + matrix, dist + ".inMatrix2")
+
+    ratio = plan.add_node(base_name + "_stretchFactor", 'multiplyDivide')
+    plan.connect(dist + ".distance", ratio + ".input1X")
+    plan.set_value(ratio + ".operation", 2)
+
+    cond = plan.add_node(base_name + "_stretch_condition", 'condition')
+    plan.connect(dist + ".distance", cond + ".firstTerm")
+    plan.connect(ratio + ".outputX", cond + ".colorIfTrueR")
+    plan.set_value(cond + ".operation", 3)
+
+    bta = plan.add_node(base_name + "_stretch_BTA", 'blendTwoAttr')
+    plan.set_value(bta + ".input[0]", 1)
+    plan.connect(cond + ".outColorR", bta + ".input[1]")
+    plan.connect(world_ctrl + ".stretch", bta + ".attributesBlender")
+
+    for name, joint in [(up_name, ik_chain[0]), (lo_name, ik_chain[1])]:
+        pma = plan.add_node('{}_{}_PMA'.format(base_name, name),
+                            'plusMinusAverage')
+        plan.connect(world_ctrl + '.' + name, pma + ".input1D[0]")
+        plan.connect(bta + '.output', pma + ".input1D[1]")
+        plan.set_value(pma + '.input1D[2]', -1)
+        plan.connect(pma + '.output1D', joint + '.' + SCALE + axis)
+
+    if rig_space:
+        plan.set_value(ratio + '.input2X', total_length)
+        plan.set_value(cond + '.secondTerm', total_length)
+        return
+
+    # Total length scales with the rig so stretching starts at the same pose
+    gs_mdl = plan.add_node(base_name + "_globalScale_MDL", 'multDoubleLinear')
+    plan.set_value(gs_mdl + '.input1', total_length)
+    plan.connect(global_scale, gs_mdl + '.input2')
+    plan.connect(gs_mdl + '.output', ratio + '.input2X')
+    plan.connect(gs_mdl + '.output', cond + '.secondTerm')
+
+
+def _plan_fk_stretch(plan, fk_joints, fk_ctrls, local, axis):
+    axis_idx = 'XYZ'.index(axis)
+    for i, fk_ctrl in enumerate(fk_ctrls[:-1]):
+        plan.add_attr(fk_ctrl, 'stretch', min=0.001, defaultValue=1,
+                      keyable=True)
+        offset_loc = plan.add_locator(
+            fk_ctrl.replace('_Control', "_offLOC"), fk_joints[i])
+        offset = limb_utils.get_translation(local[i + 1])
+        plan.set_value(offset_loc + '.rotate',
+                       limb_utils.get_euler_rotation(local[i + 1]))
+        fk_stretch_mdl = plan.add_node(
+            fk_ctrl.replace("_Control", "_Stretch_MDL"),
+            'multDoubleLinear')
+        plan.set_value(fk_stretch_mdl + ".input1", offset[axis_idx])
+        plan.connect(fk_ctrl + ".stretch", fk_stretch_mdl + ".input2")
+        plan.connect(fk_stretch_mdl + ".output",
+                     offset_loc + ".translate" + axis)
+        for a, value in zip('XYZ', offset):
+            if a != axis:
+                plan.set_value(offset_loc + '.translate' + a, value)
+        plan.connect(fk_ctrl + ".stretch", fk_joints[i] + ".scale" + axis)
+        plan.connect(offset_loc + ".matrix",
+                     fk_ctrls[i + 1] + ".offsetParentMatrix")
+
+
+def set_plug_value(plug, value):
+    if isinstance(value, (list, tuple)):
+        if len(value) == 16:
+            cmds.setAttr(plug, value, type='matrix')
+        else:
+            cmds.setAttr(plug, *value)
+    else:
+        cmds.setAttr(plug, value)
+
+
+def _set_shape(shape, spec):
+    cmds.setAttr(shape + '.cc', spec['degree'], spec['spans'], spec['form'],
+                 False, 3, spec['knots'], len(spec['knots']),
+                 len(spec['points']), *spec['points'], type='nurbsCurve')
+
+
+# Applies a plan to the scene. Nothing is queried, every entry is one write.
+# Returns a dict mapping planned names to the names Maya gave the nodes.
+# Inside limb_utils.unique_names() the names are free before they are
+# used, so Maya never has to rename a node.
+def apply_plan(plan):
+    if cmds is None:
+        limb_utils.error("Applying a rig plan requires Maya")
+    if any(node['type'] == 'limbStretch' for node in plan.nodes):
+        import lrig.limb_stretch_node as limb_stretch_node
+        limb_stretch_node.ensure_loaded()
+    names = {}
+
+    def real(plug):
+        node, _, attr = plug.partition('.')
+        node = names.get(node, node)
+        return node + '.' + attr if attr else node
+
+    for node in plan.nodes:
+        flags = {'name': limb_utils.unique_name(node['name'])}
+        if node['parent']:
+            flags['parent'] = real(node['parent'])
+        names[node['name']] = cmds.createNode(node['type'], **flags)
+    for shape, spec in plan.shapes.items():
+        _set_shape(real(shape), spec)
+    for attr in plan.attributes:
+        flags = dict((k, v) for k, v in attr.items() if k != 'node')
+        cmds.addAttr(real(attr['node']), **flags)
+    for plug, value in plan.values:
+        set_plug_value(real(plug), value)
+    for handle in plan.ik_handles:
+        created, effector = cmds.ikHandle(
+            name=limb_utils.unique_name(handle['name']),
+            startJoint=real(handle['startJoint']),
+            endEffector=real(handle['endEffector']), sticky='sticky',
+            solver=handle['solver'], setupForRPsolver=True)
+        effector_key = effector_name(handle['name'])
+        names[effector_key] = cmds.rename(
+            effector, limb_utils.unique_name(effector_key))
+        names[handle['name']] = cmds.parent(created,
+                                            real(handle['parent']))[0]
+    for source, destination in plan.connections:
+        cmds.connectAttr(real(source), real(destination))
+    for constraint in plan.constraints:
+        command = getattr(cmds, constraint['type'])
+        flags = {'name': limb_utils.unique_name(constraint['name'])}
+        if constraint['maintainOffset']:
+            flags['maintainOffset'] = True
+        names[constraint['name']] = command(
+            real(constraint['driver']), real(constraint['driven']),
+            **flags)[0]
+    return names
+
+
+# Names in a plan that apply_plan() gives the scene, in the order it
+# allocates them
+def planned_names(plan):
+    planned = [node['name'] for node in plan.nodes]
+    for handle in plan.ik_handles:
+        planned += [handle['name'], effector_name(handle['name'])]
+    return planned + [c['name'] for c in plan.constraints]
+
+
+def _mel(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _mel_values(values):
+    return ' '.join(_mel(float(v)) for v in values)
+
+
+# The MEL that makes the same rig as apply_plan(plan), as one script the rig
+# cache stores and load_script() runs. Planned names are the only quoted
+# strings, so they can be swapped for the names the scene gives them.
+def plan_script(plan):
+    lines = []
+    for node in plan.nodes:
+        parent = ' -parent "{}"'.format(node['parent']) \
+            if node['parent'] else ''
+        lines.append('createNode {} -name "{}"{};'.format(
+            node['type'], node['name'], parent))
+    for shape, spec in plan.shapes.items():
+        lines.append('setAttr "{}.cc" -type nurbsCurve {} {} {} no 3 '
+                     '{} {} {} {};'.format(
+                         shape, spec['degree'], spec['spans'], spec['form'],
+                         len(spec['knots']), _mel_values(spec['knots']),
+                         len(spec['points']),
+                         _mel_values(v for p in spec['points'] for v in p)))
+    for attr in plan.attributes:
+        flags = ''.join(' -{} {}'.format(k, _mel(v))
+                        for k, v in attr.items() if k != 'node')
+        lines.append('addAttr{} "{}";'.format(flags, attr['node']))
+    for plug, value in plan.values:
+        if isinstance(value, (list, tuple)):
+            value = ('-type matrix ' if len(value) == 16 else '') + \
+                _mel_values(value)
+        else:
+            value = _mel(int(value) if isinstance(value, bool) else value)
+        lines.append('setAttr "{}" {};'.format(plug, value))
+    for handle in plan.ik_handles:
+        lines.append('ikHandle -name "{}" -startJoint "{}" -endEffector "{}" '
+                     '-sticky sticky -solver {} -setupForRPsolver true;'
+                     .format(handle['name'], handle['startJoint'],
+                             handle['endEffector'], handle['solver']))
+        lines.append('rename `ikHandle -query -endEffector "{}"` "{}";'
+                     .format(handle['name'], effector_name(handle['name'])))
+        lines.append('parent "{}" "{}";'.format(handle['name'],
+                                               handle['parent']))
+    for source, destination in plan.connections:
+        lines.append('connectAttr "{}" "{}";'.format(source, destination))
+    for constraint in plan.constraints:
+        lines.append('{}{} -name "{}" "{}" "{}";'.format(
+            constraint['type'],
+            ' -maintainOffset' if constraint['maintainOffset'] else '',
+            constraint['name'], constraint['driver'], constraint['driven']))
+    return '\n'.join(lines) + '\n'
+
+
+# plan_script()'s script with the planned names in names swapped for the
+# given ones, in one pass over the text
+def rename_script(script, names):
+    def real(match):
+        node, dot, attr = match.group(1).partition('.')
+        return '"' + names.get(node, node) + dot + attr + '"'
+    return re.sub(r'"([^"]*)"', real, script)
+
+
+# Runs a plan_script() script in one mel.eval, planned are its
+# planned_names(). Names are allocated like apply_plan() does, and the same
+# dict of planned to given names is returned.
+def load_script(script, planned):
+    if cmds is None:
+        limb_utils.error("Loading a rig script requires Maya")
+    if 'createNode limbStretch ' in script:
+        import lrig.limb_stretch_node as limb_stretch_node
+        limb_stretch_node.ensure_loaded()
+    names = dict((name, limb_utils.unique_name(name)) for name in planned)
+    mel.eval(rename_script(script, names))
+    return names
+
+
+# Plans a limb and applies it, or only plans it when dry_run is set
+def build_limb(side='L', limb='arm',
+               joints=["LeftShoulder", "LeftElbow", "LeftWrist"],
+               aliases=None, pole_vector="LeftShoulder_PV",
+               primary_axis='X', up_axis='Y', stretch=True,
+               guide_matrices=None, dry_run=False, blend_mode='blendColors'):
+    plan = plan_limb(side, limb, joints, aliases, pole_vector,
+                     primary_axis, up_axis, stretch, guide_matrices,
+                     blend_mode)
+    if not dry_run:
+        apply_plan(plan)
+    return plan
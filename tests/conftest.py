@@ -0,0 +1,50 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The repository is the lrig package, register it under that name so the
+# tests import it the way Maya does
+if 'lrig' not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        'lrig', os.path.join(ROOT, '__init__.py'),
+        submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['lrig'] = package
+    spec.loader.exec_module(package)
+
+import lrig.fake_maya as fake_maya  # noqa: E402
+
+# Outside Maya, modules that import maya.cmds get the fake scene
+FAKE_SCENE = fake_maya.install()
+
+
+# An empty fake scene. Skipped inside Maya, where the real scene is used.
+@pytest.fixture
+def scene():
+    if FAKE_SCENE is None:
+        pytest.skip("Runs against the fake scene outside Maya")
+    return fake_maya.new_scene()
+
+
+# Maya in this process, for tests that compare against the real DG. They
+# only run under mayapy (mayapy -m pytest) and are skipped elsewhere.
+@pytest.fixture(scope='session')
+def maya_session():
+    if FAKE_SCENE is not None:
+        pytest.skip("Needs Maya, run with mayapy -m pytest")
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    yield
+    maya.standalone.uninitialize()
+
+
+# An empty Maya scene, returns maya.cmds
+@pytest.fixture
+def maya_scene(maya_session):
+    import maya.cmds as cmds
+    cmds.file(new=True, force=True)
+    return cmds
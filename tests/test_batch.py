@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pytest
+
+import lrig.batch as batch
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIMB = {'backend': 'plan'}
+# Crashes the first time it starts, then works like a fake worker
+CRASH_ONCE = (
+    "import os, sys\n"
+    "if not os.path.exists({marker!r}):\n"
+    "    open({marker!r}, 'w').close()\n"
+    "    sys.exit('first start')\n"
+    "import lrig.batch\n"
+    "lrig.batch.main(['--worker', '--fake-maya'])\n")
+
+
+# Workers import the checkout as lrig, whatever its directory is called
+@pytest.fixture
+def env(tmp_path):
+    packages = tmp_path / 'packages'
+    packages.mkdir()
+    os.symlink(ROOT, str(packages / 'lrig'))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(packages)] + [p for p in env.get('PYTHONPATH', '').split(
+            os.pathsep) if p])
+    return env
+
+
+@pytest.fixture
+def jobs(scene, tmp_path):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    jobs = []
+    for i in range(3):
+        path = str(tmp_path / 'scene{}.ma'.format(i))
+        scene.file(rename=path)
+        scene.file(save=True)
+        jobs.append({'scene': path,
+                     'output': str(tmp_path / 'rigged{}.ma'.format(i)),
+                     'limbs': [LIMB]})
+    return jobs
+
+
+def _run(jobs, env, command=None, **options):
+    return batch.run_batch(
+        jobs, command=command or batch.worker_command(fake_maya=True),
+        env=env, **options)
+
+
+def test_rigs_every_job(jobs, env, scene):
+    report = _run(jobs, env, workers=2)
+    assert (report['ok'], report['failed'], report['workers']) == (3, 0, 2)
+    for job, result in zip(jobs, report['jobs']):
+        assert result['status'] == 'ok'
+        assert result['top_groups'] == ['LEFTARM']
+        assert len(result['attempts']) == 1
+        scene.file(job['output'], open=True)
+        assert scene.objExists('LEFTARM')
+
+
+# A job that fails in the worker is tried retries more times, then
+# reported with the worker's error
+def test_failed_job_is_retried(jobs, env):
+    jobs[1]['limbs'] = [dict(LIMB, pole_vector='Missing_PV')]
+    report = _run(jobs, env, workers=2, retries=2)
+    assert (report['ok'], report['failed']) == (2, 1)
+    result = report['jobs'][1]
+    assert result['status'] == 'failed'
+    assert [a['status'] for a in result['attempts']] == ['failed'] * 3
+    assert 'Missing_PV' in result['error']
+
+
+def test_job_times_out(jobs, env):
+    command = [sys.executable, '-c', 'import time; time.sleep(60)']
+    report = _run(jobs[:2], env, command, workers=2, timeout=0.5,
+                  retries=1)
+    assert report['failed'] == 2
+    for result in report['jobs']:
+        assert [a['status'] for a in result['attempts']] == ['timeout'] * 2
+
+
+# A worker that dies is restarted on the retry, and its stderr is reported
+# if it keeps dying
+def test_crashed_worker_restarts(jobs, env, tmp_path):
+    marker = str(tmp_path / 'started')
+    command = [sys.executable, '-c', CRASH_ONCE.format(marker=marker)]
+    report = _run(jobs[:1], env, command, workers=1, retries=1)
+    assert report['ok'] == 1
+    statuses = [a['status'] for a in report['jobs'][0]['attempts']]
+    assert statuses == ['crashed', 'ok']
+
+    command = [sys.executable, '-c', 'import sys; sys.exit("boom")']
+    report = _run(jobs[:1], env, command, workers=1, retries=0)
+    assert report['jobs'][0]['status'] == 'crashed'
+    assert report['jobs'][0]['error'] == 'boom'
+
+
+# A worker that can't start fails its attempts instead of leaving the
+# other workers waiting for jobs
+def test_worker_that_cannot_start(jobs, env, tmp_path):
+    command = [str(tmp_path / 'missing' / 'mayapy')]
+    report = _run(jobs, env, command, workers=2, retries=1)
+    assert report['failed'] == 3
+    for result in report['jobs']:
+        assert [a['status'] for a in result['attempts']] == ['error'] * 2
+        assert result['error'].startswith('FileNotFoundError')
@@ -0,0 +1,65 @@
+import pytest
+
+import lrig.limb as limb
+import lrig.limb_template as limb_template
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+MOVES = [('LeftElbow', (5, 14, -2)), ('LeftWrist', (9, 13, 1)),
+         ('LeftShoulder_PV', (5, 13, -7))]
+
+
+@pytest.fixture
+def guides(scene):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    return scene
+
+
+def _value(scene, plug):
+    value = scene.getAttr(plug)
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+
+# Updating a numbered copy after its guides moved places it like a fresh
+# plan for the new guides and leaves the first limb alone
+@pytest.mark.parametrize('backend', ['cmds', 'plan'])
+def test_update_matches_a_fresh_plan(guides, backend):
+    first = limb.create_limb(backend=backend, return_names=True)
+    names = limb.create_limb(backend=backend, return_names=True)
+    before = dict((plug, _value(guides, first[plug.partition('.')[0]] +
+                                '.' + plug.partition('.')[2]))
+                  for plug, _ in rig_plan.plan_limb().values
+                  if plug.endswith('.offsetParentMatrix'))
+    for guide, position in MOVES:
+        guides.xform(guide, worldSpace=True, translation=position)
+    written = limb.update_limb(names=names)
+
+    planned = dict((given, name) for name, given in names.items())
+    values = limb_template.placement_values(rig_plan.plan_limb(
+        guide_matrices=rig_plan.read_guides(
+            [name for name, _ in GUIDES] + ['LeftShoulder_PV'])))
+    if backend == 'cmds':
+        # cmds builds keep the blend control's offset from the wrist in
+        # its offsetParentMatrix, plans in its shape
+        del values['LeftArm_Control.offsetParentMatrix']
+    compared = 0
+    for plug in written:
+        node, _, attr = plug.partition('.')
+        key = planned.get(node, node) + '.' + attr
+        if key in values:
+            assert limb_template._same(_value(guides, plug), values[key]), \
+                key
+            compared += 1
+    assert compared >= 30
+    for plug, value in before.items():
+        node, _, attr = plug.partition('.')
+        assert limb_template._same(
+            _value(guides, first[node] + '.' + attr), value)
@@ -0,0 +1,39 @@
+import pytest
+
+import lrig.benchmark as benchmark
+import lrig.limb_character as limb_character
+import lrig.limb_utils as limb_utils
+
+GUIDES = {'LeftShoulder': (2, 15, 0), 'LeftElbow': (5, 15, -1),
+          'LeftWrist': (8, 15, 0), 'LeftShoulder_PV': (5, 15, -5)}
+SPEC = {'joints': ['LeftShoulder', 'LeftElbow', 'LeftWrist'],
+        'pole_vector': 'LeftShoulder_PV'}
+
+
+def _plan(specs):
+    return limb_character.plan_character(specs, guide_matrices=dict(
+        (name, limb_utils.compose_matrix(position, (0, 0, 0)))
+        for name, position in GUIDES.items()))
+
+
+# A character's limbs share its groups and globalScale, and go through one
+# pass of each kind of edit, so it ends up with fewer nodes and fewer scene
+# calls than the same limbs built one at a time with its backend
+def test_character_costs_less_than_separate_limbs(scene):
+    separate = benchmark.run_character_build(4, False)
+    character = benchmark.run_character_build(4, True)
+    assert character['nodes_created'] < separate['nodes_created']
+    assert character['calls'] < separate['calls']
+    assert scene.ls('*_noXform_GROUP') == ['Character0_noXform_GROUP']
+
+
+@pytest.mark.parametrize('specs, message', [
+    ([], "at least one limb"),
+    ([SPEC, dict(SPEC, side='L')], "both LeftArm"),
+    ([dict(SPEC, twist=True)], "Unknown limb options: twist"),
+    ([{'joints': SPEC['joints']}], "joints and pole_vector"),
+    ([SPEC, {'joints': SPEC['joints'], 'limb': 'leg'}],
+     "joints and pole_vector")])
+def test_plan_character_rejects_bad_specs(specs, message):
+    with pytest.raises(RuntimeError, match=message):
+        _plan(specs)
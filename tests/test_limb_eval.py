@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+import pytest
+
+import lrig.limb_eval as limb_eval
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+BLEND_MODES = ['blendColors', 'pairBlend', 'blendMatrix']
+JOINTS = ['Shoulder', 'Elbow', 'Wrist']
+ANGLE = math.degrees(math.atan2(0.5, 3.0))
+# A slightly bent arm, each joint aimed down the chain
+GUIDE_MATRICES = {
+    'Shoulder': limb_utils.compose_matrix((2, 15, 0), (0, ANGLE, 0)),
+    'Elbow': limb_utils.compose_matrix((5, 15, -0.5), (0, -ANGLE, 0)),
+    'Wrist': limb_utils.compose_matrix((8, 15, 0), (0, -ANGLE, 0)),
+    'PV': limb_utils.compose_matrix((5, 15, -5))}
+
+
+def plan(**options):
+    return rig_plan.plan_limb(joints=JOINTS, pole_vector='PV',
+                              guide_matrices=GUIDE_MATRICES, **options)
+
+
+def rest_world():
+    return np.array([GUIDE_MATRICES[j] for j in JOINTS]).reshape(3, 4, 4)
+
+
+def test_euler_round_trip():
+    rotation = np.array([[10.0, 20.0, 30.0], [-75.0, 60.0, -150.0]])
+    assert limb_eval.matrix_to_euler(limb_eval.euler_to_matrix(rotation)) \
+        == pytest.approx(rotation)
+
+
+# At rest, either side of the blend puts the bind chain on its guides
+@pytest.mark.parametrize('blend_mode', BLEND_MODES)
+@pytest.mark.parametrize('ikfk', [0.0, 0.5, 1.0])
+def test_rest_pose_matches_plan(blend_mode, ikfk):
+    evaluator = limb_eval.LimbEvaluator(plan(blend_mode=blend_mode))
+    result = evaluator.evaluate(2, ikfk=ikfk)
+    assert result['world'][:, :] == pytest.approx(
+        np.broadcast_to(rest_world(), (2, 3, 4, 4)), abs=1e-6)
+    assert result['scale'] == pytest.approx(np.ones((2, 3, 3)))
+
+
+def test_rest_translate_is_planned_translate():
+    rig = plan()
+    values = dict((p, v) for p, v in rig.values)
+    result = limb_eval.LimbEvaluator(rig).evaluate(1)
+    planned = [values[j + '.translate'] for j in rig.outputs['bind_chain']]
+    assert result['translate'][0] == pytest.approx(np.array(planned))
+    assert result['rotate'][0] == pytest.approx(np.zeros((3, 3)), abs=1e-6)
+
+
+def test_global_scale_scales_the_world():
+    result = limb_eval.LimbEvaluator(plan()).evaluate(1, global_scale=2.0)
+    scaled = rest_world() @ np.diag([2.0, 2.0, 2.0, 1.0])
+    assert result['world'][0] == pytest.approx(scaled, abs=1e-6)
+
+
+# Pulling the IK control past the chain's reach stretches both bones by
+# what the stretch kernel computes
+@pytest.mark.parametrize('stretch', [0.0, 0.5, 1.0])
+def test_ik_stretch_matches_kernel(stretch):
+    rig = plan()
+    out = rig.outputs
+    pull = (4.0, 0.0, 0.0)
+    result = limb_eval.LimbEvaluator(rig).evaluate(
+        1, ik_translate=pull, stretch=stretch)
+    values = dict((p, v) for p, v in rig.values)
+    base = values[out['base_ctrl'] + '.offsetParentMatrix']
+    end = limb_utils.mult_matrix(
+        values[out['local_ctrl'] + '.offsetParentMatrix'],
+        limb_utils.mult_matrix(limb_utils.translation_matrix(pull),
+                               values[out['world_ctrl'] +
+                                      '.offsetParentMatrix']))
+    positions = [GUIDE_MATRICES[j][12:15] for j in JOINTS]
+    upper, lower = limb_utils.stretch_scales(
+        base, end, limb_utils.point_distance(positions[0], positions[1]),
+        limb_utils.point_distance(positions[1], positions[2]), stretch)
+    assert result['scale'][0, :2, 0] == pytest.approx([upper, lower])
+    if stretch:
+        assert upper > 1.0
+    if stretch == 1.0:  # Fully stretched, the wrist reaches the control
+        assert result['world'][0, 2, 3, :3] == pytest.approx(
+            np.array(positions[2]) + pull)
+
+
+def test_fk_rotate_moves_the_bind_chain():
+    rig = plan()
+    result = limb_eval.LimbEvaluator(rig).evaluate(
+        1, ikfk=0.0, fk_rotate=[(0, 0, 90), (0, 0, 0), (0, 0, 0)])
+    assert result['rotate'][0, 0] == pytest.approx([0, 0, 90], abs=1e-6)
+    shoulder = np.array(GUIDE_MATRICES['Shoulder'][12:15])
+    elbow = result['world'][0, 1, 3, :3]
+    assert np.linalg.norm(elbow - shoulder) == pytest.approx(
+        math.hypot(3.0, 0.5))
+    assert elbow[1] > 15.0
+
+
+# Keys every input the evaluator samples on a limb built from a plan, then
+# checks the evaluator against what Maya's DG computes frame by frame
+@pytest.mark.parametrize('blend_mode', BLEND_MODES)
+def test_evaluator_matches_dg(maya_scene, blend_mode):
+    cmds = maya_scene
+    for name, matrix in GUIDE_MATRICES.items():
+        cmds.select(clear=True)
+        cmds.joint(name=name)
+        cmds.xform(name, worldSpace=True, matrix=matrix)
+    rig = plan(blend_mode=blend_mode)
+    rig_plan.apply_plan(rig)
+    evaluator = limb_eval.LimbEvaluator(rig)
+    frames = list(range(1, 11))
+    for frame in frames:
+        t = (frame - 1) / 9.0
+        keys = {'ikfk': [t], 'stretch': [1.0 - t * 0.5],
+                'global_scale': [1.0 + t],
+                'fk_rotate': [(10 * t, 0, 40 * t), (0, 0, 30 * t),
+                              (0, 20 * t, 0)],
+                'ik_translate': [(4 * t, -2 * t, 1 * t)],
+                'ik_rotate': [(0, 30 * t, 0)],
+                'local_rotate': [(15 * t, 0, 0)],
+                'base_translate': [(0, 0.5 * t, 0)],
+                'pv_translate': [(0, 2 * t, -1 * t)],
+                'up_length': [1.0 + 0.2 * t], 'lo_length': [1.0],
+                'fk_stretch': [1.0 + t, 1.0 - 0.3 * t]}
+        plugs = evaluator.input_plugs()
+        for key, values in keys.items():
+            for plug, value in zip(plugs[key], values):
+                if isinstance(value, tuple):
+                    for axis, v in zip('XYZ', value):
+                        cmds.setKeyframe(plug + axis, time=frame, value=v)
+                else:
+                    cmds.setKeyframe(plug, time=frame, value=value)
+    errors = limb_eval.validate(evaluator, frames)
+    assert set(errors) >= {'world'}
+    assert max(errors.values()) < 1e-3, errors
@@ -0,0 +1,118 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import lrig.limb_export as limb_export
+import lrig.limb_utils as limb_utils
+
+JOINTS = ['LeftShoulder_Bind_Joint', 'LeftElbow_Bind_Joint',
+          'LeftWrist_Bind_Joint']
+
+
+def _header(frames=5, dtype='<f4', **header):
+    return dict({'version': limb_export.FORMAT_VERSION, 'dtype': dtype,
+                 'start': 10.0, 'step': 0.5, 'frames': frames,
+                 'joints': JOINTS, 'parents': [-1, 0, 1],
+                 'channels': limb_export.CHANNELS,
+                 'shape': [len(JOINTS), len(limb_export.CHANNELS), frames]},
+                **header)
+
+
+# Writes a file the way export_bind_chains lays it out, with every sample
+# set to its own flat index
+def _write(path, header):
+    dtype = np.dtype(header['dtype'])
+    with open(path, 'wb') as f:
+        offset = limb_export._write_header(f, header)
+        f.truncate(offset + dtype.itemsize * int(np.prod(header['shape'])))
+    data = np.memmap(path, dtype, 'r+', offset, tuple(header['shape']))
+    data[:] = np.arange(data.size).reshape(data.shape)
+    data.flush()
+    return np.array(data)
+
+
+@pytest.mark.parametrize('joints', [1, 3, 40])
+def test_header_pads_samples_to_the_alignment(joints):
+    header = _header(joints=['Joint{}'.format(i) for i in range(joints)])
+    f = io.BytesIO()
+    offset = limb_export._write_header(f, header)
+    written = f.getvalue()
+    assert offset == len(written)
+    assert offset % limb_export.DATA_ALIGNMENT == 0
+    assert written.startswith(limb_export.MAGIC)
+    prefix = len(limb_export.MAGIC) + 4
+    assert struct.unpack('<I', written[len(limb_export.MAGIC):prefix]) == \
+        (offset - prefix,)
+    assert json.loads(written[prefix:].decode('utf-8')) == header
+
+
+@pytest.mark.parametrize('dtype', ['<f4', '<f8'])
+def test_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'chains.bake')
+    data = _write(path, _header(dtype=dtype))
+    baked = limb_export.BakedChains(path)
+    assert baked.joints == JOINTS
+    assert baked.parents == [-1, 0, 1]
+    assert np.allclose(baked.frames(), [10.0, 10.5, 11.0, 11.5, 12.0])
+    assert baked.data.dtype == np.dtype(dtype)
+    assert baked.data.offset % limb_export.DATA_ALIGNMENT == 0
+    assert np.array_equal(baked.samples(), data.transpose(2, 0, 1))
+    local = len(limb_export.LOCAL_CHANNELS)
+    for index, joint in enumerate(JOINTS):
+        for key in [index, joint]:
+            assert np.array_equal(baked.curve(key), data[index].T)
+            assert np.array_equal(baked.local(key), data[index, :local].T)
+            assert np.array_equal(baked.channel(key, 'ry'), data[index, 4])
+            assert np.array_equal(baked.channel(key, 'm31'),
+                                  data[index, local + 13])
+        world = baked.world_matrices(joint)
+        assert world.shape == (5, 4, 4)
+        assert np.array_equal(world[2].ravel(), data[index, local:, 2])
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'newer.bake')
+    _write(path, _header(version=limb_export.FORMAT_VERSION + 1))
+    with pytest.raises(RuntimeError):
+        limb_export.BakedChains(path)
+    path = str(tmp_path / 'other.bake')
+    with open(path, 'wb') as f:
+        f.write(b'NOTABAKE' + b'\0' * 60)
+    with pytest.raises(RuntimeError):
+        limb_export.BakedChains(path)
+
+
+@pytest.mark.parametrize('start, end, step, count', [
+    (1, 10, 1.0, 10), (1, 10, 2.0, 5), (0, 1, 0.1, 11), (5, 5, 1.0, 1),
+    (1, 10.5, 1.0, 10)])
+def test_frame_count(start, end, step, count):
+    assert limb_export.frame_count(start, end, step) == count
+
+
+@pytest.mark.parametrize('start, end, step', [(1, 10, 0), (1, 10, -1),
+                                              (10, 1, 1.0)])
+def test_frame_count_rejects_bad_ranges(start, end, step):
+    with pytest.raises(RuntimeError):
+        limb_export.frame_count(start, end, step)
+
+
+# Channels are the child's transform in its parent's space, for a batch of
+# frames and joints at once
+def test_local_channels():
+    poses = [((1, 2, 3), (10, -20, 30), (1, 1, 1)),
+             ((0, -4, 0.5), (-60, 5, 80), (2, 0.5, 1.5))]
+    parent = np.array(limb_utils.compose_matrix((3, 1, -2), (0, 45, 10)))
+    parent = parent.reshape(4, 4)
+    world = []
+    for translate, rotate, scale in poses:
+        local = np.array(limb_utils.compose_matrix(translate, rotate))
+        local = local.reshape(4, 4)
+        local[:3] *= np.array(scale)[:, None]
+        world.append(local @ parent)
+    world = np.array(world)[:, None]
+    channels = limb_export.local_channels(world, np.array([[parent]] * 2))
+    assert channels.shape == (2, 1, len(limb_export.LOCAL_CHANNELS))
+    assert np.allclose(channels[:, 0], [t + r + s for t, r, s in poses])
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import lrig.limb as limb
+import lrig.limb_mirror as limb_mirror
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+PLANES = sorted(limb_mirror.MIRROR_PLANES)
+
+
+@pytest.fixture
+def guides(scene):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    return scene
+
+
+def _rotation(matrix):
+    return np.array(matrix, dtype=float).reshape(4, 4)[:3, :3]
+
+
+def _left_plan():
+    matrices = dict((name, limb_utils.compose_matrix(position, (0, 0, 0)))
+                    for name, position in GUIDES)
+    matrices['LeftShoulder_PV'] = limb_utils.compose_matrix((5, 15, -5),
+                                                            (0, 0, 0))
+    return rig_plan.plan_limb(guide_matrices=matrices)
+
+
+# Positions reflect in both modes. Behavior mode stays right handed with
+# every axis the reflection of the original's negated, orientation mode
+# keeps the rotation, and mirroring twice gives the matrix back.
+@pytest.mark.parametrize('plane', PLANES)
+def test_mirror_matrix(plane):
+    matrix = limb_utils.compose_matrix((1, 2, 3), (20, -35, 70))
+    normal = limb_mirror.MIRROR_PLANES[plane]
+    reflect = np.eye(3)
+    reflect[normal, normal] = -1.0
+    for mode in limb_mirror.MIRROR_MODES:
+        mirrored = limb_mirror.mirror_matrix(matrix, plane, mode)
+        assert np.allclose(mirrored[12:15],
+                           np.array(matrix[12:15]) @ reflect)
+        assert np.isclose(np.linalg.det(_rotation(mirrored)), 1.0)
+        assert np.allclose(limb_mirror.mirror_matrix(mirrored, plane, mode),
+                           matrix)
+    behavior = limb_mirror.mirror_matrix(matrix, plane, 'behavior')
+    assert np.allclose(_rotation(behavior), -_rotation(matrix) @ reflect)
+    orientation = limb_mirror.mirror_matrix(matrix, plane, 'orientation')
+    assert np.allclose(_rotation(orientation), _rotation(matrix))
+
+
+def test_mirror_matrix_rejects_bad_options():
+    with pytest.raises(RuntimeError):
+        limb_mirror.mirror_matrix(limb_utils.IDENTITY_MATRIX, plane='XX')
+    with pytest.raises(RuntimeError):
+        limb_mirror.mirror_matrix(limb_utils.IDENTITY_MATRIX, mode='flip')
+
+
+# The mirrored plan places the right side on the behavior mirror of the
+# left side's joints and pole vector, right handed, with its up axis
+# flipped
+def test_plan_mirror_places_the_opposite_side():
+    left = _left_plan()
+    right = limb_mirror.mirror_plan(left)
+    assert right.base_name == 'RightArm'
+    assert right.outputs['up_axis'] == '-Y'
+    world, pv_matrix = limb_mirror.plan_matrices(left)
+    mirrored, mirrored_pv = limb_mirror.plan_matrices(right)
+    for matrix, result in zip(world, mirrored):
+        assert np.allclose(result, limb_mirror.mirror_matrix(matrix))
+        assert np.isclose(np.linalg.det(_rotation(result)), 1.0)
+    # The pole vector control is placed by position only
+    assert np.allclose(mirrored_pv[12:15],
+                       limb_mirror.mirror_matrix(pv_matrix)[12:15])
+    assert np.allclose(np.array(mirrored)[:, 12:15],
+                       [(-x, y, z) for _, (x, y, z) in GUIDES])
+    # Mirroring back gives the left side's placement again
+    again = limb_mirror.mirror_plan(right)
+    assert again.base_name == 'LeftArm'
+    for plug, value in again.values:
+        if plug.endswith('.offsetParentMatrix'):
+            assert np.allclose(value, dict(left.values)[plug]), plug
+
+
+# A numbered copy is read through its name map, not the first limb's names
+def test_read_limb_follows_the_name_map(guides):
+    limb.create_limb(backend='plan')
+    guides.xform('LeftWrist', worldSpace=True, translation=(9, 13, 1))
+    second = limb.create_limb(backend='plan', return_names=True)
+    world, _ = limb_mirror.read_limb()
+    assert np.allclose(world[2][12:15], (8, 15, 0))
+    world, pv_matrix = limb_mirror.read_limb(names=second)
+    assert np.allclose(world[2][12:15], (9, 13, 1))
+    assert pv_matrix == limb_utils.world_matrix(
+        second['LeftArm_PV_Control'])
+    top_group = limb_mirror.mirror_limb(names=second)
+    assert top_group == 'RIGHTARM'
+    assert np.allclose(limb_utils.world_matrix(
+        'RightWrist_FK_Joint')[12:15], (-9, 13, 1))
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import lrig.limb as limb
+import lrig.limb_switch as limb_switch
+import lrig.limb_utils as limb_utils
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+POSES = [((0.5, -1.0, 2.0), (10.0, 20.0, 30.0)),
+         ((-2.0, 0.0, 1.0), (-45.0, 5.0, 80.0)),
+         ((0.0, 3.0, 0.0), (0.0, -60.0, 0.0))]
+
+
+@pytest.fixture
+def guides(scene):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    return scene
+
+
+def _world(scene, node):
+    return np.array(scene.xform(node, query=True, worldSpace=True,
+                                matrix=True)).reshape(4, 4)
+
+
+# A second build's nodes are numbered, its name map finds them
+def test_limb_nodes_follows_the_name_map(guides):
+    first = limb.create_limb(backend='plan', return_names=True)
+    second = limb.create_limb(backend='plan', return_names=True)
+    assert limb_switch.limb_nodes('LeftArm') == \
+        limb_switch.limb_nodes('LeftArm', first)
+    nodes = limb_switch.limb_nodes('LeftArm', second)
+    assert nodes['top_group'] == second['LEFTARM'] != 'LEFTARM'
+    assert nodes['blend_ctrl'] == second['LeftArm_Control']
+    assert nodes['pv_ctrl'] == second['LeftArm_PV_Control']
+    for chain_type in ['IK', 'FK']:
+        assert nodes[chain_type.lower() + '_chain'] == [
+            second['{}_{}_Joint'.format(joint, chain_type)]
+            for joint, _ in GUIDES]
+    assert nodes['fk_ctrls'] == [second[joint + '_FK_Control']
+                                 for joint, _ in GUIDES]
+
+
+# Poses set on a control under an offset parent and a moved top group are
+# solved back from where a point in its space lands, all frames at once.
+# The fake scene leaves pivots out, so the control's pivot stays at zero.
+def test_solve_control_recovers_known_poses(scene):
+    top = scene.createNode('transform', name='TOP')
+    scene.xform(top, translation=(1, 2, 3), rotation=(0, 30, 0))
+    group = scene.createNode('transform', name='GROUP', parent=top)
+    scene.xform(group, translation=(0, 4, 0), rotation=(15, 0, 0))
+    ctrl = scene.createNode('transform', name='CTRL', parent=group)
+    scene.setAttr(ctrl + '.offsetParentMatrix', limb_utils.compose_matrix(
+        (2, 0, 1), (0, 0, 40)), type='matrix')
+    data = limb_switch._control_data(ctrl, top)
+    origin = np.array([1.0, -0.5, 2.0])
+    targets = []
+    rotations = []
+    for translate, rotate in POSES:
+        scene.xform(ctrl, translation=translate, rotation=rotate)
+        world = _world(scene, ctrl)
+        targets.append(np.append(origin, 1.0) @ world)
+        rotations.append(limb_switch._rotation(world))
+    tops = np.array([_world(scene, top)] * len(POSES))
+    translate, rotate = limb_switch._solve_control(
+        data, tops, np.array(targets)[:, :3], origin, np.array(rotations))
+    assert np.allclose(translate, [pose[0] for pose in POSES])
+    assert np.allclose(rotate, [pose[1] for pose in POSES])
+
+
+# Bent frames place the pole vector out from the elbow in the limb's plane,
+# straight ones keep the last bent direction, -Z before the first
+def test_pole_vector_positions():
+    positions = np.array([
+        [(0, 0, 0), (2, 0, 0), (4, 0, 0)],
+        [(0, 0, 0), (1, 0, -1), (2, 0, 0)],
+        [(0, 0, 0), (0, 3, 1), (0, 6, 0)],
+        [(0, 0, 0), (0, 1, 0), (0, 2, 0)]], dtype=float)
+    targets = limb_switch.pole_vector_positions(positions, 2.0)
+    assert np.allclose(targets, [(2, 0, -2), (1, 0, -3), (0, 3, 3),
+                                 (0, 1, 2)])
@@ -0,0 +1,56 @@
+import lrig.cmds_proxy as cmds_proxy
+import lrig.limb_template as limb_template
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('Shoulder', (2, 15, 0)), ('Elbow', (5, 15, -1)),
+          ('Wrist', (8, 15, 0)), ('PV', (5, 15, -5))]
+
+
+def _guides(scene, index):
+    names = []
+    for part, (x, y, z) in GUIDES:
+        scene.select(clear=True)
+        names.append(scene.joint(name='Left{}{}_guide'.format(part, index),
+                                 position=(x, y + index, z + index * 10)))
+    return names
+
+
+# A stamp copies every tagged node once under allocated names, shares the
+# template's solver and places the copy like a fresh plan would
+def test_stamp_copies_onto_new_guides(scene):
+    guides = _guides(scene, 0)
+    template = limb_template.create_template(joints=guides[:3],
+                                             pole_vector=guides[3])
+    others = _guides(scene, 1)
+    before = len(scene.ls())
+    with cmds_proxy.instrumented() as proxy:
+        names = template.stamp(others)
+    commands = proxy.report()['totals']['commands']
+    assert 'rename' not in commands
+
+    assert sorted(names) == sorted(template.names)
+    assert len(scene.ls()) - before == len(template.names) + 1
+    assert names['LEFTARM'] == 'LEFTARM1'
+    assert not set(names.values()) & set(template.names.values())
+    assert all(scene.objExists(name) for name in names.values())
+    assert scene.ls(type='ikRPsolver') == ['ikRPsolver']
+    assert scene.listConnections(names['LeftArmIK_Handle'] + '.ikSolver') \
+        == ['ikRPsolver']
+    assert scene.ls(type='network') == ['LeftArm_template_NET',
+                                        'LeftArm_template_NET1']
+
+    plan = rig_plan.plan_limb(
+        joints=template.guides[:3], pole_vector=template.guides[3],
+        guide_matrices=dict(zip(template.guides,
+                                [scene.xform(g, query=True, worldSpace=True,
+                                             matrix=True) for g in others])),
+        **template.options)
+    planned = dict(plan.values)
+    for plug, value in limb_template.placement_values(plan).items():
+        if plug not in planned:  # Constraint offsets aren't kept headless
+            continue
+        node, _, attr = plug.partition('.')
+        stamped = scene.getAttr(names[node] + '.' + attr)
+        if isinstance(value, (list, tuple)) and len(value) == 3:
+            stamped = stamped[0]
+        assert limb_template._same(stamped, value), plug
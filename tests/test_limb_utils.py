@@ -0,0 +1,219 @@
+import pytest
+
+import lrig.limb_utils as limb_utils
+
+ROTATIONS = [(0, 0, 0), (30, 0, 0), (0, -45, 0), (0, 0, 120),
+             (10, 20, 30), (-75, 60, -150), (170, -10, 95)]
+
+
+def assert_matrix(actual, expected, tolerance=1e-6):
+    assert len(actual) == 16
+    assert actual == pytest.approx(expected, abs=tolerance)
+
+
+@pytest.mark.parametrize('rotation', ROTATIONS)
+def test_compose_euler_round_trip(rotation):
+    matrix = limb_utils.compose_matrix((1, -2, 3), rotation)
+    assert limb_utils.get_euler_rotation(matrix) == \
+        pytest.approx(rotation, abs=1e-6)
+    assert limb_utils.get_translation(matrix) == [1, -2, 3]
+
+
+def test_euler_gimbal_lock_keeps_the_matrix():
+    matrix = limb_utils.compose_matrix((0, 0, 0), (25, 90, 40))
+    euler = limb_utils.get_euler_rotation(matrix)
+    assert euler[2] == 0.0
+    assert_matrix(limb_utils.compose_matrix((0, 0, 0), euler), matrix)
+
+
+def test_inverse_matrix():
+    matrix = limb_utils.compose_matrix((4, 5, -6), (10, 20, 30))
+    assert_matrix(limb_utils.mult_matrix(matrix,
+                                         limb_utils.inverse_matrix(matrix)),
+                  limb_utils.IDENTITY_MATRIX)
+
+
+def test_offset_matrix_places_child_under_parent():
+    parent = limb_utils.compose_matrix((1, 2, 3), (0, 90, 0))
+    child = limb_utils.compose_matrix((5, 2, 0), (45, 0, 10))
+    offset = limb_utils.offset_matrix(child, parent)
+    assert_matrix(limb_utils.mult_matrix(offset, parent), child)
+    assert limb_utils.offset_matrix(child) == child
+
+
+def test_orthonormal_matrix_drops_scale():
+    matrix = limb_utils.compose_matrix((1, 2, 3), (10, 20, 30))
+    scaled = [v * 2.0 for v in matrix[:12]] + matrix[12:]
+    assert_matrix(limb_utils.orthonormal_matrix(scaled), matrix)
+
+
+def test_snap_matches_world_matrix(scene):
+    target = scene.createNode('transform', name='target')
+    dest = scene.createNode('transform', name='dest')
+    scene.xform(dest, worldSpace=True, translation=(1, 2, 3),
+                rotation=(10, 20, 30))
+    limb_utils.snap(target, dest)
+    assert_matrix(limb_utils.world_matrix(target),
+                  limb_utils.world_matrix(dest))
+
+
+def test_snap_frozen_joint_stores_orientation(scene):
+    parent = scene.createNode('transform', name='parent')
+    scene.xform(parent, worldSpace=True, translation=(0, 5, 0),
+                rotation=(0, 0, 90))
+    joint = scene.createNode('joint', name='joint', parent=parent)
+    dest = scene.createNode('transform', name='dest')
+    scene.xform(dest, worldSpace=True, translation=(2, 3, 4),
+                rotation=(0, 45, 0))
+    limb_utils.snap(joint, dest, freeze_transform=True)
+    assert scene.getAttr(joint + '.rotate')[0] == (0, 0, 0)
+    assert_matrix(limb_utils.world_matrix(joint),
+                  limb_utils.world_matrix(dest))
+
+
+def test_align_lras_zeroes_control_on_joint(scene):
+    joint = scene.createNode('joint', name='joint')
+    scene.xform(joint, worldSpace=True, translation=(3, 1, 0),
+                rotation=(0, 0, 30))
+    ctrl = scene.createNode('transform', name='ctrl')
+    scene.xform(ctrl, worldSpace=True, translation=(7, 7, 7))
+    assert limb_utils.align_lras(snap_align=True, sel=[ctrl, joint]) == ctrl
+    assert scene.getAttr(ctrl + '.translate')[0] == \
+        pytest.approx((0, 0, 0))
+    assert_matrix(limb_utils.world_matrix(ctrl),
+                  limb_utils.world_matrix(joint))
+
+
+# Without snap_align the offset from the joint is frozen into the control,
+# which leaves its axes on the joint's
+def test_align_lras_freezes_control_onto_joint(scene):
+    parent = scene.createNode('transform', name='parent')
+    scene.xform(parent, worldSpace=True, translation=(0, 0, 2))
+    joint = scene.createNode('joint', name='joint')
+    scene.xform(joint, worldSpace=True, translation=(3, 1, 0),
+                rotation=(0, 0, 30))
+    ctrl = scene.createNode('transform', name='ctrl', parent=parent)
+    scene.xform(ctrl, worldSpace=True, translation=(3, 2, 0),
+                rotation=(0, 0, 30))
+    limb_utils.align_lras(sel=[ctrl, joint])
+    assert scene.getAttr(ctrl + '.translate')[0] == \
+        pytest.approx((0, 0, 0))
+    assert scene.getAttr(ctrl + '.rotate')[0] == pytest.approx((0, 0, 0))
+    assert_matrix(limb_utils.world_matrix(ctrl),
+                  limb_utils.world_matrix(joint))
+
+
+def test_distance(scene):
+    a = scene.createNode('transform', name='a')
+    b = scene.createNode('transform', name='b')
+    scene.xform(b, worldSpace=True, translation=(3, 4, 0))
+    assert limb_utils.distance(a, b) == pytest.approx(5.0)
+
+
+def _at(position):
+    return limb_utils.compose_matrix(position, (0, 0, 0))
+
+
+def test_stretch_scales_rest_within_length():
+    assert limb_utils.stretch_scales(_at((0, 0, 0)), _at((5, 0, 0)), 3, 4) \
+        == pytest.approx((1.0, 1.0))
+
+
+def test_stretch_scales_stretches_past_length():
+    assert limb_utils.stretch_scales(_at((0, 0, 0)), _at((14, 0, 0)), 3, 4) \
+        == pytest.approx((2.0, 2.0))
+
+
+# stretch blends toward the full stretch, the bone offsets add on top and
+# global scale lengthens the chain before it stretches
+@pytest.mark.parametrize('options, expected', [
+    ({'stretch': 0.0}, (1.0, 1.0)),
+    ({'stretch': 0.5}, (1.5, 1.5)),
+    ({'upper': 1.5, 'lower': 0.5}, (2.5, 1.5)),
+    ({'global_scale': 2.0}, (1.0, 1.0)),
+    ({'global_scale': 0.5}, (4.0, 4.0))])
+def test_stretch_scales_options(options, expected):
+    assert limb_utils.stretch_scales(_at((0, 0, 0)), _at((14, 0, 0)), 3, 4,
+                                     **options) == pytest.approx(expected)
+
+
+def test_stretch_scales_measures_between_pivots():
+    start = limb_utils.compose_matrix((0, 0, 0), (0, 0, 90))
+    scales = limb_utils.stretch_scales(start, _at((14, 0, 0)), 3, 4,
+                                       start_pivot=(0, 7, 0))
+    assert scales == pytest.approx((3.0, 3.0))
+
+
+# A session leaves refresh and the evaluation manager the way it found
+# them, and its undo chunk closed
+@pytest.mark.parametrize('suspended, mode', [(False, 'parallel'),
+                                             (True, 'parallel'),
+                                             (False, 'off')])
+def test_build_session_restores_scene_state(scene, suspended, mode):
+    scene.refresh(suspend=suspended)
+    scene.evaluationManager(mode=mode)
+    with limb_utils.build_session('Build'):
+        assert scene.refresh_suspended
+        assert scene.evaluation_mode == 'off'
+        assert scene.undo_chunks == 1
+    assert scene.refresh_suspended == suspended
+    assert scene.evaluation_mode == mode
+    assert scene.undo_chunks == 0
+
+
+# A failed build deletes what it made and nothing else. With patterns that
+# is only the names it allocated.
+@pytest.mark.parametrize('patterns', [None, ['LEFTARM']])
+def test_build_session_rolls_back(scene, patterns):
+    scene.createNode('transform', name='Existing')
+    with pytest.raises(ValueError):
+        with limb_utils.build_session('Build', patterns=patterns):
+            scene.createNode('transform',
+                             name=limb_utils.unique_name('LEFTARM'))
+            scene.createNode('transform', name='Other')
+            raise ValueError("Build failed")
+    remaining = ['Existing'] + (['Other'] if patterns else [])
+    assert sorted(scene.ls(type='transform')) == remaining
+    assert not scene.refresh_suspended
+    assert scene.undo_chunks == 0
+
+    with pytest.raises(ValueError):
+        with limb_utils.build_session('Build', rollback=False):
+            scene.createNode('transform', name='Kept')
+            raise ValueError("Build failed")
+    assert scene.objExists('Kept')
+
+
+# Nested builds join the outer session: one undo chunk, one refresh, steps
+# only counted at the top, and a failure inside rolls back the whole build
+def test_nested_build_sessions(scene):
+    phases = []
+    cancel = [False]
+
+    def progress(phase, index, total):
+        phases.append((phase, index, total))
+        return cancel[0]
+
+    with limb_utils.build_session('Outer', ['a', 'b'], progress) as outer:
+        limb_utils.build_step('a')
+        with limb_utils.build_session('Inner') as inner:
+            assert inner is outer and outer.depth == 1
+            scene.createNode('transform', name='Inner_GRP')
+            limb_utils.build_step('inner')
+            assert scene.undo_chunks == 1
+        assert outer.depth == 0 and scene.refresh_suspended
+        limb_utils.build_step('b')
+    assert phases == [('a', 1, 2), ('a', 1, 2), ('b', 2, 2)]
+    assert scene.objExists('Inner_GRP')
+    assert (scene.undo_chunks, scene.refresh_suspended) == (0, False)
+
+    with pytest.raises(limb_utils.BuildCancelled):
+        with limb_utils.build_session('Outer', progress=progress):
+            scene.createNode('transform', name='Outer_GRP')
+            with limb_utils.build_session('Inner'):
+                scene.createNode('transform', name='Cancelled_GRP')
+                cancel[0] = True
+                limb_utils.build_step('inner')
+    assert not scene.objExists('Outer_GRP')
+    assert not scene.objExists('Cancelled_GRP')
+    assert (scene.undo_chunks, scene.refresh_suspended) == (0, False)
@@ -0,0 +1,37 @@
+import pytest
+
+import lrig.limb as limb
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+
+
+@pytest.fixture
+def guides(scene):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    return scene
+
+
+# Every node of a second build is numbered the way its names were
+# allocated, effectors included
+@pytest.mark.parametrize('backend', ['cmds', 'plan'])
+def test_rebuild_allocates_every_name(guides, backend):
+    limb.create_limb(backend=backend)
+    names = limb.create_limb(backend=backend, return_names=True)
+    assert names['LEFTARM'] == 'LEFTARM1'
+    assert names['LeftArmIK_Handle_effector'] == \
+        'LeftArmIK_Handle_effector1'
+    assert sorted(guides.ls(type='ikEffector')) == \
+        ['LeftArmIK_Handle_effector', 'LeftArmIK_Handle_effector1']
+    assert set(names.values()) <= set(guides.ls())
+
+
+def test_unknown_joint_is_a_build_error(guides):
+    with pytest.raises(RuntimeError, match="No alias for LeftHand"):
+        limb.create_limb(joints=['LeftShoulder', 'LeftElbow', 'LeftHand'])
+    assert guides.ls('LEFTARM*') == []
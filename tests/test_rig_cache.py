@@ -0,0 +1,132 @@
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+import lrig.limb_utils as limb_utils
+import lrig.rig_cache as rig_cache
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0))]
+OPTIONS = {'side': 'L', 'limb': 'arm',
+           'joints': ['LeftShoulder', 'LeftElbow', 'LeftWrist'],
+           'aliases': {'LeftShoulder': 'Shoulder', 'LeftElbow': 'Elbow',
+                       'LeftWrist': 'Wrist'},
+           'pole_vector': 'LeftShoulder_PV', 'primary_axis': 'X',
+           'up_axis': 'Y', 'del_guides': False, 'stretch': True,
+           'color_dict': {}, 'blend_mode': 'blendColors',
+           'stretch_node': False}
+PATTERNS = rig_plan.name_patterns('Left', 'arm',
+                                  ['Shoulder', 'Elbow', 'Wrist'])
+
+
+def _plan():
+    plan = rig_plan.RigPlan('LeftArm')
+    plan.add_node('LEFTARM', 'transform')
+    return plan
+
+
+@pytest.fixture
+def guides(scene):
+    parent = None
+    for name, position in GUIDES:
+        parent = scene.createNode('joint', name=name, parent=parent)
+        scene.xform(parent, worldSpace=True, translation=position)
+    pole_vector = scene.createNode('transform', name='LeftShoulder_PV')
+    scene.xform(pole_vector, worldSpace=True, translation=(5, 15, -5))
+    return scene
+
+
+def _build(cache, **options):
+    with limb_utils.unique_names(PATTERNS):
+        return rig_cache.cached_build(cache, rig_plan.apply_plan,
+                                      rig_plan.load_script,
+                                      **dict(OPTIONS, **options))
+
+
+def _scene(scene):
+    return dict((name, scene.nodeType(name)) for name in scene.ls())
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = rig_cache.RigCache(str(tmp_path))
+    cache.put('key', _plan(), 0.5)
+    entry = cache.get('key')
+    assert entry['script'] == rig_plan.plan_script(_plan())
+    assert entry['planned'] == ['LEFTARM']
+    assert cache.get('other') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['seconds_building'] == 0.5
+
+
+# An entry missing its fields is a miss and is removed, not an error
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = rig_cache.RigCache(str(tmp_path))
+    entries = [{'key': 'a'}, {'script': 1, 'planned': [], 'outputs': {},
+                              'seconds': 0.0}, [1]]
+    for i, entry in enumerate(entries):
+        key = 'bad{}'.format(i)
+        with gzip.open(cache.path(key), 'wt') as f:
+            json.dump(entry, f)
+        assert cache.get(key) is None
+    assert cache.misses == 3
+    assert cache.entries() == []
+
+
+# Once the entries outgrow max_bytes the least recently used go first, and
+# reading an entry counts as using it
+def test_evicts_least_recently_used_by_size(tmp_path):
+    cache = rig_cache.RigCache(str(tmp_path))
+    cache.put('a', _plan(), 0.0)
+    size = cache.size()
+    cache.max_bytes = size * 2 + size // 2
+    cache.put('b', _plan(), 0.0)
+    now = time.time()
+    os.utime(cache.path('a'), (now - 20, now - 20))
+    os.utime(cache.path('b'), (now - 10, now - 10))
+    assert cache.get('a') is not None
+    cache.put('c', _plan(), 0.0)
+    assert sorted(os.path.basename(path) for _, _, path in cache.entries()) \
+        == ['a' + rig_cache.ENTRY_SUFFIX, 'c' + rig_cache.ENTRY_SUFFIX]
+    assert cache.evictions == 1
+    assert cache.size() <= cache.max_bytes
+
+
+# A hit loads the same rig a miss built, and reports what it saved
+def test_hit_rebuilds_the_rig(guides, tmp_path):
+    names, outputs = _build(str(tmp_path))
+    built = _scene(guides)
+    for name in names.values():
+        if guides.objExists(name):
+            guides.delete(name)
+    hit_names, hit_outputs = _build(str(tmp_path))
+    assert (hit_names, hit_outputs) == (names, outputs)
+    assert _scene(guides) == built
+    stats = rig_cache.open_cache(str(tmp_path)).stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['seconds_saved'] == pytest.approx(
+        stats['seconds_building'] - stats['seconds_loading'])
+
+
+@pytest.mark.parametrize('option, value', [
+    ('del_guides', True), ('color_dict', {'L': 6}), ('primary_axis', 'Y'),
+    ('up_axis', 'Z'), ('stretch', False), ('blend_mode', 'blendMatrix')])
+def test_key_changes_with_each_option(option, value):
+    matrices = {'LeftShoulder': limb_utils.compose_matrix((2, 15, 0),
+                                                          (0, 0, 0))}
+    guides = ['LeftShoulder']
+    key = rig_cache.build_key(matrices, guides, OPTIONS)
+    assert rig_cache.build_key(matrices, guides, dict(OPTIONS)) == key
+    assert rig_cache.build_key(matrices, guides,
+                               dict(OPTIONS, **{option: value})) != key
+
+
+def test_moved_guide_is_a_miss(guides, tmp_path):
+    _build(str(tmp_path))
+    guides.xform('LeftShoulder_PV', worldSpace=True, translation=(5, 15, -6))
+    _build(str(tmp_path))
+    assert rig_cache.open_cache(str(tmp_path)).misses == 2
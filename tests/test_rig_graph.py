@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import lrig.limb_utils as limb_utils
+import lrig.rig_graph as rig_graph
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0)), ('LeftShoulder_PV', (5, 15, -5))]
+JOINTS = ['LeftShoulder_Bind_Joint', 'LeftElbow_Bind_Joint',
+          'LeftWrist_Bind_Joint']
+
+
+def _plan(**options):
+    return rig_plan.plan_limb(guide_matrices=dict(
+        (name, limb_utils.compose_matrix(position, (0, 0, 0)))
+        for name, position in GUIDES), **options)
+
+
+# A_Control -> A -> B <-> C -> A_Bind_Joint, with D on its own
+def _graph():
+    graph = rig_graph.RigGraph()
+    graph.add_node('A_Control', 'transform')
+    for name in 'ABCD':
+        graph.add_node(name, 'multiplyDivide')
+    graph.add_node('A_Bind_Joint', 'joint', 'A_Control')
+    graph.connect('A_Control.translateX', 'A.input1X')
+    graph.connect('A.outputX', 'B.input1X')
+    graph.connect('B.outputX', 'C.input1X')
+    graph.connect('C.outputX', 'B.input2X')
+    graph.connect('C.outputY', 'A_Bind_Joint.rotateY')
+    return graph
+
+
+def test_cycles_are_strongly_connected_components():
+    upstream = {'b': {'a'}, 'c': {'b'}, 'a': {'c'}, 'e': {'d', 'a'},
+                'd': {'e'}, 'f': {'e'}}
+    assert sorted(rig_graph._cycles('abcdefg', upstream)) == \
+        [['a', 'b', 'c'], ['d', 'e']]
+    assert rig_graph._cycles('abc', {'b': {'a'}, 'c': {'b'}}) == []
+
+
+# A cycle is one step of a path, listed by its nodes
+def test_depth_collapses_cycles():
+    report = rig_graph.analyze(_graph())
+    assert report['bind_depth'] == {'A_Bind_Joint': {
+        'length': 3, 'path': ['A_Control', 'A', ['B', 'C'],
+                              'A_Bind_Joint']}}
+    assert report['max_depth'] == 3
+    assert report['serial_blockers'] == [{
+        'pattern': 'cycle', 'nodes': ['B', 'C'],
+        'detail': "The evaluation manager runs a cycle as one serial "
+                  "cluster"}]
+
+
+@pytest.mark.parametrize('fan_out, plugs', [
+    (rig_graph.FAN_OUT_THRESHOLD, ['A.outputX']),
+    (3, ['A.outputX', 'A.outputY']), (6, [])])
+def test_fan_out_threshold(fan_out, plugs):
+    graph = rig_graph.RigGraph()
+    for i in range(5):
+        graph.add_node('N{}'.format(i), 'transform')
+        graph.connect('A.outputX', 'N{}.translateX'.format(i))
+        if i < 3:
+            graph.connect('A.outputY', 'N{}.translateY'.format(i))
+    hotspots = rig_graph.analyze(graph, fan_out)['fan_out']
+    assert [hotspot['plug'] for hotspot in hotspots] == plugs
+
+
+def test_round_trip():
+    graph = rig_graph.plan_graph(_plan())
+    data = json.loads(json.dumps(graph.to_dict()))
+    copy = rig_graph.RigGraph.from_dict(data)
+    assert copy.nodes == graph.nodes
+    assert copy.parents == graph.parents
+    assert copy.connections == graph.connections
+    assert rig_graph.analyze(copy) == rig_graph.analyze(graph)
+
+
+# The blend control follows the wrist while its switch drives the blend
+# nodes. That node level loop is reported on its own rather than as a
+# cycle holding every bind joint, so each joint keeps its own depth.
+@pytest.mark.parametrize('options', [{}, {'stretch': False},
+                                     {'blend_mode': 'blendMatrix'}])
+def test_plan_reports_the_blend_control_feedback(options):
+    graph = rig_graph.plan_graph(_plan(**options))
+    report = rig_graph.analyze(graph)
+    blockers = report['serial_blockers']
+    assert [blocker['pattern'] for blocker in blockers] == \
+        ['control_feedback']
+    blocker = blockers[0]
+    assert blocker['nodes'][-2:] == ['LeftArm_Control_parentConstraint1',
+                                     'LeftArm_Control']
+    assert 'LeftWrist_Bind_Joint' in blocker['nodes']
+    lengths = [report['bind_depth'][joint]['length'] for joint in JOINTS]
+    assert lengths == sorted(set(lengths))
+    assert report['max_depth'] == lengths[-1]
+    for joint in JOINTS:
+        path = report['bind_depth'][joint]['path']
+        assert path[0].endswith('_Control') and path[-1] == joint
+        assert all(isinstance(step, str) for step in path)
@@ -0,0 +1,102 @@
+import re
+
+import pytest
+
+import lrig.limb_utils as limb_utils
+import lrig.rig_plan as rig_plan
+
+GUIDES = [('LeftShoulder', (2, 15, 0)), ('LeftElbow', (5, 15, -1)),
+          ('LeftWrist', (8, 15, 0)), ('LeftShoulder_PV', (5, 15, -5))]
+# Lines of a plan_script() script that give a node its name
+NAMING = re.compile(r'^(?:createNode \w+|ikHandle|\w+Constraint.*?) -name '
+                    r'"([^"]*)"|^rename .* "([^"]*)";$')
+
+
+def _plan(**options):
+    return rig_plan.plan_limb(guide_matrices=dict(
+        (name, limb_utils.compose_matrix(position, (0, 0, 0)))
+        for name, position in GUIDES), **options)
+
+
+def _outside_plan():
+    plan = rig_plan.RigPlan('Outside')
+    plan.add_node('Outside_GRP', 'transform', 'SCENE_GRP')
+    plan.add_node('Outside_Joint', 'joint', 'Outside_GRP')
+    return plan
+
+
+# Every backend creates a node in one go under its final parent, so a
+# parent is either outside the plan or planned before its children, and
+# everything else refers only to planned names
+@pytest.mark.parametrize('options', [{}, {'stretch': False},
+                                     {'blend_mode': 'blendMatrix'}])
+def test_plan_orders_parents_first(options):
+    plan = _plan(**options)
+    planned = rig_plan.planned_names(plan)
+    assert len(planned) == len(set(planned))
+    seen = set()
+    for node in plan.nodes:
+        assert node['parent'] is None or node['parent'] in seen, node
+        seen.add(node['name'])
+    used = [plug for pair in plan.connections for plug in pair]
+    used += [plug for plug, _ in plan.values] + list(plan.shapes)
+    used += [attr['node'] for attr in plan.attributes]
+    for handle in plan.ik_handles:
+        used += [handle['startJoint'], handle['endEffector'],
+                 handle['parent']]
+    for constraint in plan.constraints:
+        used += [constraint['driver'], constraint['driven']]
+    for plug in used:
+        assert plug.partition('.')[0] in planned, plug
+
+
+# The script names every planned name once, handles before their
+# effectors, and uses a name only after the line that makes it
+def test_plan_script_names_before_use():
+    plan = _plan()
+    named = []
+    for line in rig_plan.plan_script(plan).splitlines():
+        match = NAMING.match(line)
+        if match:
+            named.append(match.group(1) or match.group(2))
+        for name in re.findall(r'"([^"]*)"', line):
+            assert name.partition('.')[0] in named, line
+    assert named == rig_plan.planned_names(plan)
+
+
+def test_rename_script_swaps_nodes_and_plugs():
+    script = 'connectAttr "A.tx" "B.ty";\nsetAttr "A.v" 0;\nparent "C" "A";'
+    assert rig_plan.rename_script(script, {'A': 'A1', 'B': 'B|x'}) == \
+        'connectAttr "A1.tx" "B|x.ty";\nsetAttr "A1.v" 0;\nparent "C" "A1";'
+
+
+# Applied or loaded, a plan gives back every planned name
+def test_backends_return_every_planned_name(scene):
+    plan = _plan()
+    planned = rig_plan.planned_names(plan)
+    names = rig_plan.apply_plan(plan)
+    assert sorted(names) == sorted(planned)
+    assert all(scene.objExists(name) for name in names.values())
+    scene.file(new=True)
+    loaded = rig_plan.load_script(rig_plan.plan_script(plan), planned)
+    assert loaded == names
+
+
+# A parent outside the plan is found in the scene, a missing one is an
+# error rather than a node left at the world
+def test_parents_outside_the_plan(scene):
+    plan = _outside_plan()
+    planned = rig_plan.planned_names(plan)
+    for build in [rig_plan.apply_plan, lambda plan: rig_plan.load_script(
+            rig_plan.plan_script(plan), planned)]:
+        scene.file(new=True)
+        with pytest.raises((RuntimeError, ValueError)):
+            build(plan)
+        scene.file(new=True)
+        scene.createNode('transform', name='SCENE_GRP')
+        names = build(plan)
+        assert scene.listRelatives(names['Outside_GRP'], parent=True) == \
+            ['SCENE_GRP']
+        assert scene.listRelatives(names['Outside_Joint'], parent=True) == \
+            [names['Outside_GRP']]
+
@@ -0,0 +1,52 @@
+import pytest
+
+import lrig.limb as limb
+import lrig.limb_utils as limb_utils
+
+
+# Has every new control's world matrix cached at the origin, like any
+# query made before the control is placed would
+@pytest.fixture
+def cached_controls(monkeypatch):
+    create_control = limb_utils.create_control
+
+    def create_and_query(*args, **kwargs):
+        ctrl = create_control(*args, **kwargs)
+        limb_utils.world_matrix(ctrl)
+        return ctrl
+    monkeypatch.setattr(limb_utils, 'create_control', create_and_query)
+
+
+def _joint(scene, name, position, parent=None):
+    joint = scene.createNode('joint', name=name, parent=parent)
+    scene.xform(joint, worldSpace=True, translation=position)
+    return joint
+
+
+# Controls placed through offsetParentMatrix inside a cached build have to
+# read back where they were placed
+def test_blend_control_placement_invalidates(scene, cached_controls):
+    joint = _joint(scene, 'LeftWrist_Bind_Joint', (8, 15, 0))
+    with limb_utils.transform_cache():
+        ctrl = limb.create_blend_control(2, 'Y', joint, 'LeftArm')
+        cached = limb_utils.world_matrix(ctrl)
+    assert limb_utils.get_translation(cached) == pytest.approx([8, 18, 0])
+
+
+def test_ik_control_placement_invalidates(scene, cached_controls):
+    joints = []
+    for name, position in [('Shoulder', (2, 15, 0)), ('Elbow', (5, 15, -1)),
+                           ('Wrist', (8, 15, 0))]:
+        joints.append(_joint(scene, 'Left' + name + '_IK_Joint', position,
+                             joints[-1] if joints else None))
+    pole_vector = _joint(scene, 'pv', (5, 15, -5))
+    with limb_utils.transform_cache():
+        limb.create_ik_controls_and_handle('LeftArm', joints, pole_vector)
+        cached = dict((name, limb_utils.world_matrix(name))
+                      for name in ['LeftArm_IK_Control',
+                                   'LeftArm_PV_Control',
+                                   'LeftArm_Base_Control'])
+    for name, matrix in cached.items():
+        assert matrix == pytest.approx(limb_utils.world_matrix(name))
+    assert limb_utils.get_translation(cached['LeftArm_PV_Control']) == \
+        pytest.approx([5, 15, -5])